@@ -0,0 +1,81 @@
+import os
+
+from fastapi import APIRouter, HTTPException
+
+from app.api.segment import _check_memory, _check_postprocess, _job_fingerprint, _run_job
+from app.schemas.jobs import CohortRequest, CohortResponse, CohortStudy, SegmentRequest
+from app.services.cohort import batch_summary, batches, enqueue_studies, find_dicom_series
+from app.services.jobs import jobs
+from app.services.storage import ingest_local_directory, list_dicom_files, study_store
+
+
+router = APIRouter(prefix="/cohort", tags=["cohort"])
+
+
+def _segment_request(req: CohortRequest, study_id: str) -> SegmentRequest:
+    return SegmentRequest(
+        study_id=study_id,
+        threshold=req.threshold,
+        classifier_scan=req.classifier_scan,
+        classifier_batch_size=req.classifier_batch_size,
+        classifier_coarse_stride=req.classifier_coarse_stride,
+        use_cache=req.use_cache,
+        postprocess=req.postprocess,
+        memory_budget_mb=req.memory_budget_mb,
+        slice_storage=req.slice_storage,
+    )
+
+
+@router.post("/start", response_model=CohortResponse)
+def start_cohort(req: CohortRequest) -> CohortResponse:
+    """
+    Ingest every DICOM series under a root directory and queue segmentation for all of them.
+    Poll /cohort/{batch_id}/status for aggregate progress.
+    """
+    if not os.path.isdir(req.root):
+        raise HTTPException(status_code=400, detail="root must be an existing directory")
+    if req.classifier_scan not in (None, "full", "bidirectional"):
+        raise HTTPException(status_code=400, detail="classifier_scan must be 'full' or 'bidirectional'")
+    _check_postprocess(req.postprocess)
+    _check_memory(req.memory_budget_mb, req.slice_storage)
+
+    studies = []
+    requests = {}
+    for series_dir in find_dicom_series(req.root, recursive=bool(req.recursive)):
+        # Each ingest is a new study, so an identical resubmission is matched through the
+        # study last ingested from this series; otherwise it gets a study of its own as before
+        study_id = study_store.find_by_source(series_dir)
+        job_id = jobs.reusable(_job_fingerprint(study_id, _segment_request(req, study_id))) if study_id else None
+        if job_id is not None:
+            studies.append({
+                "study_id": study_id, "job_id": job_id, "source": series_dir,
+                "files": len(list_dicom_files(series_dir)), "reused": True,
+            })
+            continue
+        study_id, files = ingest_local_directory(series_dir)
+        seg_req = _segment_request(req, study_id)
+        job_id, created = jobs.create_or_reuse(
+            _job_fingerprint(study_id, seg_req), {"study_id": study_id, "model": None, "threshold": req.threshold}
+        )
+        # A reused job is queued or finished elsewhere; only new ones run here
+        if created:
+            requests[job_id] = seg_req
+        studies.append({
+            "study_id": study_id, "job_id": job_id, "source": series_dir, "files": len(files), "reused": not created,
+        })
+
+    batch_id = batches.create({"root": os.path.abspath(req.root), "studies": studies})
+    enqueue_studies(
+        batch_id,
+        lambda job_id, study_id: _run_job(job_id, study_id, requests[job_id]),
+        [(s["job_id"], s["study_id"]) for s in studies if s["job_id"] in requests],
+    )
+    return CohortResponse(batch_id=batch_id, studies=[CohortStudy(**s) for s in studies])
+
+
+@router.get("/{batch_id}/status")
+async def cohort_status(batch_id: str):
+    summary = batch_summary(batch_id)
+    if summary is None:
+        raise HTTPException(status_code=404, detail="batch not found")
+    return summary
@@ -9,22 +9,67 @@ from fastapi.responses import FileResponse, StreamingResponse
 from PIL import Image
 from scipy.io import savemat
 
-from app.services.dicom import list_dicom_files
+from app.services.dicom import list_dicom_slices, slice_label
 from app.services.metadata import read_study_info, read_spacing_and_thickness_mm
-from app.services.storage import get_study_subdir, get_study_dicom_source_dir
+from app.services.morphology import study_morphology
+from app.services.cohort import batch_summary
+from app.services.export_csv import stream_cohort_csv, write_cohort_parquet
+from app.services.storage import get_study_subdir, get_study_dicom_source_dir, study_exists
 from app.services.images import ensure_png_slices
-from app.services.volume import compute_raw_areas
+from app.services.executors import run_cpu, run_io, run_process
+from app.services.export_xlsx import build_volumes_workbook
 
 
 router = APIRouter(prefix="/export", tags=["export"])
 
 
-@router.get("/{study_id}/images.zip")
-async def export_images(
-    study_id: str,
-    kind: Literal["overlays", "masks", "pngs"] = Query("overlays", description="Export overlays, masks, or PNG images"),
-    prefix: str | None = Query(None, description="Optional filename prefix inside the ZIP"),
+def _cohort_parquet(ids: list, morphology: bool) -> io.BytesIO:
+    mem = io.BytesIO()
+    write_cohort_parquet(ids, mem, morphology=morphology)
+    mem.seek(0)
+    return mem
+
+
+@router.get("/cohort/volumes")
+async def export_cohort_volumes(
+    batch_id: str | None = Query(None, description="Export every study of a cohort batch"),
+    study_ids: str | None = Query(None, description="Comma-separated study ids"),
+    format: Literal["csv", "parquet"] = Query("csv"),
+    prefix: str | None = Query(None),
+    morphology: bool = Query(False, description="Add morphology columns, from already computed stats only"),
 ):
+    """
+    One row per slice across many studies: study tags, spacing, total volume and per-slice
+    areas. Built from stored areas and cached metadata; CSV rows stream as studies are read.
+    """
+    ids = [s.strip() for s in (study_ids or "").split(",") if s.strip()]
+    if batch_id:
+        summary = await run_io(batch_summary, batch_id)
+        if summary is None:
+            raise HTTPException(status_code=404, detail="batch not found")
+        ids += [s["study_id"] for s in summary["studies"] if s["status"] == "done"]
+    if not ids:
+        raise HTTPException(status_code=400, detail="batch_id or study_ids required")
+    missing = await run_io(lambda: [s for s in ids if not study_exists(s)])
+    if missing:
+        raise HTTPException(status_code=404, detail=f"unknown studies: {', '.join(missing)}")
+
+    out_name = f"cohort_volumes.{format}"
+    if prefix:
+        out_name = f"{prefix}_" + out_name
+    headers = {"Content-Disposition": f"attachment; filename={out_name}"}
+    if format == "parquet":
+        try:
+            import pyarrow  # noqa: F401
+        except Exception:
+            raise HTTPException(status_code=500, detail="pyarrow not installed")
+        # Parquet needs the whole file before the footer is written; built off the event loop
+        mem = await run_cpu(_cohort_parquet, ids, morphology)
+        return StreamingResponse(mem, media_type="application/vnd.apache.parquet", headers=headers)
+    return StreamingResponse(stream_cohort_csv(ids, morphology=morphology), media_type="text/csv", headers=headers)
+
+
+def _build_images_zip(study_id: str, kind: str, prefix: str | None) -> io.BytesIO:
     if kind == "pngs":
         ensure_png_slices(study_id)
         target_dir = get_study_subdir(study_id, "png")
@@ -38,8 +83,7 @@ async def export_images(
 
     # Map indices to original DICOM-derived base names when available
     dicom_dir = get_study_dicom_source_dir(study_id)
-    dcm_files = list_dicom_files(dicom_dir)
-    dcm_bases = [os.path.splitext(n)[0] for n in dcm_files]
+    dcm_bases = [os.path.splitext(slice_label(s))[0] for s in list_dicom_slices(dicom_dir)]
 
     mem = io.BytesIO()
     with zipfile.ZipFile(mem, mode="w", compression=zipfile.ZIP_DEFLATED) as zf:
@@ -51,6 +95,16 @@ async def export_images(
                 arc_name = f"{prefix}_{arc_name}"
             zf.write(os.path.join(target_dir, name), arcname=arc_name)
     mem.seek(0)
+    return mem
+
+
+@router.get("/{study_id}/images.zip")
+async def export_images(
+    study_id: str,
+    kind: Literal["overlays", "masks", "pngs"] = Query("overlays", description="Export overlays, masks, or PNG images"),
+    prefix: str | None = Query(None, description="Optional filename prefix inside the ZIP"),
+):
+    mem = await run_cpu(_build_images_zip, study_id, kind, prefix)
     filename = "images.zip" if kind == "pngs" else f"{kind}.zip"
     if prefix:
         filename = f"{prefix}_" + filename
@@ -59,17 +113,9 @@ async def export_images(
     })
 
 
-@router.get("/{study_id}/volumes.xlsx")
-async def export_volumes_excel(study_id: str, prefix: str | None = Query(None)):
-    try:
-        import openpyxl
-        from openpyxl.utils import get_column_letter
-    except Exception as e:
-        raise HTTPException(status_code=500, detail="openpyxl not installed")
-
-    # Prepare data
+def _volumes_inputs(study_id: str, morphology: bool = False) -> dict:
     dicom_dir = get_study_dicom_source_dir(study_id)
-    dcm_files = list_dicom_files(dicom_dir)
+    dcm_files = [slice_label(s) for s in list_dicom_slices(dicom_dir)]
     if not dcm_files:
         raise HTTPException(status_code=404, detail="no slices found")
     masks_dir = get_study_subdir(study_id, "masks")
@@ -83,70 +129,41 @@ async def export_volumes_excel(study_id: str, prefix: str | None = Query(None)):
         arr = np.array(Image.open(p).convert('L'))
         raw_counts.append(int((arr > 127).sum()))
     pixel_spacing_mm, thickness_mm = read_spacing_and_thickness_mm(study_id)
-    meta = read_study_info(study_id)
-
-    # Build workbook with formulas
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = "Volumes"
-
-    # Metadata block
-    ws.append(["Study ID", study_id])
-    ws.append(["Patient ID", meta.get("patient_id", "")])
-    ws.append(["Study Date", meta.get("study_date", "")])
-    ws.append(["Pixel Spacing mm", f"{pixel_spacing_mm[0]}", f"{pixel_spacing_mm[1]}"])
-    px_row = ws.max_row
-    ws.append(["Slice Thickness mm", thickness_mm])
-    th_row = ws.max_row
-    ws.append(["Spacing Between Slices (mm)", meta.get("spacing_between_slices_mm", "")])
-    ws.append(["Image Height (px)", meta.get("height", "")])
-    ws.append(["Image Width (px)", meta.get("width", "")])
-    # Two blank rows before table
-    ws.append(["", "", ""])  # Empty row with 3 columns
-    ws.append(["", "", ""])  # Empty row with 3 columns
-
-    # Header for per-slice table
-    start_row = ws.max_row + 1
-    ws.cell(row=start_row, column=1, value="Slice (DICOM)")
-    ws.cell(row=start_row, column=2, value="Raw area (pixels)")
-    ws.cell(row=start_row, column=3, value="Scaled area (cc)")
-
-    # Constants cells for formulas (pixel spacing and thickness)
-    pxr, pxc = px_row, 2  # pixel spacing x at column B
-    pyr, pyc = px_row, 3  # pixel spacing y at column C
-    thr, thc = th_row, 2  # thickness at column B
-
-    for i, (name, raw) in enumerate(zip(dcm_files, raw_counts), start=1):
-        r = start_row + i
-        ws.cell(row=r, column=1, value=name)
-        ws.cell(row=r, column=2, value=raw)
-        # Formula: raw * thickness_mm * px * py / 1000
-        ws.cell(row=r, column=3, value=f"=B{r}*$B{thr}*$B{pxr}*$C{pyr}/1000")
-
-    # Total row
-    end_row = start_row + len(dcm_files)
-    ws.cell(row=end_row + 1, column=1, value="Total volume (cc)")
-    ws.cell(row=end_row + 1, column=3, value=f"=SUM(C{start_row+1}:C{end_row})")
-
-    # Autosize some columns
-    for col in range(1, 4):
-        letter = get_column_letter(col)
-        ws.column_dimensions[letter].width = 22
-
-    # Stream workbook
-    mem = io.BytesIO()
-    wb.save(mem)
-    mem.seek(0)
+    return {
+        "study_id": study_id,
+        "meta": read_study_info(study_id),
+        "pixel_spacing_mm": pixel_spacing_mm,
+        "thickness_mm": thickness_mm,
+        "dcm_files": dcm_files,
+        "raw_counts": raw_counts,
+        "morphology": study_morphology(study_id) if morphology else None,
+    }
+
+
+@router.get("/{study_id}/volumes.xlsx")
+async def export_volumes_excel(
+    study_id: str,
+    prefix: str | None = Query(None),
+    morphology: bool = Query(False, description="Add a Morphology sheet (computes it if the masks changed)"),
+):
+    try:
+        import openpyxl  # noqa: F401
+    except Exception as e:
+        raise HTTPException(status_code=500, detail="openpyxl not installed")
+
+    # Prepare data
+    inputs = await run_cpu(_volumes_inputs, study_id, morphology)
+    # openpyxl is pure Python and holds the GIL, so the workbook is built in a worker process
+    data = await run_process(build_volumes_workbook, **inputs)
     out_name = "volumes.xlsx"
     if prefix:
         out_name = f"{prefix}_" + out_name
-    return StreamingResponse(mem, media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", headers={
+    return StreamingResponse(io.BytesIO(data), media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", headers={
         "Content-Disposition": f"attachment; filename={out_name}"
     })
 
 
-@router.get("/{study_id}/images.npz")
-async def export_images_npz(study_id: str, prefix: str | None = Query(None)):
+def _build_images_npz(study_id: str) -> io.BytesIO:
     ensure_png_slices(study_id)
     png_dir = get_study_subdir(study_id, "png")
     files = [f for f in sorted(os.listdir(png_dir)) if f.lower().endswith('.png')]
@@ -161,6 +178,12 @@ async def export_images_npz(study_id: str, prefix: str | None = Query(None)):
     mem = io.BytesIO()
     np.savez_compressed(mem, images=vol)
     mem.seek(0)
+    return mem
+
+
+@router.get("/{study_id}/images.npz")
+async def export_images_npz(study_id: str, prefix: str | None = Query(None)):
+    mem = await run_cpu(_build_images_npz, study_id)
     out_name = "images.npz"
     if prefix:
         out_name = f"{prefix}_" + out_name
@@ -169,12 +192,7 @@ async def export_images_npz(study_id: str, prefix: str | None = Query(None)):
     })
 
 
-@router.get("/{study_id}/masks")
-async def export_masks(study_id: str, format: str = Query("npz", description="Export format: npz, mat"), prefix: str | None = Query(None)):
-    """
-    Export masks in various formats.
-    Supports NPZ (NumPy) and MAT (MATLAB) formats.
-    """
+def _build_masks_file(study_id: str, format: str) -> tuple:
     masks_dir = get_study_subdir(study_id, "masks")
     files = [f for f in sorted(os.listdir(masks_dir)) if f.lower().endswith('.png')]
     if not files:
@@ -207,6 +225,16 @@ async def export_masks(study_id: str, format: str = Query("npz", description="Ex
         media_type = "application/octet-stream"
     
     mem.seek(0)
+    return mem, file_extension, media_type
+
+
+@router.get("/{study_id}/masks")
+async def export_masks(study_id: str, format: str = Query("npz", description="Export format: npz, mat"), prefix: str | None = Query(None)):
+    """
+    Export masks in various formats.
+    Supports NPZ (NumPy) and MAT (MATLAB) formats.
+    """
+    mem, file_extension, media_type = await run_cpu(_build_masks_file, study_id, format)
     
     # Generate filename
     out_name = f"masks.{file_extension}"
@@ -220,5 +248,3 @@ async def export_masks(study_id: str, format: str = Query("npz", description="Ex
             "Content-Disposition": f"attachment; filename={out_name}"
         }
     )
-
-
@@ -1,64 +1,228 @@
+import gzip
+import hashlib
+import io
 import os
-from fastapi import APIRouter, HTTPException, Query
-from fastapi.responses import FileResponse
+from typing import Optional
 
-from app.services.images import ensure_png_slices, get_png_path
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import FileResponse, Response
+
+from app.services.images import ensure_png_slices, ensure_preview, get_png_path
+from app.services.preview import EXTENSIONS, MEDIA_TYPES, encoder_params, negotiate_format
 from app.services.overlay import overlay_mask_on_image
-from app.services.storage import get_study_subdir
+from app.services.storage import study_exists, study_store
+from app.services.thumbnails import FULL_LEVEL, render_montage
+from app.services.volume_cache import DTYPES, KINDS, VolumeBuildError, slice_range_payload
+from app.services.metrics import stage_timer
+from app.services.executors import run_io
+import numpy as np
 from PIL import Image
 
 
 router = APIRouter(prefix="/images", tags=["images"])
 
 
-@router.get("/{study_id}/{slice_index}.png")
-async def get_image(study_id: str, slice_index: int):
-    files = ensure_png_slices(study_id)
-    if slice_index < 1 or slice_index > len(files):
+def _image_path(study_id: str, slice_index: int, fmt: str) -> str:
+    path = ensure_preview(study_id, slice_index, fmt)
+    if path is None:
         raise HTTPException(status_code=404, detail="slice index out of range")
-    path = get_png_path(study_id, slice_index)
-    if not os.path.exists(path):
-        raise HTTPException(status_code=404, detail="image not found")
-    return FileResponse(path, media_type="image/png")
+    return path
 
 
-@router.get("/{study_id}/{slice_index}/overlay.png")
-async def get_overlay(
-    study_id: str,
-    slice_index: int,
-    alpha: float = Query(0.4, ge=0.0, le=1.0),
-    v: str = Query(None, description="Cache busting parameter"),
-):
+def _overlay_path(study_id: str, slice_index: int, alpha: float, refresh: bool, fmt: str) -> str:
     base_path = get_png_path(study_id, slice_index)
     if not os.path.exists(base_path):
         files = ensure_png_slices(study_id)
         if slice_index < 1 or slice_index > len(files):
             raise HTTPException(status_code=404, detail="slice index out of range")
-    # Load base and mask if present
-    base_img = Image.open(base_path).convert('L')
-    masks_dir = get_study_subdir(study_id, "masks")
-    mask_path = os.path.join(masks_dir, f"{slice_index}.png")
-    overlays_dir = get_study_subdir(study_id, "overlays")
-    overlay_path = os.path.join(overlays_dir, f"{slice_index}.png")
+    mask_path = study_store.mask_path(study_id, slice_index)
+    overlay_path = study_store.overlay_path(study_id, slice_index, EXTENSIONS[fmt])
 
     # Serve cached overlay if present (unless cache busting parameter is provided)
-    if os.path.exists(overlay_path) and not v:
-        return FileResponse(overlay_path, media_type="image/png")
+    if os.path.exists(overlay_path) and not refresh:
+        return overlay_path
 
     # If no mask yet, just return original
     if not os.path.exists(mask_path):
-        return FileResponse(base_path, media_type="image/png")
+        return _image_path(study_id, slice_index, fmt)
 
     # Generate and persist overlay
+    base_img = Image.open(base_path).convert('L')
     mask_img = Image.open(mask_path).convert('L')
-    import numpy as np
-    overlaid = overlay_mask_on_image(
-        np.array(base_img),
-        (np.array(mask_img) > 127).astype(np.uint8),
-        color_rgb=(0, 255, 0),  # Green overlay
-        alpha=alpha,
+    with stage_timer("overlay_render"):
+        overlaid = overlay_mask_on_image(
+            np.array(base_img),
+            (np.array(mask_img) > 127).astype(np.uint8),
+            color_rgb=(0, 255, 0),  # Green overlay
+            alpha=alpha,
+        )
+        study_store.write_overlay(study_id, slice_index, overlaid, EXTENSIONS[fmt], **encoder_params(fmt))
+    return overlay_path
+
+
+def _preview_response(path: str, fmt: str) -> FileResponse:
+    # The same URL serves PNG or WebP depending on Accept, so caches must key on it
+    return FileResponse(path, media_type=MEDIA_TYPES[fmt], headers={"Vary": "Accept"})
+
+
+def _montage(
+    study_id: str, level: str, start: int, end: Optional[int], columns: Optional[int], overlay: bool, alpha: float, fmt: str
+) -> Response:
+    if not study_exists(study_id):
+        raise HTTPException(status_code=404, detail="Study not found")
+    try:
+        rendered = render_montage(study_id, level, start, end, columns, overlay, alpha)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if rendered is None:
+        raise HTTPException(status_code=404, detail="Study has no slices")
+    img, layout = rendered
+    buf = io.BytesIO()
+    with stage_timer("preview_encode", format=fmt):
+        img.save(buf, format=fmt.upper(), **encoder_params(fmt))
+    # Tile i (0-based from start) sits at column i % columns, row i // columns
+    headers = {
+        f"X-Montage-{k.replace('_', '-').title()}": str(v).lower() if isinstance(v, bool) else str(v)
+        for k, v in layout.items()
+    }
+    headers["Access-Control-Expose-Headers"] = ", ".join(headers)
+    headers["Vary"] = "Accept"
+    return Response(content=buf.getvalue(), media_type=MEDIA_TYPES[fmt], headers=headers)
+
+
+@router.get("/{study_id}/montage")
+async def get_montage(
+    study_id: str,
+    request: Request,
+    level: str = Query("128", description=f"Pyramid level: long side in pixels, or '{FULL_LEVEL}'"),
+    start: int = Query(1, ge=1, description="First slice (1-based)"),
+    end: Optional[int] = Query(None, ge=1, description="Last slice, inclusive; defaults to the last slice"),
+    columns: Optional[int] = Query(None, ge=1, description="Tiles per row; defaults to a near-square grid"),
+    overlay: bool = False,
+    alpha: float = Query(0.4, ge=0.0, le=1.0),
+):
+    fmt = negotiate_format(request.headers.get("accept"))
+    return await run_io(_montage, study_id, level, start, end, columns, overlay, alpha, fmt)
+
+
+def _byte_range(spec: Optional[str], size: int) -> Optional[tuple]:
+    # Single "bytes=a-b", "bytes=a-" or "bytes=-n" range; anything else is served in full
+    if not spec or not spec.startswith("bytes=") or "," in spec:
+        return None
+    first, _, last = spec[6:].strip().partition("-")
+    try:
+        if first:
+            lo, hi = int(first), int(last) if last else size - 1
+        else:
+            lo, hi = max(0, size - int(last)), size - 1
+    except ValueError:
+        return None
+    if lo >= size or lo > hi:
+        raise HTTPException(status_code=416, detail="range not satisfiable", headers={"Content-Range": f"bytes */{size}"})
+    return lo, min(hi, size - 1)
+
+
+def _slices_response(
+    study_id: str,
+    kind: str,
+    dtype: str,
+    start: int,
+    end: Optional[int],
+    compress: bool,
+    range_spec: Optional[str],
+    if_range: Optional[str],
+) -> Response:
+    if not study_exists(study_id):
+        raise HTTPException(status_code=404, detail="Study not found")
+    try:
+        built = slice_range_payload(study_id, kind, dtype, start, end)
+    except VolumeBuildError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if built is None:
+        raise HTTPException(status_code=404, detail="no masks available" if kind == "mask" else "no images available")
+    payload, info = built
+    etag = '"%s"' % hashlib.sha1(
+        f"{study_id}:{kind}:{info['dtype']}:{info['start']}:{info['end']}:{info['version']}".encode()
+    ).hexdigest()[:20]
+    headers = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        "Vary": "Accept-Encoding",
+        "X-Volume-Dtype": info["dtype"],
+        "X-Volume-Shape": ",".join(str(v) for v in info["shape"]),
+        "X-Volume-Start": str(info["start"]),
+        "X-Volume-Header-Bytes": str(info["header_bytes"]),
+    }
+    if info["rescale"]:
+        headers["X-Volume-Rescale-Slope"] = str(info["rescale"]["slope"])
+        headers["X-Volume-Rescale-Intercept"] = str(info["rescale"]["intercept"])
+    headers["Access-Control-Expose-Headers"] = ", ".join(headers)
+
+    # A stale If-Range validator means the client's partial copy is outdated: send everything
+    byte_range = _byte_range(range_spec, len(payload)) if if_range in (None, etag) else None
+    if byte_range is not None:
+        lo, hi = byte_range
+        headers["Content-Range"] = f"bytes {lo}-{hi}/{len(payload)}"
+        return Response(payload[lo:hi + 1], status_code=206, media_type="application/octet-stream", headers=headers)
+    if compress:
+        with stage_timer("volume_gzip", kind=kind):
+            payload = gzip.compress(payload, compresslevel=1)
+        headers["Content-Encoding"] = "gzip"
+    return Response(payload, media_type="application/octet-stream", headers=headers)
+
+
+@router.get("/{study_id}/slices.bin")
+async def get_slices_binary(
+    study_id: str,
+    request: Request,
+    kind: str = Query("image", description="image or mask"),
+    dtype: str = Query("uint8", description="uint8 (8-bit previews) or native (stored DICOM values, int16)"),
+    start: int = Query(1, ge=1, description="First slice (1-based)"),
+    end: Optional[int] = Query(None, ge=1, description="Last slice, inclusive; defaults to the last slice"),
+    use_gzip: bool = Query(
+        False, alias="gzip", description="gzip the payload when the client accepts it; ignored for Range requests"
+    ),
+):
+    """
+    Slices start..end as one raw little-endian payload: a fixed header (magic "PDXV", version,
+    dtype code, kind code, start, slices, rows, cols) followed by the voxels in C order.
+    """
+    if kind not in KINDS:
+        raise HTTPException(status_code=400, detail=f"kind must be one of {', '.join(KINDS)}")
+    if dtype not in DTYPES:
+        raise HTTPException(status_code=400, detail=f"dtype must be one of {', '.join(DTYPES)}")
+    compress = use_gzip and "gzip" in request.headers.get("accept-encoding", "").lower()
+    return await run_io(
+        _slices_response, study_id, kind, dtype, start, end, compress,
+        request.headers.get("range"), request.headers.get("if-range"),
     )
-    overlaid.save(overlay_path)
-    return FileResponse(overlay_path, media_type="image/png")
 
 
+@router.get("/{study_id}/{slice_index}.png")
+async def get_image(
+    study_id: str,
+    slice_index: int,
+    request: Request,
+    bit_depth: int = Query(8, description="16 returns a 16-bit grayscale PNG of the stored pixel values (signed ones + 32768)"),
+):
+    if bit_depth not in (8, 16):
+        raise HTTPException(status_code=400, detail="bit_depth must be 8 or 16")
+    fmt = "png16" if bit_depth == 16 else negotiate_format(request.headers.get("accept"))
+    # Slice reads use the io pool so they are not queued behind bulk exports on the cpu pool
+    path = await run_io(_image_path, study_id, slice_index, fmt)
+    return _preview_response(path, fmt)
+
+
+@router.get("/{study_id}/{slice_index}/overlay.png")
+async def get_overlay(
+    study_id: str,
+    slice_index: int,
+    request: Request,
+    alpha: float = Query(0.4, ge=0.0, le=1.0),
+    v: str = Query(None, description="Cache busting parameter"),
+):
+    fmt = negotiate_format(request.headers.get("accept"))
+    path = await run_io(_overlay_path, study_id, slice_index, alpha, bool(v), fmt)
+    return _preview_response(path, fmt)
@@ -0,0 +1,32 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from app.services.inference_cache import inference_cache
+from app.services.jobs import jobs
+from app.services.metrics import register_counter, register_gauge, registry
+
+
+router = APIRouter(tags=["system"])
+
+
+def _job_counts(status: str):
+    return lambda: {(): float(jobs.count_by_status().get(status, 0))}
+
+
+def _cache_counter(field: str):
+    return lambda: {
+        (kind,): float(stats[field]) for kind, stats in inference_cache.stats()["by_kind"].items()
+    }
+
+
+register_gauge("pdx_jobs_queue_depth", "Segmentation jobs created but not yet running.", (), _job_counts("pending"))
+register_gauge("pdx_jobs_in_flight", "Segmentation jobs currently running.", (), _job_counts("running"))
+register_counter("pdx_inference_cache_hits_total", "Inference cache hits.", ("kind",), _cache_counter("hits"))
+register_counter("pdx_inference_cache_misses_total", "Inference cache misses.", ("kind",), _cache_counter("misses"))
+register_gauge("pdx_inference_cache_hit_ratio", "Inference cache hit ratio since startup.", ("kind",), _cache_counter("hit_rate"))
+register_gauge("pdx_inference_cache_bytes", "Bytes stored in the inference cache.", (), lambda: {(): float(inference_cache.stats()["bytes"])})
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics() -> PlainTextResponse:
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
@@ -1,63 +1,58 @@
-import os
-import numpy as np
-from PIL import Image
-from fastapi import APIRouter, HTTPException
+from typing import Optional
 
+from fastapi import APIRouter, Header, HTTPException, Response
+from fastapi.responses import JSONResponse
+
+from app.services.executors import run_cpu, run_io
 from app.services.jobs import jobs
-from app.services.metadata import read_spacing_and_thickness_mm, read_study_info
-from app.services.volume import compute_raw_areas, scale_all_areas
-from app.services.storage import get_study_subdir
+from app.services.morphology import study_morphology
+from app.services.results_cache import cached_results, materialize_results
+from app.services.volume import masks_version
 
 
 router = APIRouter(prefix="/results", tags=["results"])
 
 
-@router.get("/{job_id}")
-async def get_results(job_id: str):
+def _not_modified(etag: str, if_none_match: Optional[str]) -> bool:
+    return bool(if_none_match) and etag in [t.strip() for t in if_none_match.split(",")]
+
+
+def _done_job(job_id: str) -> dict:
     job = jobs.get(job_id)
     if not job or job["status"] != "done":
         raise HTTPException(status_code=404, detail="job not completed")
-    study_id = job["payload"].get("study_id")
-    classifier_results = job["payload"].get("classifier_results")
-    masks_dir = get_study_subdir(study_id, "masks")
-    # Load masks volume
-    # Sort numerically by slice index (filenames are like "1.png", "2.png", ...)
-    mask_files = sorted(
-        (f for f in os.listdir(masks_dir) if f.lower().endswith('.png')),
-        key=lambda x: int(os.path.splitext(x)[0])
-    )
-    if not mask_files:
-        return {
-            "study_id": study_id,
-            "total_volume_cc": 0,
-            "slice_areas_cc": [],
-            "classifier_results": classifier_results,
-        }
-    vol = []
-    for name in mask_files:
-        arr = np.array(Image.open(os.path.join(masks_dir, name)).convert('L'))
-        vol.append((arr > 127).astype(np.uint8))
-    vol = np.stack(vol, axis=0)  # N,H,W
-    print("Vol shape", vol.shape)
-    # Compute unscaled areas (sum per slice). vol is (N,H,W)
-    raw_areas = compute_raw_areas(vol)
-    spacing_mm, thickness_mm = read_spacing_and_thickness_mm(study_id)
-    meta = read_study_info(study_id)
-    scaled_cc = scale_all_areas(raw_areas, thickness_mm, spacing_mm)
-    total_cc = float(np.sum(scaled_cc))
-
-    # Ensure classifier_results aligns with masks order; if missing or length-mismatched,
-    # derive booleans directly from per-slice areas in mask order
-    if not isinstance(classifier_results, list) or len(classifier_results) != len(scaled_cc):
-        classifier_results = [bool(float(a) > 0) for a in scaled_cc]
-    return {
-        "study_id": study_id,
-        "total_volume_cc": total_cc,
-        "slice_areas_cc": scaled_cc,
-        "pixel_spacing_mm": spacing_mm,
-        "slice_thickness_mm": thickness_mm,
-        "classifier_results": classifier_results,
-        **meta,
-    }
+    return job
 
 
+@router.get("/{job_id}")
+async def get_results(job_id: str, if_none_match: Optional[str] = Header(None)):
+    _done_job(job_id)
+    # Materialized when the job finished; rebuilt (incrementally) only after the masks change
+    entry = cached_results(job_id) or await run_io(materialize_results, job_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="job not completed")
+    headers = {"ETag": entry["etag"], "Cache-Control": "no-cache", "Access-Control-Expose-Headers": "ETag"}
+    if _not_modified(entry["etag"], if_none_match):
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry["body"], media_type="application/json", headers=headers)
+
+
+@router.get("/{job_id}/morphology")
+async def get_morphology(job_id: str, if_none_match: Optional[str] = Header(None)):
+    """
+    Volume statistics of the job's study (see app.services.morphology). Computed from the
+    mask volume on the first request after a mask change, then served from morphology.json.
+    """
+    job = _done_job(job_id)
+    study_id = (job.get("result") or {}).get("study_id") or job["payload"].get("study_id")
+    version = masks_version(study_id)
+    if version is None:
+        raise HTTPException(status_code=404, detail="no masks")
+    etag = f'"m{version}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Access-Control-Expose-Headers": "ETag"}
+    if _not_modified(etag, if_none_match):
+        return Response(status_code=304, headers=headers)
+    stats = await run_cpu(study_morphology, study_id)
+    if stats is None:
+        raise HTTPException(status_code=404, detail="morphology not available for this study")
+    return JSONResponse({"study_id": study_id, "morphology": stats}, headers=headers)
@@ -1,64 +1,247 @@
+import hashlib
+import json
+import logging
 import threading
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
 from fastapi import APIRouter, HTTPException
 
-from app.schemas.jobs import SegmentRequest, JobResponse, JobStatusResponse
+from app.schemas.jobs import (
+    JobResponse,
+    JobStatusResponse,
+    PostprocessRequest,
+    PostprocessSettings,
+    RethresholdRequest,
+    SegmentRequest,
+)
+from app.services.executors import run_cpu, run_io
 from app.services.jobs import jobs
 from app.services.segmentation import run_classify_then_segment
-from app.models.classifier_model.architectures.resnet50 import (
-    load_classifier_with_weights,
-    predict_tumor_presence,
-    CLASSIFIER_IMAGE_ROWS,
-    CLASSIFIER_IMAGE_COLS,
-)
+from app.services.inference_cache import inference_cache, weights_fingerprint
+from app.services.metrics import stage_timer
+from app.services.inference import classifier_scores, segmenter_probabilities
+from app.services.inference_config import inference_config, job_slot
+from app.services.profiling import PROFILERS, JobTimeline, activate_timeline, capture_profile, event
+from app.services.memory import SLICE_STORAGE_MODES, track_peak_rss
+from app.models.input_shapes import CLASSIFIER_IMAGE_ROWS, CLASSIFIER_IMAGE_COLS, IMAGE_ROW, IMAGE_COL
 from app.utils.image_preprocessing import get_default_segmentation_weights_path, get_default_classifier_weights_path, custom_normalize
 import numpy as np
 from PIL import Image
 from fastapi import Body
 import os
 from app.services.images import ensure_png_slices, get_png_path
-from app.services.storage import get_study_subdir
-from app.models.segmentation_model.architectures.r2udensenet import create_r2udensenet_model, IMAGE_ROW, IMAGE_COL
+from app.services.storage import study_store
+from app.services.metadata import read_spacing_and_thickness_mm
+from app.services.probability_maps import (
+    get_stored_threshold,
+    masks_from_probabilities,
+    rethreshold_study,
+    update_probability_maps,
+)
+from app.services.postprocess import postprocess_study, store_settings
+from app.services.volume import scale_all_areas, update_area_index
+from app.services.volume_cache import VolumeBuildError
+from app.services.results_cache import materialize_results
+
 
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/segment", tags=["segment"])
 
 
-def _run_job(job_id: str, study_id: str, threshold: float) -> None:
+def _resize_for_classifier(arr_2d: np.ndarray) -> np.ndarray:
+    if arr_2d.shape != (CLASSIFIER_IMAGE_ROWS, CLASSIFIER_IMAGE_COLS):
+        img = Image.fromarray(arr_2d.astype(np.float32))
+        img = img.resize((CLASSIFIER_IMAGE_COLS, CLASSIFIER_IMAGE_ROWS))
+        arr_2d = np.array(img, dtype=np.float32)
+    return arr_2d
+
+
+def _postprocess_settings(settings: PostprocessSettings) -> dict:
+    return {
+        "keep_largest": bool(settings.keep_largest),
+        "min_volume_cc": float(settings.min_volume_cc or 0.0),
+        "fill_holes": settings.fill_holes is not False,
+        "smoothing_radius": int(settings.smoothing_radius or 0),
+    }
+
+
+def _check_postprocess(settings: Optional[PostprocessSettings]) -> None:
+    if settings is None:
+        return
+    if (settings.min_volume_cc or 0.0) < 0:
+        raise HTTPException(status_code=400, detail="min_volume_cc must be >= 0")
+    if not 0 <= (settings.smoothing_radius or 0) <= 10:
+        raise HTTPException(status_code=400, detail="smoothing_radius must be between 0 and 10")
+
+
+def _check_memory(budget_mb: Optional[int], slice_storage: Optional[str]) -> None:
+    if budget_mb is not None and budget_mb < 0:
+        raise HTTPException(status_code=400, detail="memory_budget_mb must be >= 0")
+    if slice_storage not in (None, *SLICE_STORAGE_MODES):
+        raise HTTPException(status_code=400, detail=f"slice_storage must be one of {', '.join(SLICE_STORAGE_MODES)}")
+
+
+# Held by a segmentation job for its whole run; mask edits of the same study wait or fail fast
+MASKS_LOCK = "masks"
+
+
+@contextmanager
+def _study_writes(study_id: str) -> Iterator[None]:
+    lock = study_store.build_lock(study_id, MASKS_LOCK)
+    if not lock.acquire(blocking=False):
+        raise HTTPException(status_code=409, detail="segmentation of this study is in progress")
+    try:
+        yield
+    finally:
+        lock.release()
+        # Masks changed (even by an edit that failed partway), so an identical segmentation
+        # request must run again
+        jobs.release(study_id)
+
+
+def _weights_key(path: str) -> str:
     try:
-        jobs.set_status(job_id, "running", progress=0)
-        # Load models/weights
-        seg_weights_path = get_default_segmentation_weights_path()
-        clf_weights_path = get_default_classifier_weights_path()
-        clf_model = load_classifier_with_weights(clf_weights_path)
-
-        # Classifier slice wrapper
-        def clf_predict(arr_2d: np.ndarray) -> bool:
-            if arr_2d.shape != (CLASSIFIER_IMAGE_ROWS, CLASSIFIER_IMAGE_COLS):
-                img = Image.fromarray(arr_2d.astype(np.float32))
-                img = img.resize((CLASSIFIER_IMAGE_COLS, CLASSIFIER_IMAGE_ROWS))
-                arr_2d = np.array(img, dtype=np.float32)
-            x = np.expand_dims(arr_2d, axis=(0, -1))  # (1,H,W,1)
-            return predict_tumor_presence(clf_model, x, threshold=0.5)
-
-        saved, clf_flags = run_classify_then_segment(
+        return weights_fingerprint(path)
+    except OSError:
+        return path
+
+
+def _job_fingerprint(study_id: str, req: SegmentRequest) -> str:
+    """
+    Everything that determines a job's output: source files, weights and settings, plus the
+    profiler, whose report a job without one cannot provide.
+    """
+    source = study_store.source_dir(study_id)
+    try:
+        source_mtime = max(
+            [os.stat(source).st_mtime_ns]
+            + [os.stat(os.path.join(source, name)).st_mtime_ns for name in study_store.dicom_files(study_id)]
+        )
+    except OSError:
+        source_mtime = 0
+    key = {
+        "study_id": study_id,
+        "source": source,
+        "source_mtime_ns": source_mtime,
+        "segmenter": _weights_key(get_default_segmentation_weights_path()),
+        "classifier": _weights_key(get_default_classifier_weights_path()),
+        "model": req.model,
+        "threshold": req.threshold or 0.5,
+        "classifier_scan": req.classifier_scan or "full",
+        "classifier_coarse_stride": req.classifier_coarse_stride or 0,
+        "postprocess": _postprocess_settings(req.postprocess) if req.postprocess is not None else None,
+        "profile": req.profile,
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+def _run_job(job_id: str, study_id: str, req: SegmentRequest) -> None:
+    timeline = JobTimeline()
+    profiler: dict = {}
+    try:
+        jobs.set_profile(job_id, timeline)
+        # Stays "pending" while another job writes this study's masks, then until an
+        # inference slot is free (PDX_MAX_CONCURRENT_JOBS)
+        with study_store.build_lock(study_id, MASKS_LOCK), job_slot(), \
+                activate_timeline(timeline), capture_profile(req.profile, profiler):
+            # This run replaces the masks of any earlier job of the study
+            jobs.release(study_id)
+            _run_job_stages(job_id, study_id, req)
+    except Exception as exc:  # noqa: BLE001
+        # Whatever failed (lock, slot, profiler or a stage), a job left "pending" would be
+        # handed out by deduplication until the window ran out
+        if (jobs.get(job_id) or {}).get("status") != "done":
+            jobs.set_error(job_id, str(exc))
+        return
+    finally:
+        if profiler:
+            jobs.set_profile(job_id, timeline, profiler)
+    try:
+        # /results is served from this until the masks change; built after the masks lock
+        # and inference slot are released so other jobs are not held up
+        with activate_timeline(timeline), stage_timer("results_materialize"):
+            materialize_results(job_id)
+    except Exception:  # noqa: BLE001
+        logger.exception("Could not materialize results of job %s", job_id)
+
+
+def _run_job_stages(job_id: str, study_id: str, req: SegmentRequest) -> None:
+    jobs.set_status(job_id, "running", progress=0)
+    # Load models/weights
+    seg_weights_path = get_default_segmentation_weights_path()
+    clf_weights_path = get_default_classifier_weights_path()
+    # Models are loaded on first use (in-process or in the shared inference worker),
+    # so fully cached studies never touch the classifier
+
+    # Classifier slice wrapper
+    def clf_predict(arr_2d: np.ndarray) -> bool:
+        with stage_timer("preprocess"):
+            x = np.expand_dims(_resize_for_classifier(arr_2d), axis=(0, -1))  # (1,H,W,1)
+        with stage_timer("classifier", batch_size=1):
+            return classifier_scores(x, clf_weights_path)[0] >= 0.5
+
+    # Classifier batch wrapper, returns scores
+    def clf_predict_batch(batch: list) -> list:
+        with stage_timer("preprocess"):
+            x = np.stack([_resize_for_classifier(a) for a in batch], axis=0)
+            x = np.expand_dims(x, axis=-1)  # (N,H,W,1)
+        with stage_timer("classifier", batch_size=len(batch)):
+            return classifier_scores(x, clf_weights_path)
+
+    settings = _postprocess_settings(req.postprocess) if req.postprocess is not None else None
+    # Peak RSS over the whole job; the slice storage plan is added by the pipeline
+    memory: dict = {}
+    with track_peak_rss(memory):
+        saved, clf_flags, clf_inferred = run_classify_then_segment(
             study_id=study_id,
             classifier_predict_slice=clf_predict,
             segmenter_weights_path=seg_weights_path,
-            threshold=threshold or 0.5,
+            threshold=req.threshold or 0.5,
+            classifier_predict_batch=clf_predict_batch,
+            scan_mode=req.classifier_scan or "full",
+            scan_batch_size=req.classifier_batch_size or inference_config["classifier_batch_size"],
+            segment_batch_size=inference_config["segmenter_batch_size"],
+            coarse_stride=req.classifier_coarse_stride or 0,
+            classifier_weights_path=clf_weights_path,
+            classifier_threshold=0.5,
+            cache=inference_cache if req.use_cache else None,
+            memory_budget_mb=req.memory_budget_mb,
+            slice_storage=req.slice_storage,
+            memory=memory,
+            # Applied in the pipeline's write stage, so each mask is written once
+            postprocess=settings,
         )
-        jobs.set_result(job_id, {"study_id": study_id, "classifier_results": clf_flags})
-    except Exception as exc:  # noqa: BLE001
-        jobs.set_error(job_id, str(exc))
+        if settings is not None:
+            store_settings(study_id, settings)
+    event("peak_rss", **memory)
+    jobs.set_result(job_id, {
+        "study_id": study_id,
+        "classifier_results": clf_flags,
+        "classifier_inferred": clf_inferred,
+        "memory": memory,
+    })
 
 
 @router.post("/start", response_model=JobResponse)
 async def start_segmentation(req: SegmentRequest) -> JobResponse:
     if not req.study_id:
         raise HTTPException(status_code=400, detail="study_id required")
-    job_id = jobs.create({"study_id": req.study_id, "model": req.model, "threshold": req.threshold})
-    thread = threading.Thread(target=_run_job, args=(job_id, req.study_id, req.threshold or 0.5), daemon=True)
-    thread.start()
-    return JobResponse(job_id=job_id)
+    if req.classifier_scan not in (None, "full", "bidirectional"):
+        raise HTTPException(status_code=400, detail="classifier_scan must be 'full' or 'bidirectional'")
+    if req.profile not in (None, *PROFILERS):
+        raise HTTPException(status_code=400, detail=f"profile must be one of {', '.join(PROFILERS)}")
+    _check_postprocess(req.postprocess)
+    _check_memory(req.memory_budget_mb, req.slice_storage)
+    fingerprint = await run_io(_job_fingerprint, req.study_id, req)
+    job_id, created = jobs.create_or_reuse(
+        fingerprint, {"study_id": req.study_id, "model": req.model, "threshold": req.threshold}
+    )
+    if created:
+        thread = threading.Thread(target=_run_job, args=(job_id, req.study_id, req), daemon=True)
+        thread.start()
+    return JobResponse(job_id=job_id, reused=not created)
 
 
 @router.get("/{job_id}/status", response_model=JobStatusResponse)
@@ -69,26 +252,40 @@ async def segmentation_status(job_id: str) -> JobStatusResponse:
     return JobStatusResponse(job_id=job_id, status=job["status"])
 
 
-@router.post("/resegment", tags=["segment"])
-async def resegment_slices(
-    payload: dict = Body(..., example={"study_id": "<id>", "slices": [1,2,3]})
-):
-    study_id = payload.get("study_id")
-    slices = payload.get("slices") or []
-    if not study_id or not isinstance(slices, list):
-        raise HTTPException(status_code=400, detail="study_id and slices[] required")
+@router.get("/{job_id}/profile")
+async def segmentation_profile(job_id: str):
+    """Stage timeline of a job (live while it runs), plus profiler output if requested."""
+    job = jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="job not found")
+    timeline = job.get("timeline")
+    return {
+        "job_id": job_id,
+        "status": job["status"],
+        **(timeline.to_dict() if timeline is not None else {"summary": {}, "spans": []}),
+        **(job.get("profiler") or {}),
+    }
+
+
+def _locked(fn, study_id: str, *args, **kwargs):
+    with _study_writes(study_id):
+        return fn(study_id, *args, **kwargs)
 
+
+def _resegment(study_id: str, slices: list) -> list:
     # Ensure PNGs exist
     ensure_png_slices(study_id)
 
-    # Load segmenter once
     seg_weights_path = get_default_segmentation_weights_path()
-    seg_model = create_r2udensenet_model()
-    seg_model.load_weights(seg_weights_path)
+    if not os.path.exists(seg_weights_path):
+        raise HTTPException(status_code=500, detail="segmentation weights not found")
 
-    masks_dir = get_study_subdir(study_id, "masks")
+    # Use the study's current threshold so a later re-threshold sees consistent masks
+    threshold = get_stored_threshold(study_id) or 0.5
 
     updated = []
+    prob_updates = {}
+    area_updates = {}
     for idx in slices:
         try:
             png_path = get_png_path(study_id, int(idx))
@@ -102,22 +299,98 @@ async def resegment_slices(
                 arr = np.array(img, dtype=np.float32)
             x = custom_normalize(arr)
             x = np.expand_dims(x, axis=(0, -1))  # (1,H,W,1)
-            pred = seg_model.predict(x, batch_size=1, verbose=0)
-            mask_small = (np.squeeze(pred, axis=(0, -1)) >= 0.5).astype(np.uint8) * 255
-            # Save mask in mask index order (idx.png)
-            mask_img = Image.fromarray(mask_small)
-            # Match original PNG size for consistency
+            with stage_timer("segmenter"):
+                prob = segmenter_probabilities(x, seg_weights_path)[0].astype(np.float16)
+            # Save mask in mask index order (idx.png), matching original PNG size for consistency
             orig = Image.open(png_path).convert('L')
-            if mask_img.size != orig.size:
-                mask_img = mask_img.resize(orig.size)
-            out_path = os.path.join(masks_dir, f"{int(idx)}.png")
-            mask_img.save(out_path)
+            mask = masks_from_probabilities((prob >= np.float16(threshold))[None], [orig.size[::-1]])[0]
+            with stage_timer("mask_write"):
+                study_store.write_mask(study_id, int(idx), mask)
+            prob_updates[int(idx) - 1] = prob
+            area_updates[int(idx) - 1] = int(np.count_nonzero(mask))
             updated.append(int(idx))
         except Exception:
             # skip problematic slice
             continue
 
+    # Keep stored probability maps and the area index in sync with the new masks
+    update_probability_maps(study_id, prob_updates)
+    update_area_index(study_id, area_updates)
+
+    return updated
+
+
+@router.post("/resegment", tags=["segment"])
+async def resegment_slices(
+    payload: dict = Body(..., example={"study_id": "<id>", "slices": [1,2,3]})
+):
+    study_id = payload.get("study_id")
+    slices = payload.get("slices") or []
+    if not study_id or not isinstance(slices, list):
+        raise HTTPException(status_code=400, detail="study_id and slices[] required")
+
+    updated = await run_cpu(_locked, _resegment, study_id, slices)
     # Return which slices were updated
     return {"study_id": study_id, "updated_slices": sorted(updated)}
 
 
+@router.post("/rethreshold", tags=["segment"])
+async def rethreshold(req: RethresholdRequest):
+    """
+    Regenerate masks from stored probability maps at a new threshold without re-running
+    the network. Only slices whose mask changes are rewritten.
+    """
+    if not 0.0 < req.threshold <= 1.0:
+        raise HTTPException(status_code=400, detail="threshold must be in (0, 1]")
+    try:
+        out = await run_cpu(
+            _locked, rethreshold_study, req.study_id, req.threshold, render_overlays=bool(req.render_overlays)
+        )
+    except VolumeBuildError as e:
+        # Stored post-processing settings need one volume; mixed slice shapes cannot be cleaned
+        raise HTTPException(status_code=409, detail=str(e))
+    if out is None:
+        raise HTTPException(status_code=404, detail="probability maps not found; run segmentation first")
+    spacing_mm, thickness_mm = await run_io(read_spacing_and_thickness_mm, req.study_id)
+    scaled_cc = scale_all_areas(out["raw_areas"], thickness_mm, spacing_mm)
+    return {
+        "study_id": req.study_id,
+        "threshold": req.threshold,
+        "total_volume_cc": float(np.sum(scaled_cc)),
+        "slice_areas_cc": scaled_cc,
+        "updated_slices": out["updated_slices"],
+    }
+
+
+def _postprocess(study_id: str, settings: dict) -> Optional[dict]:
+    try:
+        out = postprocess_study(study_id, settings)
+    except VolumeBuildError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if out is not None:
+        store_settings(study_id, settings)
+    return out
+
+
+@router.post("/postprocess", tags=["segment"])
+async def postprocess(req: PostprocessRequest):
+    """
+    Clean up a study's masks as a volume (3D connected components, hole filling, smoothing)
+    without re-running the network. Only slices whose mask changes are rewritten, and the
+    settings are reapplied by later re-thresholds.
+    """
+    _check_postprocess(req)
+    out = await run_cpu(_locked, _postprocess, req.study_id, _postprocess_settings(req))
+    if out is None:
+        raise HTTPException(status_code=404, detail="masks not found; run segmentation first")
+    spacing_mm, thickness_mm = await run_io(read_spacing_and_thickness_mm, req.study_id)
+    scaled_cc = scale_all_areas(out["raw_areas"], thickness_mm, spacing_mm)
+    return {
+        "study_id": req.study_id,
+        "settings": out["settings"],
+        "components": out["components"],
+        "components_kept": out["components_kept"],
+        "total_volume_cc": float(np.sum(scaled_cc)),
+        "slice_areas_cc": scaled_cc,
+        "updated_slices": out["updated_slices"],
+    }
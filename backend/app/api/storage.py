@@ -0,0 +1,26 @@
+from fastapi import APIRouter, Query
+
+from app.services.executors import run_io
+from app.services.janitor import janitor, storage_usage
+
+
+router = APIRouter(prefix="/storage", tags=["system"])
+
+
+@router.get("/stats")
+async def storage_stats(studies: bool = Query(False, description="Include per-study sizes and access times")):
+    usage = await run_io(storage_usage)
+    if not studies:
+        usage.pop("studies")
+    return {
+        **usage,
+        "quota_bytes": janitor.quota_bytes,
+        "janitor_enabled": janitor.enabled,
+        "last_run": janitor.last_run,
+    }
+
+
+@router.post("/janitor/run")
+async def run_janitor():
+    """Run one eviction sweep now (no-op below quota or when no quota is configured)."""
+    return await run_io(janitor.run_once)
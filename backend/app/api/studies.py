@@ -1,5 +1,6 @@
 from fastapi import APIRouter, HTTPException
 
+from app.services.executors import run_io
 from app.services.metadata import read_study_info
 
 
@@ -8,7 +9,7 @@ router = APIRouter(prefix="/studies", tags=["studies"])
 
 @router.get("/{study_id}/info")
 async def get_study_info(study_id: str):
-    info = read_study_info(study_id)
+    info = await run_io(read_study_info, study_id)
     if not info:
         raise HTTPException(status_code=404, detail="study info not found")
     return info
@@ -4,6 +4,7 @@ from fastapi import APIRouter, UploadFile, File
 from pydantic import BaseModel
 
 from app.schemas.jobs import UploadResponse
+from app.services.executors import run_io
 from app.services.storage import save_uploads, ingest_local_directory
 
 
@@ -22,7 +23,7 @@ class IngestLocalRequest(BaseModel):
 
 @router.post("/ingest_local", response_model=UploadResponse)
 async def ingest_local(req: IngestLocalRequest) -> UploadResponse:
-    study_id, saved_files = ingest_local_directory(req.path)
+    study_id, saved_files = await run_io(ingest_local_directory, req.path)
     return UploadResponse(study_id=study_id, files=saved_files)
 
 
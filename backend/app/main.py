@@ -1,3 +1,6 @@
+import os
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
@@ -9,6 +12,29 @@ from app.api.segment import router as segment_router
 from app.api.results import router as results_router
 from app.api.export import router as export_router
 from app.api.studies import router as studies_router
+from app.api.metrics import router as metrics_router
+from app.api.cohort import router as cohort_router
+from app.api.storage import router as storage_router
+from app.services.executors import shutdown_pools
+from app.services.inference_cache import inference_cache
+from app.services.inference_config import describe as inference_settings
+from app.services.janitor import janitor
+from app.services.metrics import MetricsMiddleware
+from app.services.model_registry import loaded_models, start_background_preload
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Inference modules (and TensorFlow) load lazily; optionally warm them up after
+    # the server is already accepting traffic
+    if os.environ.get("PDX_PRELOAD_MODELS", "0").lower() in ("1", "true", "yes"):
+        start_background_preload()
+    # Evicts regenerable artifacts when PDX_STORAGE_QUOTA_MB is set
+    if janitor.enabled:
+        janitor.start()
+    yield
+    janitor.stop()
+    shutdown_pools()
 
 
 def create_app() -> FastAPI:
@@ -16,6 +42,7 @@ def create_app() -> FastAPI:
         title="PDX Segmentation API",
         version="0.1.0",
         description="Backend API for DICOM upload, segmentation, and export",
+        lifespan=lifespan,
     )
 
     app.add_middleware(
@@ -25,6 +52,7 @@ def create_app() -> FastAPI:
         allow_methods=["*"],
         allow_headers=["*"],
     )
+    app.add_middleware(MetricsMiddleware)
 
     app.include_router(upload_router)
     app.include_router(images_router)
@@ -32,6 +60,9 @@ def create_app() -> FastAPI:
     app.include_router(results_router)
     app.include_router(export_router)
     app.include_router(studies_router)
+    app.include_router(metrics_router)
+    app.include_router(cohort_router)
+    app.include_router(storage_router)
 
     # Serve built frontend if present
     static_dir = Path(__file__).resolve().parent / "static"
@@ -42,6 +73,14 @@ def create_app() -> FastAPI:
     async def health_check() -> dict:
         return {"status": "ok"}
 
+    @app.get("/models", tags=["system"])
+    async def models_loaded() -> dict:
+        return {"loaded": loaded_models(), "config": inference_settings()}
+
+    @app.get("/cache/stats", tags=["system"])
+    async def cache_stats() -> dict:
+        return inference_cache.stats()
+
     return app
 
 
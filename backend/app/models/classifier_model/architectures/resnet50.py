@@ -4,15 +4,11 @@ from tensorflow.keras.layers import Dense, GlobalMaxPooling2D
 from tensorflow.keras.applications import ResNet50
 import numpy as np
 from app.utils.image_preprocessing import custom_normalize
+from app.models.input_shapes import CLASSIFIER_IMAGE_ROWS, CLASSIFIER_IMAGE_COLS, CLASSIFIER_IMAGE_DEPTH
 
 K = tf.keras.backend
 K.set_image_data_format('channels_last')
 
-# Image dimensions for classifier
-CLASSIFIER_IMAGE_ROWS = 192
-CLASSIFIER_IMAGE_COLS = 192
-CLASSIFIER_IMAGE_DEPTH = 1
-
 def create_resnet50_classifier():
     """
     Create ResNet50-based binary classifier for tumor detection.
@@ -66,3 +62,21 @@ def predict_tumor_presence(model, image_array: tf.Tensor, threshold: float = 0.5
     
     prediction = model.predict(image_array, verbose=0)
     return float(prediction[0][0]) >= threshold
+
+
+def predict_tumor_scores(model, image_batch: np.ndarray) -> list:
+    """
+    Predict tumor probabilities for a batch of images in a single forward pass.
+    
+    Args:
+        model: Loaded classifier model
+        image_batch: Preprocessed image array of shape (N, H, W, 1)
+        
+    Returns:
+        List of N floats in [0, 1]
+    """
+    # Per-image normalization (4D input is normalized slice by slice)
+    image_batch = custom_normalize(image_batch)
+    
+    predictions = model.predict(image_batch, batch_size=len(image_batch), verbose=0)
+    return [float(p[0]) for p in predictions]
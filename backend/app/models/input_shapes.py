@@ -0,0 +1,11 @@
+# Model input sizes, importable without pulling in TensorFlow
+
+# Segmenter (R2U-DenseNet)
+IMAGE_ROW = 192
+IMAGE_COL = 192
+IMAGE_DEPTH = 1
+
+# Classifier (ResNet50)
+CLASSIFIER_IMAGE_ROWS = 192
+CLASSIFIER_IMAGE_COLS = 192
+CLASSIFIER_IMAGE_DEPTH = 1
@@ -4,14 +4,10 @@ from tensorflow.keras.layers import Conv2D, Conv2DTranspose, MaxPooling2D, conca
 from tensorflow.keras import backend as K
 import numpy as np
 from app.utils.image_preprocessing import custom_normalize
+from app.models.input_shapes import IMAGE_ROW, IMAGE_COL, IMAGE_DEPTH
 
 K.set_image_data_format('channels_last')
 
-# Image dimensions for inference
-IMAGE_ROW = 192
-IMAGE_COL = 192
-IMAGE_DEPTH = 1
-
 def rec_layer(layer, filters):
     """Recurrent layer for R2U-DenseNet architecture"""
     reconv1 = Conv2D(filters, (3, 3), activation='relu', padding='same')(layer)
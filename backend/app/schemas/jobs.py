@@ -7,16 +7,82 @@ class UploadResponse(BaseModel):
     files: List[str]
 
 
+class PostprocessSettings(BaseModel):
+    # Keep only the largest 3D connected component
+    keep_largest: Optional[bool] = False
+    # Drop 3D components smaller than this volume
+    min_volume_cc: Optional[float] = 0.0
+    fill_holes: Optional[bool] = True
+    # In-plane opening + closing radius in pixels; 0 disables smoothing
+    smoothing_radius: Optional[int] = 0
+
+
 class SegmentRequest(BaseModel):
     study_id: str
     model: Optional[str] = None
     threshold: Optional[float] = 0.5
     segmenter_weights_path: Optional[str] = None
     classifier_weights_path: Optional[str] = None
+    # "full" classifies every slice; "bidirectional" scans inward from both ends
+    classifier_scan: Optional[str] = "full"
+    # Defaults to the tuned inference config (PDX_CLASSIFIER_BATCH_SIZE)
+    classifier_batch_size: Optional[int] = None
+    classifier_coarse_stride: Optional[int] = 0
+    # Reuse cached classifier scores / probability maps for identical slices
+    use_cache: Optional[bool] = True
+    # Optional per-job profiler: "cprofile" or "pyinstrument"
+    profile: Optional[str] = None
+    # Volume-level mask cleanup after segmentation; reapplied on re-threshold
+    postprocess: Optional[PostprocessSettings] = None
+    # Per-job memory budget in MiB (PDX_JOB_MEMORY_BUDGET_MB) and how decoded slices are
+    # kept: "auto", "float32", "native" or "reread" (PDX_SLICE_STORAGE)
+    memory_budget_mb: Optional[int] = None
+    slice_storage: Optional[str] = None
+
+
+class RethresholdRequest(BaseModel):
+    study_id: str
+    threshold: float
+    # Re-render overlays for changed slices now instead of on next request
+    render_overlays: Optional[bool] = False
+
+
+class PostprocessRequest(PostprocessSettings):
+    study_id: str
+
+
+class CohortRequest(BaseModel):
+    root: str
+    # Look for series in nested directories, not only directly under root
+    recursive: Optional[bool] = True
+    threshold: Optional[float] = 0.5
+    classifier_scan: Optional[str] = "full"
+    classifier_batch_size: Optional[int] = None
+    classifier_coarse_stride: Optional[int] = 0
+    use_cache: Optional[bool] = True
+    postprocess: Optional[PostprocessSettings] = None
+    memory_budget_mb: Optional[int] = None
+    slice_storage: Optional[str] = None
+
+
+class CohortStudy(BaseModel):
+    study_id: str
+    job_id: str
+    source: str
+    files: int
+    # True when an identical pending, running or recently finished job was returned
+    reused: bool = False
+
+
+class CohortResponse(BaseModel):
+    batch_id: str
+    studies: List[CohortStudy]
 
 
 class JobResponse(BaseModel):
     job_id: str
+    # True when an identical pending, running or recently finished job was returned
+    reused: bool = False
 
 
 class JobStatusResponse(BaseModel):
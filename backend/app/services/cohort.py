@@ -0,0 +1,105 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from app.services.dicom import list_dicom_files
+from app.services.jobs import JobRegistry, jobs
+
+
+# Studies of one cohort run on a small shared pool: while one study is in the classifier or
+# segmenter, the next is already decoding DICOMs, so the CPU does not idle between studies.
+COHORT_CONCURRENCY = int(os.environ.get("PDX_COHORT_CONCURRENCY", "2"))
+SCAN_WORKERS = int(os.environ.get("PDX_COHORT_SCAN_WORKERS", "8"))
+
+batches = JobRegistry()
+
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ThreadPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=max(1, COHORT_CONCURRENCY), thread_name_prefix="cohort")
+        return _pool
+
+
+def _scan_tree(top: str, recursive: bool) -> List[str]:
+    found: List[str] = []
+    if recursive:
+        for dirpath, dirnames, _ in os.walk(top):
+            dirnames[:] = sorted(d for d in dirnames if not d.startswith("."))
+            if list_dicom_files(dirpath):
+                found.append(dirpath)
+    elif list_dicom_files(top):
+        found.append(top)
+    return found
+
+
+def find_dicom_series(root: str, recursive: bool = True) -> List[str]:
+    """Directories under root that contain .dcm files, one series per directory."""
+    root = os.path.abspath(root)
+    series = [root] if list_dicom_files(root) else []
+    tops = sorted(
+        os.path.join(root, d) for d in os.listdir(root)
+        if not d.startswith(".") and os.path.isdir(os.path.join(root, d))
+    )
+    # Top-level subtrees (typically one per animal) are walked in parallel; listing large
+    # directories on network storage dominates the scan
+    with ThreadPoolExecutor(max_workers=max(1, SCAN_WORKERS)) as pool:
+        for found in pool.map(lambda top: _scan_tree(top, recursive), tops):
+            series.extend(found)
+    return series
+
+
+def enqueue_studies(batch_id: str, run_job: Callable[[str, str], None], job_ids: List[tuple]) -> None:
+    """Submit (job_id, study_id) pairs to the cohort pool; the batch is done when all finish."""
+    pool = _get_pool()
+    remaining = [len(job_ids)]
+    lock = threading.Lock()
+
+    def _run(job_id: str, study_id: str) -> None:
+        try:
+            run_job(job_id, study_id)
+        finally:
+            with lock:
+                remaining[0] -= 1
+                finished = remaining[0] == 0
+            if finished:
+                batches.set_result(batch_id, batch_summary(batch_id))
+
+    batches.set_status(batch_id, "running")
+    if not job_ids:
+        batches.set_result(batch_id, batch_summary(batch_id))
+    for job_id, study_id in job_ids:
+        pool.submit(_run, job_id, study_id)
+
+
+def batch_summary(batch_id: str) -> Optional[Dict[str, Any]]:
+    batch = batches.get(batch_id)
+    if not batch:
+        return None
+    studies = []
+    counts: Dict[str, int] = {}
+    for entry in batch["payload"].get("studies", []):
+        job = jobs.get(entry["job_id"]) or {}
+        status = job.get("status", "pending")
+        counts[status] = counts.get(status, 0) + 1
+        studies.append({**entry, "status": status, "error": job.get("error")})
+    total = len(studies)
+    finished = counts.get("done", 0) + counts.get("error", 0)
+    status = batch["status"]
+    if status == "done" and finished < total:
+        # Reused jobs are run by whoever created them and can outlive this batch's own jobs
+        status = "running"
+    return {
+        "batch_id": batch_id,
+        "status": status,
+        "root": batch["payload"].get("root"),
+        "total": total,
+        "counts": counts,
+        "progress": round(100.0 * finished / total, 1) if total else 100.0,
+        "studies": studies,
+    }
@@ -1,5 +1,47 @@
+import contextvars
 import os
-from typing import List
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import pydicom
+
+try:  # pydicom >= 3: decodes a single frame straight from the file, with a chosen plugin
+    from pydicom.pixels import get_decoder
+    from pydicom.pixels import pixel_array as _frame_array
+except ImportError:  # pragma: no cover - pydicom 2.x
+    get_decoder = None
+    _frame_array = None
+
+
+# Slices are (file, frame) pairs: a classic series has one file per slice, an enhanced
+# multi-frame file holds the whole stack. Frames are decoded on demand, one at a time, with
+# the fastest decoder installed for the transfer syntax; callers spread frames over a
+# thread pool to decode compressed series on several cores.
+
+# Fastest first: libjpeg-turbo/OpenJPEG/CharLS via pylibjpeg, then GDCM, then Pillow
+DECODER_PREFERENCE = tuple(
+    p.strip() for p in os.environ.get(
+        "PDX_DICOM_DECODERS", "pylibjpeg,gdcm,pyjpegls,pillow,pydicom"
+    ).split(",") if p.strip()
+)
+
+
+class DicomSlice(NamedTuple):
+    name: str
+    frame: int
+    frames: int
+    transfer_syntax: str
+
+
+def slice_label(s: DicomSlice) -> str:
+    """File name of a slice, with the frame number for multi-frame files ("mr_0007.dcm")."""
+    if s.frames <= 1:
+        return s.name
+    stem, ext = os.path.splitext(s.name)
+    return f"{stem}_{s.frame + 1:0{len(str(s.frames))}d}{ext}"
 
 
 def list_dicom_files(directory: str) -> List[str]:
@@ -11,3 +53,147 @@ def list_dicom_files(directory: str) -> List[str]:
     return files
 
 
+_slices_cache: Dict[str, Tuple[Any, List[DicomSlice]]] = {}
+_slices_lock = threading.Lock()
+
+
+def _file_slices(directory: str, name: str) -> List[DicomSlice]:
+    try:
+        ds = pydicom.dcmread(os.path.join(directory, name), stop_before_pixels=True, specific_tags=["NumberOfFrames"])
+        frames = int(ds.get("NumberOfFrames", 1) or 1)
+        syntax = str(ds.file_meta.get("TransferSyntaxUID", ""))
+    except Exception:
+        # Unreadable headers fail later, at decode time, like before
+        frames, syntax = 1, ""
+    return [DicomSlice(name, frame, frames, syntax) for frame in range(max(1, frames))]
+
+
+def directory_signature(directory: str, names: Optional[List[str]] = None) -> Optional[Tuple[int, Tuple[str, ...]]]:
+    """Folder mtime and DICOM file names: changes when files are added, removed or replaced."""
+    try:
+        return (os.stat(directory).st_mtime_ns, tuple(list_dicom_files(directory) if names is None else names))
+    except OSError:
+        return None
+
+
+def list_dicom_slices(directory: str) -> List[DicomSlice]:
+    """Every slice in a series folder in order: files sorted by name, frames within a file."""
+    names = list_dicom_files(directory)
+    signature = directory_signature(directory, names)
+    with _slices_lock:
+        cached = _slices_cache.get(directory)
+    if cached is not None and signature is not None and cached[0] == signature:
+        return cached[1]
+    slices = [s for name in names for s in _file_slices(directory, name)]
+    if signature is not None:
+        with _slices_lock:
+            _slices_cache[directory] = (signature, slices)
+    return slices
+
+
+@lru_cache(maxsize=None)
+def decoding_plugin(transfer_syntax: str) -> str:
+    """Preferred installed decoder for a transfer syntax; "" lets pydicom choose."""
+    if get_decoder is None or not transfer_syntax:
+        return ""
+    try:
+        available = get_decoder(pydicom.uid.UID(transfer_syntax)).available_plugins
+    except (NotImplementedError, ValueError):
+        return ""
+    return next((p for p in DECODER_PREFERENCE if p in available), "")
+
+
+# pydicom 2.x handler modules (pydicom.pixel_data_handlers.*) for each pydicom 3 plugin name
+_HANDLERS = {
+    "pylibjpeg": ("pylibjpeg_handler",),
+    "gdcm": ("gdcm_handler",),
+    "pyjpegls": ("jpeg_ls_handler",),
+    "pillow": ("pillow_handler",),
+    "pydicom": ("numpy_handler", "rle_handler"),
+}
+
+if _frame_array is None:  # pragma: no cover - pydicom 2.x: one global handler order
+    _by_name = {h.__name__.rsplit(".", 1)[-1]: h for h in pydicom.config.pixel_data_handlers}
+    _preferred = [
+        _by_name[n] for p in DECODER_PREFERENCE for n in _HANDLERS.get(p, ())
+        if n in _by_name and _by_name[n].is_available()
+    ]
+    pydicom.config.pixel_data_handlers = _preferred + [
+        h for h in pydicom.config.pixel_data_handlers if h not in _preferred
+    ]
+
+
+class _FrameCache:
+    """
+    pydicom 2.x cannot decode a single frame, so a multi-frame file is decoded once per
+    session and its frames handed out from that array. The array is dropped once every
+    frame has been read; a second pass over the file decodes it once more.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._entries: Dict[str, List[Any]] = {}  # path -> [lock, array, frames left]
+
+    def frame(self, path: str, s: DicomSlice) -> np.ndarray:
+        with self._lock:
+            entry = self._entries.setdefault(path, [threading.Lock(), None, s.frames])
+        with entry[0]:
+            if entry[1] is None:
+                entry[1] = pydicom.dcmread(path).pixel_array
+            arr = np.array(entry[1][s.frame])
+            entry[2] -= 1
+            if entry[2] <= 0:
+                entry[1] = None
+                with self._lock:
+                    if self._entries.get(path) is entry:
+                        del self._entries[path]
+        return arr
+
+
+_frame_cache: "contextvars.ContextVar[Optional[_FrameCache]]" = contextvars.ContextVar("pdx_frame_cache", default=None)
+
+
+@contextmanager
+def decode_session() -> Iterator[None]:
+    """
+    Scope for reading many slices of a series (a pipeline run, a volume build). On pydicom
+    2.x it shares decoded multi-frame files between the reads, including reads from pipeline
+    stage threads started inside it; on pydicom 3 frames are decoded singly and it is a no-op.
+    """
+    if _frame_array is not None or _frame_cache.get() is not None:
+        yield
+        return
+    token = _frame_cache.set(_FrameCache())
+    try:
+        yield
+    finally:
+        _frame_cache.reset(token)
+
+
+def read_slice_pixels(directory: str, s: DicomSlice) -> np.ndarray:
+    """
+    Stored pixel values of one slice; only that frame of a multi-frame file is decoded
+    (on pydicom 2.x, the file is decoded once per decode_session).
+    """
+    path = os.path.join(directory, s.name)
+    index: Optional[int] = s.frame if s.frames > 1 else None
+    if _frame_array is not None:
+        return _frame_array(path, index=index, decoding_plugin=decoding_plugin(s.transfer_syntax))
+    frames = _frame_cache.get()
+    if index is not None and frames is not None:
+        return frames.frame(path, s)
+    arr = pydicom.dcmread(path).pixel_array
+    return arr[s.frame] if index is not None else arr
+
+
+def functional_group(ds: Any, frame: int, keyword: str) -> Optional[Any]:
+    """
+    Item of a functional group macro (e.g. "PlanePositionSequence") for one frame of an
+    enhanced multi-frame dataset: the per-frame value, else the shared one.
+    """
+    for groups, idx in (("PerFrameFunctionalGroupsSequence", frame), ("SharedFunctionalGroupsSequence", 0)):
+        try:
+            return getattr(getattr(ds, groups)[idx], keyword)[0]
+        except (AttributeError, IndexError, KeyError, TypeError):
+            continue
+    return None
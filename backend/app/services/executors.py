@@ -0,0 +1,69 @@
+import asyncio
+import functools
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, TypeVar
+
+
+# Blocking work leaves the event loop through one of three bounded pools, so a heavy export
+# cannot starve slice serving:
+#   io      - disk reads/writes, directory listings, DICOM header reads
+#   cpu     - PIL/numpy/zlib work, which mostly releases the GIL
+#   process - pure-Python CPU work that holds the GIL (e.g. openpyxl workbooks)
+# Pool sizes are the per-pool concurrency limits; excess calls queue in the pool.
+
+IO_WORKERS = int(os.environ.get("PDX_IO_WORKERS", "16"))
+CPU_WORKERS = int(os.environ.get("PDX_CPU_WORKERS", str(min(8, os.cpu_count() or 1))))
+PROCESS_WORKERS = int(os.environ.get("PDX_PROCESS_WORKERS", "2"))
+
+T = TypeVar("T")
+
+_pools: Dict[str, Executor] = {}
+_lock = threading.Lock()
+
+
+def _create(kind: str) -> Executor:
+    if kind == "io":
+        return ThreadPoolExecutor(max_workers=max(1, IO_WORKERS), thread_name_prefix="pdx-io")
+    if kind == "cpu":
+        return ThreadPoolExecutor(max_workers=max(1, CPU_WORKERS), thread_name_prefix="pdx-cpu")
+    if kind == "process":
+        # spawn: forking a process that may hold TensorFlow/thread-pool state is unsafe
+        return ProcessPoolExecutor(max_workers=max(1, PROCESS_WORKERS), mp_context=multiprocessing.get_context("spawn"))
+    raise ValueError(f"unknown pool {kind!r}")
+
+
+def get_pool(kind: str) -> Executor:
+    with _lock:
+        pool = _pools.get(kind)
+        if pool is None:
+            pool = _pools[kind] = _create(kind)
+        return pool
+
+
+async def _run(kind: str, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_pool(kind), functools.partial(fn, *args, **kwargs))
+
+
+async def run_io(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    return await _run("io", fn, *args, **kwargs)
+
+
+async def run_cpu(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    return await _run("cpu", fn, *args, **kwargs)
+
+
+async def run_process(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """fn and its arguments must be picklable (module-level function, plain data)."""
+    return await _run("process", fn, *args, **kwargs)
+
+
+def shutdown_pools() -> None:
+    with _lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.shutdown(wait=False, cancel_futures=True)
@@ -1,5 +1,15 @@
-from typing import Iterable, List
+from functools import partial
+from typing import Iterable, Iterator, List
 import csv
+import io
+import os
+
+from app.services.dicom import list_dicom_slices, slice_label
+from app.services.metadata import read_study_info
+from app.services.morphology import cached_morphology
+from app.services.pipeline import Stage, prefetch
+from app.services.storage import get_study_dicom_source_dir
+from app.services.volume import load_raw_areas, scale_all_areas
 
 
 def write_volumes_csv(images_dcm: List[str], scaled_slice_areas: Iterable[float], total_volume: float, csv_filename: str) -> None:
@@ -15,3 +25,96 @@ def write_volumes_csv(images_dcm: List[str], scaled_slice_areas: Iterable[float]
         writer.writerow(["Total tumor volume (cc)", total_volume])
 
 
+COHORT_COLUMNS = [
+    "study_id", "source", "patient_id", "study_date", "series_description", "modality",
+    "pixel_spacing_row_mm", "pixel_spacing_col_mm", "slice_thickness_mm", "num_slices",
+    "total_volume_cc", "slice", "slice_name", "raw_area_px", "area_cc",
+]
+# Opt-in; taken from morphology.json only, so studies without current stats get empty cells
+MORPHOLOGY_COLUMNS = [
+    "position_volume_cc", "surface_area_mm2", "max_diameter_mm", "num_components",
+    "slice_position_mm", "slice_volume_cc",
+]
+
+
+def _study_rows(study_id: str, morphology: bool = False) -> List[list]:
+    # Stored areas and cached header tags only; masks are decoded just once if a study
+    # predates the area index
+    source = get_study_dicom_source_dir(study_id)
+    names = [slice_label(s) for s in list_dicom_slices(source)] if os.path.isdir(source) else []
+    info = read_study_info(study_id)
+    spacing = info.get("pixel_spacing_mm") or [1.0, 1.0]
+    thickness = float(info.get("slice_thickness_mm") or 1.0)
+    raw_areas = load_raw_areas(study_id)
+    scaled = scale_all_areas(raw_areas, thickness, spacing)
+    total = float(sum(scaled))
+    head = [
+        study_id, source, info.get("patient_id", ""), info.get("study_date", ""),
+        info.get("series_description", ""), info.get("modality", ""),
+        float(spacing[0]), float(spacing[1]), thickness, len(raw_areas), total,
+    ]
+    rows = [
+        head + [i + 1, names[i] if i < len(names) else "", raw, area]
+        for i, (raw, area) in enumerate(zip(raw_areas, scaled))
+    ]
+    if not morphology:
+        return rows
+    morph = cached_morphology(study_id) if raw_areas else None
+    if morph is not None and len(morph["slice_volumes_cc"]) == len(raw_areas):
+        tail = [morph["total_volume_cc"], morph["surface_area_mm2"], morph["max_diameter_mm"], morph["num_components"]]
+        per_slice = list(zip(morph["slice_positions_mm"], morph["slice_volumes_cc"]))
+    else:
+        tail = [None] * 4
+        per_slice = [(None, None)] * len(raw_areas)
+    return [row + tail + list(per_slice[i]) for i, row in enumerate(rows)]
+
+
+def iter_cohort_rows(study_ids: Iterable[str], workers: int = 8, morphology: bool = False) -> Iterator[List[list]]:
+    """
+    Per-slice rows for each study, in the given order. At most `workers` studies are read
+    ahead of the consumer; closing the generator (client gone) cancels the rest.
+    """
+    with Stage("export", workers) as stage:
+        yield from prefetch(stage, partial(_study_rows, morphology=morphology), study_ids, ahead=max(1, workers))
+
+
+def stream_cohort_csv(study_ids: Iterable[str], morphology: bool = False) -> Iterator[str]:
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(COHORT_COLUMNS + (MORPHOLOGY_COLUMNS if morphology else []))
+    for rows in iter_cohort_rows(study_ids, morphology=morphology):
+        writer.writerows(rows)
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue()
+
+
+def write_cohort_parquet(study_ids: Iterable[str], out, morphology: bool = False) -> None:
+    """Write one Parquet row group per study to a path or binary file object (needs pyarrow)."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    fields = [
+        ("study_id", pa.string()), ("source", pa.string()), ("patient_id", pa.string()),
+        ("study_date", pa.string()), ("series_description", pa.string()), ("modality", pa.string()),
+        ("pixel_spacing_row_mm", pa.float64()), ("pixel_spacing_col_mm", pa.float64()),
+        ("slice_thickness_mm", pa.float64()), ("num_slices", pa.int32()),
+        ("total_volume_cc", pa.float64()), ("slice", pa.int32()), ("slice_name", pa.string()),
+        ("raw_area_px", pa.int64()), ("area_cc", pa.float64()),
+    ]
+    if morphology:
+        fields += [
+            ("position_volume_cc", pa.float64()), ("surface_area_mm2", pa.float64()),
+            ("max_diameter_mm", pa.float64()), ("num_components", pa.int32()),
+            ("slice_position_mm", pa.float64()), ("slice_volume_cc", pa.float64()),
+        ]
+    schema = pa.schema(fields)
+    with pq.ParquetWriter(out, schema) as writer:
+        for rows in iter_cohort_rows(study_ids, morphology=morphology):
+            if rows:
+                columns = list(zip(*rows))
+                writer.write_table(pa.Table.from_arrays(
+                    [pa.array(col, type=field.type) for col, field in zip(columns, schema)], schema=schema
+                ))
@@ -0,0 +1,97 @@
+import io
+from typing import Any, Dict, List, Optional, Sequence
+
+
+def build_volumes_workbook(
+    study_id: str,
+    meta: Dict[str, Any],
+    pixel_spacing_mm: Sequence[float],
+    thickness_mm: float,
+    dcm_files: List[str],
+    raw_counts: List[int],
+    morphology: Optional[Dict[str, Any]] = None,
+) -> bytes:
+    # Module-level with plain-data arguments so it can run in the export process pool
+    import openpyxl
+    from openpyxl.utils import get_column_letter
+
+    # Build workbook with formulas
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = "Volumes"
+
+    # Metadata block
+    ws.append(["Study ID", study_id])
+    ws.append(["Patient ID", meta.get("patient_id", "")])
+    ws.append(["Study Date", meta.get("study_date", "")])
+    ws.append(["Pixel Spacing mm", f"{pixel_spacing_mm[0]}", f"{pixel_spacing_mm[1]}"])
+    px_row = ws.max_row
+    ws.append(["Slice Thickness mm", thickness_mm])
+    th_row = ws.max_row
+    ws.append(["Spacing Between Slices (mm)", meta.get("spacing_between_slices_mm", "")])
+    ws.append(["Image Height (px)", meta.get("height", "")])
+    ws.append(["Image Width (px)", meta.get("width", "")])
+    # Two blank rows before table
+    ws.append(["", "", ""])  # Empty row with 3 columns
+    ws.append(["", "", ""])  # Empty row with 3 columns
+
+    # Header for per-slice table
+    start_row = ws.max_row + 1
+    ws.cell(row=start_row, column=1, value="Slice (DICOM)")
+    ws.cell(row=start_row, column=2, value="Raw area (pixels)")
+    ws.cell(row=start_row, column=3, value="Scaled area (cc)")
+
+    # Constants cells for formulas (pixel spacing and thickness)
+    pxr, pxc = px_row, 2  # pixel spacing x at column B
+    pyr, pyc = px_row, 3  # pixel spacing y at column C
+    thr, thc = th_row, 2  # thickness at column B
+
+    for i, (name, raw) in enumerate(zip(dcm_files, raw_counts), start=1):
+        r = start_row + i
+        ws.cell(row=r, column=1, value=name)
+        ws.cell(row=r, column=2, value=raw)
+        # Formula: raw * thickness_mm * px * py / 1000
+        ws.cell(row=r, column=3, value=f"=B{r}*$B{thr}*$B{pxr}*$C{pyr}/1000")
+
+    # Total row
+    end_row = start_row + len(dcm_files)
+    ws.cell(row=end_row + 1, column=1, value="Total volume (cc)")
+    ws.cell(row=end_row + 1, column=3, value=f"=SUM(C{start_row+1}:C{end_row})")
+
+    # Autosize some columns
+    for col in range(1, 4):
+        letter = get_column_letter(col)
+        ws.column_dimensions[letter].width = 22
+
+    if morphology:
+        _add_morphology_sheet(wb, morphology, dcm_files)
+
+    mem = io.BytesIO()
+    wb.save(mem)
+    return mem.getvalue()
+
+
+def _add_morphology_sheet(wb: Any, morphology: Dict[str, Any], dcm_files: List[str]) -> None:
+    ws = wb.create_sheet("Morphology")
+    bbox = morphology.get("bounding_box") or {}
+    centroid = morphology.get("centroid") or {}
+    ws.append(["Volume from slice positions (cc)", morphology["total_volume_cc"]])
+    ws.append(["Slice spacing source", morphology["z_spacing_source"]])
+    ws.append(["Surface area (mm2)", morphology["surface_area_mm2"]])
+    ws.append(["Max diameter (mm)", morphology["max_diameter_mm"]])
+    ws.append(["Connected components", morphology["num_components"]])
+    ws.append(["Bounding box slices", *bbox.get("slices", [])])
+    ws.append(["Bounding box rows", *bbox.get("rows", [])])
+    ws.append(["Bounding box cols", *bbox.get("cols", [])])
+    ws.append(["Bounding box size (mm)", *bbox.get("size_mm", [])])
+    ws.append(["Centroid (slice, row, col)", *[centroid[k] for k in ("slice", "row", "col") if k in centroid]])
+    ws.append(["Centroid (mm)", *centroid.get("position_mm", [])])
+    ws.append([])
+    ws.append(["Slice (DICOM)", "Position (mm)", "Extent (mm)", "Area (mm2)", "Volume (cc)"])
+    rows = zip(
+        dcm_files, morphology["slice_positions_mm"], morphology["slice_extents_mm"],
+        morphology["slice_areas_mm2"], morphology["slice_volumes_cc"],
+    )
+    for row in rows:
+        ws.append(list(row))
+    ws.column_dimensions["A"].width = 30
@@ -1,17 +1,18 @@
 import os
-from typing import List
+from typing import List, Optional
 
 import numpy as np
 from PIL import Image
-import pydicom
 
-from app.services.storage import get_study_subdir, get_study_dicom_source_dir
-from app.services.dicom import list_dicom_files
+from app.services.dicom import DicomSlice, decode_session, read_slice_pixels
+from app.services.preview import EXTENSIONS, encoder_params
+from app.services.storage import atomic_save_image, study_store
+from app.services.metrics import stage_timer
 
 
-def _read_dicom_pixel_array(dicom_path: str) -> np.ndarray:
-    ds = pydicom.dcmread(dicom_path)
-    arr = ds.pixel_array.astype(np.float32)
+def _read_dicom_pixel_array(dicom_dir: str, s: DicomSlice) -> np.ndarray:
+    with stage_timer("dicom_decode"):
+        arr = read_slice_pixels(dicom_dir, s).astype(np.float32)
     # Normalize to 0-255
     arr = arr - arr.min()
     if arr.max() > 0:
@@ -21,24 +22,72 @@ def _read_dicom_pixel_array(dicom_path: str) -> np.ndarray:
 
 
 def ensure_png_slices(study_id: str) -> List[str]:
-    dicom_dir = get_study_dicom_source_dir(study_id)
-    png_dir = get_study_subdir(study_id, "png")
-    dcm_files = list_dicom_files(dicom_dir)
-    generated: List[str] = []
-    for idx, name in enumerate(dcm_files, start=1):
-        src = os.path.join(dicom_dir, name)
-        out_name = f"{idx}.png"
-        dst = os.path.join(png_dir, out_name)
-        if not os.path.exists(dst):
-            arr = _read_dicom_pixel_array(src)
-            Image.fromarray(arr, mode='L').save(dst)
-        generated.append(out_name)
+    slices = study_store.dicom_slices(study_id)
+    generated = [f"{idx}.png" for idx in range(1, len(slices) + 1)]
+    # Once every slice has been converted, later calls only check the directory is still there
+    if study_store.pngs_complete(study_id):
+        if os.path.isdir(os.path.join(study_store.root, study_id, "png")):
+            return generated
+        study_store.forget(study_id)
+    dicom_dir = study_store.source_dir(study_id)
+    with decode_session():
+        for idx, s in enumerate(slices, start=1):
+            dst = study_store.png_path(study_id, idx)
+            if not os.path.exists(dst):
+                arr = _read_dicom_pixel_array(dicom_dir, s)
+                study_store.write_png(study_id, idx, Image.fromarray(arr, mode='L'), **encoder_params("png"))
+    if slices:
+        study_store.mark_pngs_complete(study_id)
     return generated
 
 
 def get_png_path(study_id: str, slice_index: int) -> str:
-    png_dir = get_study_subdir(study_id, "png")
-    path = os.path.join(png_dir, f"{slice_index}.png")
-    return path
+    return study_store.png_path(study_id, slice_index)
+
+
+def preview_path(study_id: str, slice_index: int, fmt: str) -> str:
+    if fmt == "png":
+        return get_png_path(study_id, slice_index)
+    return os.path.join(study_store.subdir(study_id, fmt), f"{slice_index}.{EXTENSIONS[fmt]}")
+
 
+# Added to signed stored values so they fit a 16-bit PNG; the same for every slice of a series
+SIGNED_BIAS = 32768
 
+
+def _read_dicom_16bit(dicom_dir: str, s: DicomSlice) -> np.ndarray:
+    with stage_timer("dicom_decode"):
+        raw = read_slice_pixels(dicom_dir, s)
+    # Full dynamic range, no rescaling to 8 bits: unsigned values as stored, signed ones
+    # shifted by a fixed bias so slices of a series stay comparable
+    arr = raw.astype(np.int64)
+    if np.issubdtype(raw.dtype, np.signedinteger):
+        arr += SIGNED_BIAS
+    return np.clip(arr, 0, 65535).astype(np.uint16)
+
+
+def ensure_preview(study_id: str, slice_index: int, fmt: str) -> Optional[str]:
+    """
+    Path of a slice preview ("png", lossless "webp" or 16-bit "png16"), encoding it on first
+    request. None when the slice does not exist.
+    """
+    slices = study_store.dicom_slices(study_id)
+    if slice_index < 1 or slice_index > len(slices):
+        return None
+    path = preview_path(study_id, slice_index, fmt)
+    if fmt == "png" and not os.path.exists(path):
+        ensure_png_slices(study_id)
+    if fmt == "png" or os.path.exists(path):
+        return path if os.path.exists(path) else None
+    if fmt == "webp":
+        # Encoded from the 8-bit preview so both formats show identical pixels
+        png_path = get_png_path(study_id, slice_index)
+        if not os.path.exists(png_path):
+            ensure_png_slices(study_id)
+        img = Image.open(png_path)
+        img.load()
+    else:
+        img = Image.fromarray(_read_dicom_16bit(study_store.source_dir(study_id), slices[slice_index - 1]))
+    with stage_timer("preview_encode", format=fmt):
+        atomic_save_image(img, path, **encoder_params(fmt))
+    return path
@@ -0,0 +1,37 @@
+from typing import List
+
+import numpy as np
+
+from app.services.inference_worker import get_worker_client
+from app.services.model_registry import get_classifier, get_segmenter
+
+
+# Single entry point for model execution. With PDX_INFERENCE_WORKER set, batches go to the
+# shared inference worker process; otherwise models run in this process.
+
+
+def run_classifier_local(batch: np.ndarray, weights_path: str) -> List[float]:
+    from app.models.classifier_model.architectures.resnet50 import predict_tumor_scores
+
+    return predict_tumor_scores(get_classifier(weights_path), batch)
+
+
+def run_segmenter_local(batch: np.ndarray, weights_path: str) -> np.ndarray:
+    preds = get_segmenter(weights_path).predict(batch, batch_size=len(batch), verbose=0)
+    return np.squeeze(preds, axis=-1)  # N,H,W
+
+
+def classifier_scores(batch: np.ndarray, weights_path: str) -> List[float]:
+    """Tumor scores for an un-normalized (N,H,W,1) batch at classifier input size."""
+    client = get_worker_client()
+    if client is not None:
+        return client.classifier_scores(batch, weights_path)
+    return run_classifier_local(batch, weights_path)
+
+
+def segmenter_probabilities(batch: np.ndarray, weights_path: str) -> np.ndarray:
+    """(N,H,W) probability maps for a normalized (N,H,W,1) batch at segmenter input size."""
+    client = get_worker_client()
+    if client is not None:
+        return client.segmenter_probabilities(batch, weights_path)
+    return run_segmenter_local(batch, weights_path)
@@ -0,0 +1,210 @@
+import hashlib
+import os
+import threading
+from collections import Counter, OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+from app.services.storage import BASE_STORAGE_DIR, atomic_save_npy
+from app.utils.image_preprocessing import PREPROCESSING_VERSION
+
+
+CACHE_DIR = os.path.join(BASE_STORAGE_DIR, "cache", "inference")
+# Size cap in MB; 0 disables the cache
+CACHE_MAX_MB = int(os.environ.get("PDX_INFERENCE_CACHE_MAX_MB", "2048"))
+
+
+def hash_pixels(pixels: np.ndarray) -> str:
+    """Content hash of decoded slice pixels (dtype and shape included)."""
+    h = hashlib.sha256()
+    h.update(str(pixels.dtype).encode())
+    h.update(str(pixels.shape).encode())
+    h.update(np.ascontiguousarray(pixels).data)
+    return h.hexdigest()
+
+
+_weights_hashes: Dict[Tuple[str, int, float], str] = {}
+_weights_lock = threading.Lock()
+
+
+def weights_fingerprint(weights_path: str) -> str:
+    """SHA-256 of a weights file, memoized on (path, size, mtime) so large files hash once."""
+    path = os.path.abspath(weights_path)
+    st = os.stat(path)
+    memo_key = (path, st.st_size, st.st_mtime)
+    with _weights_lock:
+        cached = _weights_hashes.get(memo_key)
+    if cached:
+        return cached
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    digest = h.hexdigest()
+    with _weights_lock:
+        _weights_hashes[memo_key] = digest
+    return digest
+
+
+def make_cache_key(pixel_hash: str, weights_hash: str) -> str:
+    raw = f"{pixel_hash}:{weights_hash}:{PREPROCESSING_VERSION}"
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class InferenceCache:
+    """
+    Persistent, content-addressed store of per-slice model outputs.
+
+    Entries live under <root>/<kind>/<key[:2]>/<key>.npy. The in-memory index keeps LRU
+    order and is rebuilt from file mtimes on first use, so the order survives restarts.
+    """
+
+    def __init__(self, root_dir: str, max_bytes: int) -> None:
+        self._root = root_dir
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, int]" = OrderedDict()  # relpath -> size, LRU first
+        self._total_bytes = 0
+        self._loaded = False
+        self._hits: Counter = Counter()
+        self._misses: Counter = Counter()
+        self._evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self._max_bytes > 0
+
+    def _relpath(self, kind: str, key: str) -> str:
+        return os.path.join(kind, key[:2], f"{key}.npy")
+
+    def _load_index_locked(self) -> None:
+        if self._loaded:
+            return
+        found = []
+        for dirpath, _, filenames in os.walk(self._root):
+            for fn in filenames:
+                if not fn.endswith(".npy"):
+                    continue
+                path = os.path.join(dirpath, fn)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                found.append((st.st_mtime, os.path.relpath(path, self._root), st.st_size))
+        found.sort()
+        for _, rel, size in found:
+            self._entries[rel] = size
+            self._total_bytes += size
+        self._loaded = True
+
+    def _evict_locked(self) -> None:
+        while self._total_bytes > self._max_bytes and self._entries:
+            rel, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            self._evictions += 1
+            try:
+                os.remove(os.path.join(self._root, rel))
+            except OSError:
+                pass
+
+    def evict_bytes(self, nbytes: int) -> int:
+        """Evict least recently used entries until nbytes are freed; returns bytes freed."""
+        freed = 0
+        with self._lock:
+            self._load_index_locked()
+            while freed < nbytes and self._entries:
+                rel, size = self._entries.popitem(last=False)
+                self._total_bytes -= size
+                self._evictions += 1
+                freed += size
+                try:
+                    os.remove(os.path.join(self._root, rel))
+                except OSError:
+                    pass
+        return freed
+
+    def get(self, kind: str, key: str) -> Optional[np.ndarray]:
+        if not self.enabled:
+            return None
+        rel = self._relpath(kind, key)
+        with self._lock:
+            self._load_index_locked()
+            if rel not in self._entries:
+                self._misses[kind] += 1
+                return None
+            self._entries.move_to_end(rel)
+        path = os.path.join(self._root, rel)
+        try:
+            value = np.load(path)
+            os.utime(path)
+        except (OSError, ValueError):
+            with self._lock:
+                size = self._entries.pop(rel, None)
+                if size is not None:
+                    self._total_bytes -= size
+                self._misses[kind] += 1
+            return None
+        with self._lock:
+            self._hits[kind] += 1
+        return value
+
+    def put(self, kind: str, key: str, value: np.ndarray) -> None:
+        if not self.enabled:
+            return
+        rel = self._relpath(kind, key)
+        path = os.path.join(self._root, rel)
+        # Unique temp name: the inference worker and process pools write here too
+        atomic_save_npy(path, value)
+        size = os.path.getsize(path)
+        with self._lock:
+            self._load_index_locked()
+            old = self._entries.pop(rel, None)
+            if old is not None:
+                self._total_bytes -= old
+            self._entries[rel] = size
+            self._total_bytes += size
+            self._evict_locked()
+
+    def get_classifier_score(self, key: str) -> Optional[float]:
+        value = self.get("classifier", key)
+        return None if value is None else float(value.reshape(-1)[0])
+
+    def put_classifier_score(self, key: str, score: float) -> None:
+        self.put("classifier", key, np.array([score], dtype=np.float32))
+
+    def get_probability_map(self, key: str) -> Optional[np.ndarray]:
+        value = self.get("segmenter", key)
+        return None if value is None else value.astype(np.float32)
+
+    def put_probability_map(self, key: str, prob: np.ndarray) -> None:
+        self.put("segmenter", key, prob.astype(np.float16))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._load_index_locked()
+            kinds = set(self._hits) | set(self._misses)
+            per_kind = {}
+            for kind in sorted(kinds):
+                total = self._hits[kind] + self._misses[kind]
+                per_kind[kind] = {
+                    "hits": self._hits[kind],
+                    "misses": self._misses[kind],
+                    "hit_rate": (self._hits[kind] / total) if total else 0.0,
+                }
+            hits = sum(self._hits.values())
+            misses = sum(self._misses.values())
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_bytes": self._max_bytes,
+                "hits": hits,
+                "misses": misses,
+                "hit_rate": (hits / (hits + misses)) if (hits + misses) else 0.0,
+                "evictions": self._evictions,
+                "by_kind": per_kind,
+            }
+
+
+inference_cache = InferenceCache(CACHE_DIR, CACHE_MAX_MB * 1024 * 1024)
@@ -0,0 +1,94 @@
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+
+# Thread pools, batch sizes and job concurrency for TensorFlow inference. Values come from
+# the file written by `python -m benchmarks.autotune` (PDX_INFERENCE_CONFIG), and each can
+# be overridden by its own environment variable. 0 threads means TensorFlow's default.
+
+logger = logging.getLogger(__name__)
+
+CONFIG_PATH = os.environ.get("PDX_INFERENCE_CONFIG", "")
+
+DEFAULTS: Dict[str, int] = {
+    "intra_op_threads": 0,
+    "inter_op_threads": 0,
+    "segmenter_batch_size": 4,
+    "classifier_batch_size": 8,
+    # Segmentation jobs running model inference at once; 0 = unlimited
+    "max_concurrent_jobs": 0,
+}
+ENV_VARS = {
+    "intra_op_threads": "PDX_TF_INTRA_OP_THREADS",
+    "inter_op_threads": "PDX_TF_INTER_OP_THREADS",
+    "segmenter_batch_size": "PDX_SEGMENTER_BATCH_SIZE",
+    "classifier_batch_size": "PDX_CLASSIFIER_BATCH_SIZE",
+    "max_concurrent_jobs": "PDX_MAX_CONCURRENT_JOBS",
+}
+
+
+def load_inference_config(path: Optional[str] = CONFIG_PATH) -> Dict[str, int]:
+    config = dict(DEFAULTS)
+    if path:
+        try:
+            with open(path, "r") as f:
+                tuned = json.load(f)
+            # The autotune file also records its measurements; only known keys are settings
+            config.update({k: int(v) for k, v in tuned.get("config", tuned).items() if k in DEFAULTS})
+        except (OSError, ValueError, AttributeError) as exc:
+            logger.warning("Ignoring inference config %s: %s", path, exc)
+    for key, var in ENV_VARS.items():
+        if os.environ.get(var):
+            config[key] = int(os.environ[var])
+    return config
+
+
+inference_config = load_inference_config()
+
+_configured = False
+_configure_lock = threading.Lock()
+
+
+def configure_tensorflow(config: Dict[str, int] = inference_config) -> None:
+    """Apply thread pool sizes; must run before TensorFlow executes its first op."""
+    global _configured
+    with _configure_lock:
+        if _configured:
+            return
+        _configured = True
+        if not (config["intra_op_threads"] or config["inter_op_threads"]):
+            return
+        import tensorflow as tf
+
+        try:
+            if config["intra_op_threads"]:
+                tf.config.threading.set_intra_op_parallelism_threads(config["intra_op_threads"])
+            if config["inter_op_threads"]:
+                tf.config.threading.set_inter_op_parallelism_threads(config["inter_op_threads"])
+        except RuntimeError as exc:
+            # TensorFlow was already initialized (e.g. by an earlier import); keep its pools
+            logger.warning("TensorFlow thread settings not applied: %s", exc)
+
+
+_job_slots = (
+    threading.BoundedSemaphore(inference_config["max_concurrent_jobs"])
+    if inference_config["max_concurrent_jobs"] > 0 else None
+)
+
+
+@contextmanager
+def job_slot() -> Iterator[None]:
+    """Wait for a free inference slot so concurrent jobs do not oversubscribe the cores."""
+    if _job_slots is None:
+        yield
+        return
+    with _job_slots:
+        yield
+
+
+def describe() -> Dict[str, Any]:
+    return {"source": CONFIG_PATH or None, **inference_config}
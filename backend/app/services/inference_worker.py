@@ -0,0 +1,243 @@
+"""
+Local inference worker shared by all API workers.
+
+One process owns the classifier and segmenter; API processes send slice batches over a
+Unix socket (multiprocessing.connection) and pass the pixel data through
+multiprocessing.shared_memory, so batches are not pickled or copied through the socket.
+
+Run it next to uvicorn and point the API at it:
+
+    python -m app.services.inference_worker --socket /tmp/pdx-inference.sock
+    PDX_INFERENCE_WORKER=/tmp/pdx-inference.sock uvicorn app.main:app --workers 4
+
+Unless PDX_INFERENCE_WORKER_AUTHKEY is set, the worker generates a random connection key
+on every start and writes it to <socket>.key, readable only by its user; clients read it
+from there.
+"""
+import argparse
+import logging
+import os
+import secrets
+import threading
+from multiprocessing import AuthenticationError, shared_memory
+from multiprocessing.connection import Client, Connection, Listener
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+WORKER_ADDRESS = os.environ.get("PDX_INFERENCE_WORKER") or ""
+# Empty: a per-run random key, shared through the key file next to the socket
+WORKER_AUTHKEY = os.environ.get("PDX_INFERENCE_WORKER_AUTHKEY", "").encode()
+# Batches run concurrently inside the worker; 1 keeps TF thread pools from oversubscribing cores
+WORKER_CONCURRENCY = int(os.environ.get("PDX_INFERENCE_WORKER_CONCURRENCY", "1"))
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    # The creating process owns (and unlinks) the segment; keep this side's resource
+    # tracker from unlinking it again on exit
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)  # Python 3.13+
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        try:
+            from multiprocessing import resource_tracker
+
+            resource_tracker.unregister(shm._name, "shared_memory")  # type: ignore[attr-defined]
+        except Exception:
+            pass
+        return shm
+
+
+def _shared_copy(arr: np.ndarray) -> Tuple[shared_memory.SharedMemory, Dict[str, Any]]:
+    shm = shared_memory.SharedMemory(create=True, size=max(1, arr.nbytes))
+    view = np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)
+    view[...] = arr
+    return shm, {"name": shm.name, "shape": list(arr.shape), "dtype": str(arr.dtype)}
+
+
+def key_path(address: str) -> str:
+    return address + ".key"
+
+
+# ---- client (API workers) ----
+
+class InferenceWorkerClient:
+    def __init__(self, address: str, authkey: bytes = WORKER_AUTHKEY) -> None:
+        self.address = address
+        self.authkey = authkey
+
+    def _authkey(self) -> bytes:
+        if self.authkey:
+            return self.authkey
+        # Re-read on every call: a restarted worker has a new key
+        with open(key_path(self.address), "rb") as f:
+            return f.read().strip()
+
+    def _call(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            conn = Client(self.address, family="AF_UNIX", authkey=self._authkey())
+        except (OSError, EOFError, AuthenticationError) as exc:
+            raise RuntimeError(f"inference worker unavailable at {self.address}: {exc}") from exc
+        try:
+            conn.send(request)
+            reply = conn.recv()
+        finally:
+            conn.close()
+        if not reply.get("ok"):
+            raise RuntimeError(f"inference worker error: {reply.get('error')}")
+        return reply
+
+    def ping(self) -> bool:
+        try:
+            return bool(self._call({"op": "ping"}).get("ok"))
+        except RuntimeError:
+            return False
+
+    def classifier_scores(self, batch: np.ndarray, weights_path: str) -> List[float]:
+        batch = np.ascontiguousarray(batch, dtype=np.float32)
+        shm_in, spec_in = _shared_copy(batch)
+        try:
+            reply = self._call({"op": "classify", "weights_path": weights_path, "input": spec_in})
+            return [float(s) for s in reply["scores"]]
+        finally:
+            shm_in.close()
+            shm_in.unlink()
+
+    def segmenter_probabilities(self, batch: np.ndarray, weights_path: str) -> np.ndarray:
+        batch = np.ascontiguousarray(batch, dtype=np.float32)
+        shm_in, spec_in = _shared_copy(batch)
+        out_shape = batch.shape[:3]  # N,H,W
+        shm_out = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(out_shape)) * 4))
+        try:
+            self._call({
+                "op": "segment",
+                "weights_path": weights_path,
+                "input": spec_in,
+                "output": {"name": shm_out.name, "shape": list(out_shape), "dtype": "float32"},
+            })
+            return np.ndarray(out_shape, dtype=np.float32, buffer=shm_out.buf).copy()
+        finally:
+            shm_in.close()
+            shm_in.unlink()
+            shm_out.close()
+            shm_out.unlink()
+
+
+_client: Optional[InferenceWorkerClient] = None
+
+
+def get_worker_client() -> Optional[InferenceWorkerClient]:
+    """Client for the configured worker, or None when inference runs in-process."""
+    global _client
+    if not WORKER_ADDRESS:
+        return None
+    if _client is None:
+        _client = InferenceWorkerClient(WORKER_ADDRESS)
+    return _client
+
+
+# ---- server (worker process) ----
+
+_slots = threading.BoundedSemaphore(max(1, WORKER_CONCURRENCY))
+
+
+def _read_shared(spec: Dict[str, Any]) -> np.ndarray:
+    shm = _attach(spec["name"])
+    try:
+        view = np.ndarray(tuple(spec["shape"]), dtype=np.dtype(spec["dtype"]), buffer=shm.buf)
+        # One local memcpy so no view outlives the segment (close() fails while views exist)
+        arr = np.array(view)
+        del view
+    finally:
+        shm.close()
+    return arr
+
+
+def _write_shared(spec: Dict[str, Any], arr: np.ndarray) -> None:
+    shm = _attach(spec["name"])
+    try:
+        view = np.ndarray(tuple(spec["shape"]), dtype=np.dtype(spec["dtype"]), buffer=shm.buf)
+        view[...] = arr
+        del view
+    finally:
+        shm.close()
+
+
+def _handle_request(request: Dict[str, Any]) -> Dict[str, Any]:
+    from app.services.inference import run_classifier_local, run_segmenter_local
+
+    op = request.get("op")
+    if op == "ping":
+        return {"ok": True, "pid": os.getpid()}
+    if op not in ("classify", "segment"):
+        return {"ok": False, "error": f"unknown op {op!r}"}
+    batch = _read_shared(request["input"])
+    with _slots:
+        if op == "classify":
+            return {"ok": True, "scores": run_classifier_local(batch, request["weights_path"])}
+        probs = run_segmenter_local(batch, request["weights_path"])
+    _write_shared(request["output"], probs)
+    return {"ok": True}
+
+
+def _serve_connection(conn: Connection) -> None:
+    try:
+        while True:
+            try:
+                request = conn.recv()
+            except EOFError:
+                return
+            try:
+                reply = _handle_request(request)
+            except Exception as exc:  # noqa: BLE001
+                reply = {"ok": False, "error": str(exc)}
+            conn.send(reply)
+    finally:
+        conn.close()
+
+
+def serve(address: str, authkey: bytes = WORKER_AUTHKEY, preload: bool = True) -> None:
+    from app.services.model_registry import preload_models
+    from app.services.storage import atomic_write_bytes
+
+    if os.path.exists(address):
+        os.remove(address)
+    # Owner-only from creation: the socket and key file never exist with wider permissions
+    old_umask = os.umask(0o077)
+    try:
+        if not authkey:
+            authkey = secrets.token_hex(32).encode()
+            atomic_write_bytes(key_path(address), authkey)
+        listener = Listener(address, family="AF_UNIX", authkey=authkey)
+    finally:
+        os.umask(old_umask)
+    if preload:
+        preload_models()
+    logger.warning("Inference worker %s listening on %s", os.getpid(), address)
+    try:
+        while True:
+            try:
+                conn = listener.accept()
+            except Exception as exc:  # noqa: BLE001
+                # Failed handshake (e.g. wrong authkey); keep serving
+                logger.warning("Rejected inference worker connection: %s", exc)
+                continue
+            threading.Thread(target=_serve_connection, args=(conn,), daemon=True).start()
+    finally:
+        listener.close()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="PDX shared inference worker")
+    parser.add_argument("--socket", default=WORKER_ADDRESS or "/tmp/pdx-inference.sock")
+    parser.add_argument("--no-preload", action="store_true", help="Load models on first request instead")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    serve(args.socket, preload=not args.no_preload)
+
+
+if __name__ == "__main__":
+    main()
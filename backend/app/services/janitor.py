@@ -0,0 +1,192 @@
+import logging
+import os
+import shutil
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.services.inference_cache import CACHE_DIR, InferenceCache, inference_cache
+from app.services.storage import BASE_STORAGE_DIR, StudyStore, study_store
+from app.services.weights_cache import WEIGHTS_CACHE_DIR, evict_bytes as evict_converted_weights
+
+
+# Keeps PDX_STORAGE_DIR under a byte quota by deleting artifacts that can be rebuilt.
+# Eviction order: overlays, then WebP/16-bit previews, thumbnails, cached volumes and PNG
+# previews (per study, least recently used study first), then inference cache entries, then
+# converted model weights. Masks, probability maps, sidecars and uploaded DICOMs are never
+# deleted.
+
+logger = logging.getLogger(__name__)
+
+QUOTA_MB = int(os.environ.get("PDX_STORAGE_QUOTA_MB", "0"))  # 0 disables eviction
+INTERVAL_S = float(os.environ.get("PDX_JANITOR_INTERVAL_S", "300"))
+# Studies used more recently than this are left alone even when over quota
+MIN_IDLE_S = float(os.environ.get("PDX_JANITOR_MIN_IDLE_S", "900"))
+# Evict down to this fraction of the quota so the janitor does not run on every write
+LOW_WATER = 0.9
+
+REGENERABLE_SUBDIRS = ("overlays", "webp", "png16", "thumbs", "volume", "png")
+
+
+def _tree_size(path: str) -> Tuple[int, int]:
+    total = files = 0
+    try:
+        entries = list(os.scandir(path))
+    except OSError:
+        return 0, 0
+    for entry in entries:
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                size, count = _tree_size(entry.path)
+                total += size
+                files += count
+            else:
+                total += entry.stat(follow_symlinks=False).st_size
+                files += 1
+        except OSError:
+            continue
+    return total, files
+
+
+def storage_usage(
+    store: StudyStore = study_store, cache_dir: str = CACHE_DIR, weights_dir: str = WEIGHTS_CACHE_DIR
+) -> Dict[str, Any]:
+    """Bytes under the storage root by artifact kind, plus per-study sizes and access times."""
+    by_kind: Dict[str, int] = {}
+    studies: List[Dict[str, Any]] = []
+    try:
+        study_entries = [e for e in os.scandir(store.root) if e.is_dir(follow_symlinks=False)]
+    except OSError:
+        study_entries = []
+    for entry in study_entries:
+        sizes: Dict[str, int] = {}
+        try:
+            children = list(os.scandir(entry.path))
+        except OSError:
+            continue
+        for child in children:
+            try:
+                if child.is_dir(follow_symlinks=False):
+                    sizes[child.name] = _tree_size(child.path)[0]
+                else:
+                    sizes["sidecars"] = sizes.get("sidecars", 0) + child.stat(follow_symlinks=False).st_size
+            except OSError:
+                continue
+        for kind, size in sizes.items():
+            by_kind[kind] = by_kind.get(kind, 0) + size
+        studies.append({
+            "study_id": entry.name,
+            "bytes": sum(sizes.values()),
+            "by_kind": sizes,
+            "last_access": store.last_access(entry.name),
+        })
+    cache_bytes, cache_files = _tree_size(cache_dir)
+    by_kind["inference_cache"] = cache_bytes
+    by_kind["weights_cache"] = _tree_size(weights_dir)[0]
+    return {
+        "root": BASE_STORAGE_DIR,
+        "total_bytes": sum(by_kind.values()),
+        "by_kind": by_kind,
+        "num_studies": len(studies),
+        "inference_cache_files": cache_files,
+        "studies": studies,
+    }
+
+
+class StorageJanitor:
+    def __init__(
+        self,
+        store: StudyStore,
+        cache: InferenceCache,
+        quota_bytes: int,
+        interval_s: float = INTERVAL_S,
+        min_idle_s: float = MIN_IDLE_S,
+    ) -> None:
+        self.store = store
+        self.cache = cache
+        self.quota_bytes = quota_bytes
+        self.interval_s = interval_s
+        self.min_idle_s = min_idle_s
+        self.last_run: Optional[Dict[str, Any]] = None
+        self._run_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.quota_bytes > 0
+
+    def run_once(self) -> Dict[str, Any]:
+        # One sweep at a time; a manual trigger during a background sweep waits for it
+        with self._run_lock:
+            started = time.time()
+            usage = storage_usage(self.store)
+            total = usage["total_bytes"]
+            evicted: List[Dict[str, Any]] = []
+            freed = 0
+            if self.enabled and total > self.quota_bytes:
+                need = total - int(self.quota_bytes * LOW_WATER)
+                lru = sorted(usage["studies"], key=lambda s: s["last_access"])
+                for kind in REGENERABLE_SUBDIRS:
+                    for study in lru:
+                        if freed >= need:
+                            break
+                        size = study["by_kind"].get(kind, 0)
+                        if not size or started - study["last_access"] < self.min_idle_s:
+                            continue
+                        study_dir = os.path.join(self.store.root, study["study_id"])
+                        shutil.rmtree(os.path.join(study_dir, kind), ignore_errors=True)
+                        self.store.forget(study["study_id"])
+                        try:
+                            # Removing a subdirectory bumps the study's mtime, which is its access time
+                            os.utime(study_dir, (study["last_access"], study["last_access"]))
+                        except OSError:
+                            pass
+                        freed += size
+                        evicted.append({"study_id": study["study_id"], "kind": kind, "bytes": size})
+                if freed < need:
+                    cache_freed = self.cache.evict_bytes(need - freed)
+                    if cache_freed:
+                        freed += cache_freed
+                        evicted.append({"study_id": None, "kind": "inference_cache", "bytes": cache_freed})
+                if freed < need:
+                    # Reconverted from the HDF5 file on the next model load
+                    weights_freed = evict_converted_weights(need - freed)
+                    if weights_freed:
+                        freed += weights_freed
+                        evicted.append({"study_id": None, "kind": "weights_cache", "bytes": weights_freed})
+                if freed < need:
+                    logger.warning(
+                        "Storage still %d bytes over quota after evicting regenerable artifacts",
+                        need - freed,
+                    )
+            self.last_run = {
+                "started_at": started,
+                "duration_s": time.time() - started,
+                "bytes_before": total,
+                "bytes_freed": freed,
+                "evicted": evicted,
+            }
+            return self.last_run
+
+    def _loop(self) -> None:
+        while True:
+            try:
+                self.run_once()
+            except Exception:  # noqa: BLE001
+                logger.exception("Storage janitor sweep failed")
+            if self._stop.wait(self.interval_s):
+                return
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="storage-janitor", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+janitor = StorageJanitor(study_store, inference_cache, QUOTA_MB * 1024 * 1024)
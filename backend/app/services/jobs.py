@@ -1,25 +1,73 @@
+import os
 import threading
+import time
 import uuid
-from typing import Any, Callable, Dict, Optional
+from typing import Any, Callable, Dict, Optional, Tuple
+
+
+# Identical segmentation requests share one job while it is pending or running, and for this
+# long after it succeeds
+DEDUP_WINDOW_S = float(os.environ.get("PDX_JOB_DEDUP_WINDOW", "300"))
 
 
 class JobRegistry:
     def __init__(self) -> None:
         self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._keys: Dict[str, str] = {}
         self._lock = threading.Lock()
 
-    def create(self, payload: Optional[Dict[str, Any]] = None) -> str:
+    def _create_locked(self, payload: Optional[Dict[str, Any]]) -> str:
         job_id = str(uuid.uuid4())
-        with self._lock:
-            self._jobs[job_id] = {
-                "status": "pending",
-                "progress": 0,
-                "error": None,
-                "result": None,
-                "payload": payload or {},
-            }
+        self._jobs[job_id] = {
+            "status": "pending",
+            "progress": 0,
+            "error": None,
+            "result": None,
+            "payload": payload or {},
+        }
         return job_id
 
+    def create(self, payload: Optional[Dict[str, Any]] = None) -> str:
+        with self._lock:
+            return self._create_locked(payload)
+
+    def _reusable_locked(self, key: str, window_s: float) -> Optional[str]:
+        job = self._jobs.get(self._keys.get(key, ""))
+        if job is not None and (
+            job["status"] in ("pending", "running")
+            or (job["status"] == "done" and time.time() - job.get("finished_at", 0.0) <= window_s)
+        ):
+            return self._keys[key]
+        return None
+
+    def reusable(self, key: str, window_s: float = DEDUP_WINDOW_S) -> Optional[str]:
+        """The job create_or_reuse would return for key, without creating one."""
+        with self._lock:
+            return self._reusable_locked(key, window_s)
+
+    def create_or_reuse(
+        self, key: str, payload: Optional[Dict[str, Any]] = None, window_s: float = DEDUP_WINDOW_S
+    ) -> Tuple[str, bool]:
+        """
+        The job last created for key if it is pending, running, or finished successfully
+        within window_s; otherwise a new job. Returns (job_id, created).
+        """
+        with self._lock:
+            existing = self._reusable_locked(key, window_s)
+            if existing is not None:
+                return existing, False
+            job_id = self._create_locked(payload)
+            self._keys[key] = job_id
+            return job_id, True
+
+    def release(self, study_id: str) -> None:
+        """Stop reusing finished jobs of a study, e.g. after its masks were edited."""
+        with self._lock:
+            for key, job_id in list(self._keys.items()):
+                job = self._jobs.get(job_id)
+                if job is None or (job["payload"].get("study_id") == study_id and job["status"] not in ("pending", "running")):
+                    del self._keys[key]
+
     def set_status(self, job_id: str, status: str, progress: Optional[int] = None) -> None:
         with self._lock:
             job = self._jobs.get(job_id)
@@ -36,6 +84,7 @@ class JobRegistry:
                 return
             job["status"] = "error"
             job["error"] = error
+            job["finished_at"] = time.time()
 
     def set_result(self, job_id: str, result: Any) -> None:
         with self._lock:
@@ -44,11 +93,34 @@ class JobRegistry:
                 return
             job["status"] = "done"
             job["result"] = result
+            job["finished_at"] = time.time()
+
+    def set_profile(self, job_id: str, timeline: Any, profiler: Optional[Dict[str, Any]] = None) -> None:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if not job:
+                return
+            job["timeline"] = timeline
+            if profiler is not None:
+                job["profiler"] = profiler
+
+    def set_results_cache(self, job_id: str, entry: Dict[str, Any]) -> None:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job["results_cache"] = entry
 
     def get(self, job_id: str) -> Optional[Dict[str, Any]]:
         with self._lock:
             return self._jobs.get(job_id)
 
+    def count_by_status(self) -> Dict[str, int]:
+        with self._lock:
+            counts: Dict[str, int] = {}
+            for job in self._jobs.values():
+                counts[job["status"]] = counts.get(job["status"], 0) + 1
+            return counts
+
 
 jobs = JobRegistry()
 
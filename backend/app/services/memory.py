@@ -0,0 +1,131 @@
+import logging
+import os
+import resource
+import sys
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+from app.models.input_shapes import IMAGE_COL, IMAGE_ROW
+from app.services.pipeline import DECODE_WORKERS, PREFETCH_BATCHES, WRITE_WORKERS
+
+
+# Per-job memory budget for segmentation. Decoded slices are kept as float32 ("float32"),
+# in their stored int16/uint16 dtype and converted per batch ("native"), or dropped after
+# hashing and re-read from disk when needed ("reread"). "auto" takes the first that fits
+# the budget. The budget covers slice data and pipeline buffers, not model weights or
+# TensorFlow's own arena; peak RSS is measured separately and reported with each job.
+
+logger = logging.getLogger(__name__)
+
+SLICE_STORAGE_MODES = ("auto", "float32", "native", "reread")
+SLICE_STORAGE = os.environ.get("PDX_SLICE_STORAGE", "auto")
+# 0 = unlimited
+MEMORY_BUDGET_MB = int(os.environ.get("PDX_JOB_MEMORY_BUDGET_MB", "0"))
+RSS_SAMPLE_INTERVAL_S = float(os.environ.get("PDX_RSS_SAMPLE_INTERVAL", "0.05"))
+
+MB = 1024 * 1024
+
+
+class MemoryBudgetError(RuntimeError):
+    pass
+
+
+def current_rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # No procfs: fall back to the process high-water mark (KiB on Linux, bytes on macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+@contextmanager
+def track_peak_rss(out: Dict[str, Any], interval_s: float = RSS_SAMPLE_INTERVAL_S) -> Iterator[None]:
+    """
+    Sample the process RSS while the block runs and write start/peak (MiB) into out. RSS is
+    process-wide, so jobs running side by side see each other's allocations.
+    """
+    start = current_rss_bytes()
+    peak = [start]
+    stop = threading.Event()
+
+    def _sample() -> None:
+        while not stop.wait(interval_s):
+            peak[0] = max(peak[0], current_rss_bytes())
+
+    sampler = threading.Thread(target=_sample, name="pdx-rss", daemon=True)
+    sampler.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        sampler.join()
+        peak[0] = max(peak[0], current_rss_bytes())
+        out.update({
+            "rss_start_mb": round(start / MB, 1),
+            "rss_peak_mb": round(peak[0] / MB, 1),
+            "rss_peak_delta_mb": round((peak[0] - start) / MB, 1),
+        })
+
+
+def estimate_job_bytes(mode: str, n: int, rows: int, cols: int, itemsize: int, segment_batch_size: int) -> int:
+    """Slice data plus pipeline buffers held at once by run_classify_then_segment."""
+    pixels = rows * cols
+    model_pixels = IMAGE_ROW * IMAGE_COL
+    if mode == "float32":
+        slices = n * pixels * 4
+    elif mode == "native":
+        slices = n * pixels * itemsize
+    else:
+        # Slices in flight in the decoder and the batch being prepared, as float32
+        slices = (DECODE_WORKERS + segment_batch_size) * pixels * 4
+    probs = n * model_pixels * 2  # float16 maps for re-thresholding
+    # Batches queued ahead of the segmenter plus the running one; normalization makes a copy
+    batches = (PREFETCH_BATCHES + 1) * segment_batch_size * model_pixels * 4 * 2
+    # Queued mask writes: full-size uint8 mask plus the upsampling intermediate
+    writes = 4 * WRITE_WORKERS * pixels * 2
+    return slices + probs + batches + writes
+
+
+def plan_slice_storage(
+    n: int,
+    rows: int,
+    cols: int,
+    itemsize: int,
+    segment_batch_size: int,
+    budget_mb: Optional[int] = None,
+    mode: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Choose how decoded slices are kept so the job fits budget_mb, shrinking the segmenter
+    batch as a last resort. Raises MemoryBudgetError when nothing fits.
+    """
+    budget_mb = MEMORY_BUDGET_MB if budget_mb is None else budget_mb
+    mode = mode or SLICE_STORAGE
+    if mode not in SLICE_STORAGE_MODES:
+        raise ValueError(f"slice storage must be one of {', '.join(SLICE_STORAGE_MODES)}")
+    batch = max(1, int(segment_batch_size))
+    if mode != "auto":
+        candidates = [mode]
+    elif budget_mb > 0:
+        candidates = ["float32", "native", "reread"]
+    else:
+        candidates = ["float32"]
+
+    def _plan(m: str, b: int) -> Dict[str, Any]:
+        estimate = estimate_job_bytes(m, n, rows, cols, itemsize, b)
+        return {"slice_storage": m, "segment_batch_size": b, "estimate_mb": round(estimate / MB, 1), "budget_mb": budget_mb}
+
+    for m in candidates:
+        plan = _plan(m, batch)
+        if budget_mb <= 0 or plan["estimate_mb"] <= budget_mb:
+            return plan
+    smallest = _plan(candidates[-1], 1)
+    if smallest["estimate_mb"] <= budget_mb:
+        return smallest
+    raise MemoryBudgetError(
+        f"{n} slices of {rows}x{cols} need at least {smallest['estimate_mb']} MiB "
+        f"({smallest['slice_storage']}), over the {budget_mb} MiB job budget"
+    )
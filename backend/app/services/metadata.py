@@ -1,18 +1,53 @@
+import json
 import os
-from typing import List, Tuple, Dict, Any
+from typing import List, Tuple, Dict, Any, Optional
 
 import pydicom
 
-from app.services.storage import get_study_subdir, get_study_dicom_source_dir
-from app.services.dicom import list_dicom_files
+from app.services.storage import atomic_write_json, get_study_dir, get_study_subdir, get_study_dicom_source_dir
+from app.services.dicom import functional_group, list_dicom_files, list_dicom_slices
+
+
+STUDY_INFO_FILENAME = "study_info.json"
+SLICE_GEOMETRY_FILENAME = "slice_geometry.json"
+
+
+def _read_cached_info(study_id: str) -> Optional[Dict[str, Any]]:
+    # Header tags cached on first read so cohort exports and /results skip pydicom;
+    # discarded if the study now points at a different source folder
+    path = os.path.join(get_study_dir(study_id), STUDY_INFO_FILENAME)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r") as f:
+            cached = json.load(f)
+    except Exception:
+        return None
+    if cached.get("source") != get_study_dicom_source_dir(study_id):
+        return None
+    return cached.get("info")
+
+
+def _write_cached_info(study_id: str, info: Dict[str, Any]) -> None:
+    path = os.path.join(get_study_dir(study_id), STUDY_INFO_FILENAME)
+    try:
+        atomic_write_json(path, {"source": get_study_dicom_source_dir(study_id), "info": info}, default=str)
+    except Exception:
+        pass
 
 
 def read_spacing_and_thickness_mm(study_id: str) -> Tuple[List[float], float]:
+    cached = _read_cached_info(study_id)
+    if cached:
+        return [float(v) for v in cached["pixel_spacing_mm"]], float(cached["slice_thickness_mm"])
     dicom_dir = get_study_dicom_source_dir(study_id)
     files = list_dicom_files(dicom_dir)
     if not files:
         return [1.0, 1.0], 1.0
     ds = pydicom.dcmread(os.path.join(dicom_dir, files[0]))
+    if "PixelSpacing" not in ds:
+        # Enhanced multi-frame files keep the geometry in a functional group
+        ds = functional_group(ds, 0, "PixelMeasuresSequence") or ds
     pixel_spacing = ds.get("PixelSpacing", [1.0, 1.0])
     try:
         spacing = [float(pixel_spacing[0]), float(pixel_spacing[1])]
@@ -26,6 +61,9 @@ def read_spacing_and_thickness_mm(study_id: str) -> Tuple[List[float], float]:
 
 
 def read_study_info(study_id: str) -> Dict[str, Any]:
+    cached = _read_cached_info(study_id)
+    if cached is not None:
+        return cached
     dicom_dir = get_study_dicom_source_dir(study_id)
     files = list_dicom_files(dicom_dir)
     info: Dict[str, Any] = {}
@@ -76,6 +114,58 @@ def read_study_info(study_id: str) -> Dict[str, Any]:
         "sequence_variant": str(ds.get("SequenceVariant", "")),
         "echo_train_length": ds.get("EchoTrainLength", None),
     })
+    _write_cached_info(study_id, info)
     return info
 
 
+def _slice_position_mm(ds: Any, frame: Optional[int] = None) -> Optional[float]:
+    # Distance along the slice normal (row x column direction cosines), in mm
+    try:
+        if frame is None:
+            orientation = [float(v) for v in ds.ImageOrientationPatient]
+            position = [float(v) for v in ds.ImagePositionPatient]
+        else:
+            orientation = [float(v) for v in functional_group(ds, frame, "PlaneOrientationSequence").ImageOrientationPatient]
+            position = [float(v) for v in functional_group(ds, frame, "PlanePositionSequence").ImagePositionPatient]
+    except Exception:
+        return None
+    row, col = orientation[:3], orientation[3:]
+    normal = [
+        row[1] * col[2] - row[2] * col[1],
+        row[2] * col[0] - row[0] * col[2],
+        row[0] * col[1] - row[1] * col[0],
+    ]
+    return sum(p * n for p, n in zip(position, normal))
+
+
+def read_slice_positions_mm(study_id: str) -> Optional[List[float]]:
+    """
+    Position of every slice along the slice normal, in mask order, from ImagePositionPatient.
+    None when any slice lacks the geometry tags. Cached like the study info.
+    """
+    dicom_dir = get_study_dicom_source_dir(study_id)
+    path = os.path.join(get_study_dir(study_id), SLICE_GEOMETRY_FILENAME)
+    try:
+        with open(path, "r") as f:
+            cached = json.load(f)
+        if cached.get("source") == dicom_dir:
+            return cached.get("positions_mm")
+    except Exception:
+        pass
+    slices = list_dicom_slices(dicom_dir)
+    positions: Optional[List[float]] = []
+    ds = None
+    for s in slices:
+        if s.frame == 0:
+            ds = pydicom.dcmread(os.path.join(dicom_dir, s.name), stop_before_pixels=True)
+        pos = _slice_position_mm(ds, s.frame if s.frames > 1 else None)
+        if pos is None:
+            positions = None
+            break
+        positions.append(pos)
+    if slices:
+        try:
+            atomic_write_json(path, {"source": dicom_dir, "positions_mm": positions})
+        except Exception:
+            pass
+    return positions
@@ -0,0 +1,101 @@
+import logging
+import os
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.services.inference_config import configure_tensorflow
+from app.services.metrics import MODEL_LOADS, stage_timer
+from app.services.weights_cache import load_weights
+from app.utils.image_preprocessing import (
+    get_default_classifier_weights_path,
+    get_default_segmentation_weights_path,
+)
+
+
+# TensorFlow/Keras is only imported when a model is first requested, so routes that do not
+# run inference (health, images, exports) never pay for it.
+
+logger = logging.getLogger(__name__)
+
+_models: Dict[Tuple[str, str, float], Any] = {}
+# Format each loaded model's weights were read from ("flat" or "hdf5")
+_formats: Dict[Tuple[str, str, float], str] = {}
+_load_locks: Dict[Tuple[str, str], threading.Lock] = {}
+_lock = threading.Lock()
+
+
+def _build_segmenter(weights_path: str) -> Tuple[Any, str]:
+    from app.models.segmentation_model.architectures.r2udensenet import create_r2udensenet_model
+
+    model = create_r2udensenet_model()
+    return model, load_weights(model, "segmenter", weights_path)
+
+
+def _build_classifier(weights_path: str) -> Tuple[Any, str]:
+    from app.models.classifier_model.architectures.resnet50 import create_resnet50_classifier
+
+    model = create_resnet50_classifier()
+    return model, load_weights(model, "classifier", weights_path)
+
+
+_BUILDERS: Dict[str, Callable[[str], Tuple[Any, str]]] = {
+    "segmenter": _build_segmenter,
+    "classifier": _build_classifier,
+}
+
+
+def _get_model(kind: str, weights_path: str) -> Any:
+    path = os.path.abspath(weights_path)
+    # mtime in the key so replaced weights are picked up without a restart
+    key = (kind, path, os.path.getmtime(path))
+    with _lock:
+        model = _models.get(key)
+        if model is not None:
+            return model
+        load_lock = _load_locks.setdefault((kind, path), threading.Lock())
+    # Per-model lock: concurrent first requests wait for one load instead of loading twice
+    with load_lock:
+        with _lock:
+            model = _models.get(key)
+        if model is not None:
+            return model
+        configure_tensorflow()
+        with stage_timer("model_load", model=kind):
+            model, weights_format = _BUILDERS[kind](path)
+        MODEL_LOADS.inc(model=kind)
+        logger.info("Loaded %s weights from %s (%s)", kind, path, weights_format)
+        with _lock:
+            for stale in [k for k in _models if k[:2] == (kind, path)]:
+                del _models[stale]
+                _formats.pop(stale, None)
+            _models[key] = model
+            _formats[key] = weights_format
+        return model
+
+
+def get_segmenter(weights_path: Optional[str] = None) -> Any:
+    return _get_model("segmenter", weights_path or get_default_segmentation_weights_path())
+
+
+def get_classifier(weights_path: Optional[str] = None) -> Any:
+    return _get_model("classifier", weights_path or get_default_classifier_weights_path())
+
+
+def loaded_models() -> List[Dict[str, Any]]:
+    with _lock:
+        return [{"model": k[0], "weights_path": k[1], "weights_format": _formats.get(k)} for k in _models]
+
+
+def preload_models() -> None:
+    for getter in (get_classifier, get_segmenter):
+        try:
+            getter()
+        except Exception as exc:  # noqa: BLE001
+            # Missing weights should not take the API down; the job will report the error
+            logger.warning("Model preload failed: %s", exc)
+
+
+def start_background_preload() -> threading.Thread:
+    thread = threading.Thread(target=preload_models, name="model-preload", daemon=True)
+    thread.start()
+    return thread
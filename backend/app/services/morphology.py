@@ -0,0 +1,195 @@
+import json
+import os
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+from scipy import ndimage
+
+from app.services.metadata import read_slice_positions_mm, read_spacing_and_thickness_mm
+from app.services.metrics import stage_timer
+from app.services.storage import atomic_write_json, get_study_dir
+from app.services.volume import masks_version
+from app.services.volume_cache import VolumeBuildError, load_volume
+
+
+MORPHOLOGY_FILENAME = "morphology.json"
+# Light smoothing before marching cubes; a raw binary mask's staircase surface overestimates
+# the area by ~15-20% (sphere test: +19% raw, +10% at 0.5)
+SURFACE_SMOOTHING_SIGMA = 0.5
+
+
+def _usable_positions(positions_mm: Optional[Sequence[float]], n: int) -> Optional[np.ndarray]:
+    """Slice positions if there is one per slice and no two coincide, else None."""
+    if positions_mm is None or len(positions_mm) != n:
+        return None
+    pos = np.asarray(positions_mm, dtype=np.float64)
+    # Duplicate positions (e.g. several series mixed in one folder) make gaps meaningless
+    if not np.all(np.diff(np.sort(pos)) > 0):
+        return None
+    return pos
+
+
+def slice_extents_mm(positions_mm: Optional[Sequence[float]], n: int, thickness_mm: float) -> List[float]:
+    """
+    Thickness each slice stands for: half the gap to each neighbour along the slice normal
+    (the outer slices use their single gap). Falls back to SliceThickness without usable
+    positions.
+    """
+    pos = _usable_positions(positions_mm, n)
+    if pos is None or n < 2:
+        return [float(thickness_mm)] * n
+    order = np.argsort(pos)
+    gaps = np.diff(pos[order])
+    padded = np.concatenate([gaps[:1], gaps, gaps[-1:]])
+    extents = np.empty(n, dtype=np.float64)
+    extents[order] = (padded[:-1] + padded[1:]) / 2.0
+    return extents.tolist()
+
+
+def _surface_and_diameter(
+    masks: np.ndarray, z_mm: np.ndarray, spacing_mm: Sequence[float]
+) -> Dict[str, float]:
+    # Imported here so importing the API (which reaches this module via /results) stays cheap
+    from scipy.spatial import ConvexHull
+    from scipy.spatial.distance import pdist
+    from skimage import measure
+
+    # Marching cubes on the cropped, zero-padded volume; vertex slice coordinates are then
+    # mapped through the actual slice positions so uneven spacing is honoured
+    pad = 2
+    field = np.pad(masks, pad).astype(np.float32)
+    smoothed = ndimage.gaussian_filter(field, SURFACE_SMOOTHING_SIGMA)
+    if smoothed.max() > 0.5:  # tiny objects would vanish
+        field = smoothed
+    verts, faces, _, _ = measure.marching_cubes(field, level=0.5)
+    verts -= pad
+    idx = verts[:, 0]
+    step_lo = z_mm[1] - z_mm[0] if len(z_mm) > 1 else 1.0
+    step_hi = z_mm[-1] - z_mm[-2] if len(z_mm) > 1 else 1.0
+    z_ext = np.concatenate([[z_mm[0] - pad * step_lo], z_mm, [z_mm[-1] + pad * step_hi]])
+    verts_mm = np.column_stack([
+        np.interp(idx, np.concatenate([[-pad], np.arange(len(z_mm)), [len(z_mm) - 1 + pad]]), z_ext),
+        verts[:, 1] * spacing_mm[0],
+        verts[:, 2] * spacing_mm[1],
+    ])
+    surface = float(measure.mesh_surface_area(verts_mm, faces))
+    # The farthest vertex pair lies on the convex hull; joggling copes with flat objects
+    hull = verts_mm[ConvexHull(verts_mm, qhull_options="QJ").vertices]
+    diameter = float(pdist(hull).max())
+    return {"surface_area_mm2": surface, "max_diameter_mm": diameter}
+
+
+def compute_morphology(
+    masks: np.ndarray,
+    spacing_mm: Sequence[float],
+    thickness_mm: float,
+    positions_mm: Optional[Sequence[float]] = None,
+) -> Dict[str, Any]:
+    """
+    Volume statistics of an (N, H, W) mask volume in one pass. spacing_mm is (row, col)
+    pixel spacing; positions_mm the slice positions along the normal, if known.
+    """
+    vol = np.asarray(masks).astype(bool, copy=False)
+    n = vol.shape[0]
+    extents = np.asarray(slice_extents_mm(positions_mm, n, thickness_mm))
+    pos = _usable_positions(positions_mm, n)
+    z_mm = pos if pos is not None else np.arange(n, dtype=np.float64) * thickness_mm
+    pixel_mm2 = float(spacing_mm[0]) * float(spacing_mm[1])
+
+    areas_px = np.count_nonzero(vol, axis=(1, 2))
+    areas_mm2 = areas_px * pixel_mm2
+    slice_volumes_cc = areas_mm2 * extents / 1000.0
+    stats: Dict[str, Any] = {
+        "total_volume_cc": float(slice_volumes_cc.sum()),
+        "z_spacing_source": "image_position_patient" if pos is not None and n >= 2 else "slice_thickness",
+        "slice_positions_mm": z_mm.tolist(),
+        "slice_extents_mm": extents.tolist(),
+        "slice_areas_mm2": areas_mm2.tolist(),
+        "slice_volumes_cc": slice_volumes_cc.tolist(),
+        "num_components": 0,
+        "bounding_box": None,
+        "centroid": None,
+        "surface_area_mm2": 0.0,
+        "max_diameter_mm": 0.0,
+    }
+    if not areas_px.any():
+        return stats
+
+    with stage_timer("morphology"):
+        slices = np.nonzero(areas_px)[0]
+        rows = np.nonzero(vol.any(axis=(0, 2)))[0]
+        cols = np.nonzero(vol.any(axis=(0, 1)))[0]
+        z0, z1 = int(slices[0]), int(slices[-1])
+        r0, r1, c0, c1 = int(rows[0]), int(rows[-1]), int(cols[0]), int(cols[-1])
+        crop = vol[z0:z1 + 1, r0:r1 + 1, c0:c1 + 1]
+        _, num = ndimage.label(crop, structure=np.ones((3, 3, 3), dtype=bool))
+        stats["num_components"] = int(num)
+
+        # Centroid weighted by each slice's physical volume, not just voxel counts
+        weights = (extents[z0:z1 + 1] * pixel_mm2)[:, None, None] * crop
+        total = float(weights.sum())
+        zz, rr, cc = np.indices(crop.shape, sparse=True)
+        c_slice = float((weights * zz).sum() / total) + z0
+        c_row = float((weights * rr).sum() / total) + r0
+        c_col = float((weights * cc).sum() / total) + c0
+        stats["bounding_box"] = {
+            "slices": [z0 + 1, z1 + 1],
+            "rows": [r0, r1],
+            "cols": [c0, c1],
+            "size_mm": [
+                float(abs(z_mm[z1] - z_mm[z0]) + (extents[z0] + extents[z1]) / 2.0),
+                float((r1 - r0 + 1) * spacing_mm[0]),
+                float((c1 - c0 + 1) * spacing_mm[1]),
+            ],
+        }
+        stats["centroid"] = {
+            "slice": c_slice + 1.0,
+            "row": c_row,
+            "col": c_col,
+            "position_mm": [
+                float(np.interp(c_slice, np.arange(n), z_mm)),
+                c_row * float(spacing_mm[0]),
+                c_col * float(spacing_mm[1]),
+            ],
+        }
+        stats.update(_surface_and_diameter(crop, z_mm[z0:z1 + 1], spacing_mm))
+    return stats
+
+
+def cached_morphology(study_id: str) -> Optional[Dict[str, Any]]:
+    """Stored morphology if it matches the current masks; never decodes masks."""
+    version = masks_version(study_id)
+    if version is None:
+        return None
+    try:
+        with open(os.path.join(get_study_dir(study_id), MORPHOLOGY_FILENAME), "r") as f:
+            cached = json.load(f)
+        if cached.get("version") == version:
+            return cached["stats"]
+    except (OSError, ValueError, KeyError):
+        pass
+    return None
+
+
+def study_morphology(study_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Morphology of a study's current masks, cached per mask version (the area index mtime).
+    None when the study has no masks or its slices cannot be stacked into a volume.
+    """
+    cached = cached_morphology(study_id)
+    if cached is not None:
+        return cached
+    version = masks_version(study_id)
+    if version is None:
+        return None
+    path = os.path.join(get_study_dir(study_id), MORPHOLOGY_FILENAME)
+    try:
+        loaded = load_volume(study_id, "mask", "uint8")
+    except VolumeBuildError:
+        return None
+    if loaded is None:
+        return None
+    spacing_mm, thickness_mm = read_spacing_and_thickness_mm(study_id)
+    stats = compute_morphology(loaded[0], spacing_mm, thickness_mm, read_slice_positions_mm(study_id))
+    atomic_write_json(path, {"version": version, "stats": stats})
+    return stats
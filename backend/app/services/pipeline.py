@@ -0,0 +1,94 @@
+import contextvars
+import os
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, Generic, Iterable, Iterator, TypeVar
+
+
+# Streaming stages for the segmentation pipeline: decode -> preprocess -> infer -> mask
+# encode/write. Every stage has its own small thread pool and a bound on queued items, so
+# decoding the next chunk and writing the previous one overlap with inference (PIL, pydicom
+# decompression, numpy and file I/O mostly release the GIL) without buffering a study twice.
+
+DECODE_WORKERS = int(os.environ.get("PDX_PIPELINE_DECODE_WORKERS", str(min(4, os.cpu_count() or 1))))
+WRITE_WORKERS = int(os.environ.get("PDX_PIPELINE_WRITE_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Inference batches prepared ahead of the one running
+PREFETCH_BATCHES = int(os.environ.get("PDX_PIPELINE_PREFETCH", "2"))
+
+T = TypeVar("T")
+
+
+class Stage:
+    """
+    A pipeline stage: a thread pool plus a bounded queue of pending items. put() blocks once
+    max_pending items are in flight, so a fast producer cannot run ahead of a slow stage.
+    Tasks run in the caller's context, keeping job timelines and profiling spans attached.
+    """
+
+    def __init__(self, name: str, workers: int, max_pending: int = 0) -> None:
+        self.name = name
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix=f"pdx-{name}")
+        self._max_pending = max_pending if max_pending > 0 else 4 * max(1, workers)
+        self._pending: Deque[Future] = deque()
+
+    def submit(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> "Future[T]":
+        """Schedule without back-pressure; for stages whose results are consumed out of order."""
+        ctx = contextvars.copy_context()
+        return self._pool.submit(ctx.run, fn, *args, **kwargs)
+
+    def put(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> "Future[T]":
+        while len(self._pending) >= self._max_pending:
+            self._pending.popleft().result()  # re-raises a failed task in the producer
+        future = self.submit(fn, *args, **kwargs)
+        self._pending.append(future)
+        return future
+
+    def drain(self) -> None:
+        """Wait for every queued item; raises the first failure."""
+        while self._pending:
+            self._pending.popleft().result()
+
+    def close(self) -> None:
+        self._pool.shutdown(wait=True, cancel_futures=True)
+
+    def __enter__(self) -> "Stage":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+
+def prefetch(stage: Stage, fn: Callable[[Any], T], items: Iterable[Any], ahead: int = PREFETCH_BATCHES) -> Iterator[T]:
+    """fn(item) for each item in order, computed up to `ahead` items before they are consumed."""
+    window: Deque[Future] = deque()
+    for item in items:
+        window.append(stage.submit(fn, item))
+        if len(window) > max(0, ahead):
+            yield window.popleft().result()
+    while window:
+        yield window.popleft().result()
+
+
+class Lookahead(Generic[T]):
+    """
+    fn(i) for i in range(n), read in any order from any thread. get(i) queues i and the next
+    `ahead` items through the stage's bounded put(), so a consumer walking the sequence keeps
+    the stage busy without queueing all of it; results are kept once computed.
+    """
+
+    def __init__(self, stage: Stage, fn: Callable[[int], T], n: int, ahead: int = PREFETCH_BATCHES) -> None:
+        self._stage = stage
+        self._fn = fn
+        self._n = n
+        self._ahead = max(0, ahead)
+        self._futures: Dict[int, "Future[T]"] = {}
+        self._lock = threading.Lock()
+
+    def get(self, i: int) -> T:
+        with self._lock:
+            for j in range(i, min(self._n, i + self._ahead + 1)):
+                if j not in self._futures:
+                    self._futures[j] = self._stage.put(self._fn, j)
+            future = self._futures[i]
+        return future.result()
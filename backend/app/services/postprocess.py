@@ -0,0 +1,134 @@
+import json
+import os
+from typing import Any, Dict, Optional
+
+import numpy as np
+from scipy import ndimage
+
+from app.services.metadata import read_spacing_and_thickness_mm
+from app.services.metrics import stage_timer
+from app.services.probability_maps import META_FILENAME
+from app.services.storage import atomic_write_json, get_study_subdir, study_store
+from app.services.volume import write_area_index
+from app.services.volume_cache import load_volume
+
+
+# Volume-level cleanup of per-slice masks. Components are 3D (26-connected); hole filling and
+# smoothing work in-plane because slices are much thicker than the pixel spacing.
+DEFAULT_SETTINGS: Dict[str, Any] = {
+    "keep_largest": False,
+    "min_volume_cc": 0.0,
+    "fill_holes": True,
+    "smoothing_radius": 0,
+}
+# Stored next to the probability maps so a later re-threshold reapplies the same cleanup
+SETTINGS_KEY = "postprocess"
+
+
+def _in_plane_disk(radius: int) -> np.ndarray:
+    yy, xx = np.mgrid[-radius:radius + 1, -radius:radius + 1]
+    return (yy * yy + xx * xx <= radius * radius)[None]
+
+
+def clean_mask_volume(
+    masks: np.ndarray,
+    keep_largest: bool = False,
+    min_voxels: int = 0,
+    fill_holes: bool = True,
+    smoothing_radius: int = 0,
+) -> Dict[str, Any]:
+    """
+    Post-process an (N, H, W) boolean mask volume in one pass: in-plane opening/closing,
+    3D connected-component filtering, then in-plane hole filling. Returns the cleaned
+    volume and component counts.
+    """
+    vol = masks.astype(bool)
+    if smoothing_radius > 0:
+        disk = _in_plane_disk(smoothing_radius)
+        with stage_timer("postprocess_smooth"):
+            vol = ndimage.binary_closing(ndimage.binary_opening(vol, structure=disk), structure=disk)
+
+    with stage_timer("postprocess_components"):
+        labels, num = ndimage.label(vol, structure=np.ones((3, 3, 3), dtype=bool))
+        sizes = np.bincount(labels.ravel(), minlength=num + 1)
+        keep = sizes >= max(1, min_voxels)
+        keep[0] = False
+        if keep_largest and keep.any():
+            largest = int(np.argmax(np.where(keep, sizes, 0)))
+            keep[:] = False
+            keep[largest] = True
+        vol = keep[labels]
+
+    if fill_holes:
+        # Background connectivity within each slice only, so every slice is filled independently
+        plane = np.zeros((3, 3, 3), dtype=bool)
+        plane[1] = ndimage.generate_binary_structure(2, 1)
+        with stage_timer("postprocess_fill"):
+            vol = ndimage.binary_fill_holes(vol, structure=plane)
+
+    return {"masks": vol, "components": int(num), "components_kept": int(np.count_nonzero(keep))}
+
+
+def clean_study_masks(study_id: str, masks: np.ndarray, settings: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """clean_mask_volume with a study's settings; min_volume_cc is converted with its spacing."""
+    opts = {**DEFAULT_SETTINGS, **(settings or {})}
+    min_voxels = 0
+    if opts["min_volume_cc"] > 0:
+        spacing_mm, thickness_mm = read_spacing_and_thickness_mm(study_id)
+        voxel_cc = thickness_mm * spacing_mm[0] * spacing_mm[1] / 1000.0
+        min_voxels = int(np.ceil(opts["min_volume_cc"] / voxel_cc)) if voxel_cc > 0 else 0
+    out = clean_mask_volume(
+        masks,
+        keep_largest=bool(opts["keep_largest"]),
+        min_voxels=min_voxels,
+        fill_holes=bool(opts["fill_holes"]),
+        smoothing_radius=int(opts["smoothing_radius"]),
+    )
+    return {**out, "settings": opts}
+
+
+def postprocess_study(
+    study_id: str, settings: Optional[Dict[str, Any]] = None, masks: Optional[np.ndarray] = None
+) -> Optional[Dict[str, Any]]:
+    """
+    Clean up a study's masks (the stored ones, or a freshly thresholded (N, H, W) volume) and
+    rewrite only the slices that differ from disk, plus the area index. Returns None when
+    there are no masks; otherwise the cleaned (N, H, W) boolean volume is under "masks".
+    """
+    loaded = load_volume(study_id, "mask", "uint8")
+    if loaded is None and masks is None:
+        return None
+    old = np.asarray(loaded[0], dtype=bool) if loaded is not None else None
+
+    out = clean_study_masks(study_id, masks if masks is not None else old, settings)
+    new = out["masks"]
+
+    if old is None or old.shape != new.shape:
+        changed = np.arange(new.shape[0])
+    else:
+        changed = np.nonzero((new != old).any(axis=(1, 2)))[0]
+    for i in changed.tolist():
+        with stage_timer("mask_write"):
+            study_store.write_mask(study_id, i + 1, new[i].astype(np.uint8) * 255)
+        study_store.remove_overlays(study_id, i + 1)
+    raw_areas = np.count_nonzero(new, axis=(1, 2)).tolist()
+    write_area_index(study_id, raw_areas)
+    return {
+        "masks": new,
+        "raw_areas": raw_areas,
+        "updated_slices": [i + 1 for i in changed.tolist()],
+        "components": out["components"],
+        "components_kept": out["components_kept"],
+        "settings": out["settings"],
+    }
+
+
+def store_settings(study_id: str, settings: Dict[str, Any]) -> None:
+    """Record settings with the probability maps; a new segmentation run clears them."""
+    meta_path = os.path.join(get_study_subdir(study_id, "probabilities"), META_FILENAME)
+    if not os.path.exists(meta_path):
+        return
+    with open(meta_path, "r") as f:
+        meta = json.load(f)
+    meta[SETTINGS_KEY] = {**DEFAULT_SETTINGS, **settings}
+    atomic_write_json(meta_path, meta)
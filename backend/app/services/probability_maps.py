@@ -0,0 +1,175 @@
+import json
+import os
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image
+from scipy import ndimage
+
+from app.services.storage import atomic_save_npy, atomic_write_json, get_study_subdir, study_store
+from app.services.overlay import overlay_mask_on_image
+from app.services.preview import encoder_params
+from app.services.volume import read_area_index, write_area_index
+from app.services.volume_cache import VolumeBuildError
+from app.services.metrics import stage_timer
+
+
+PROBS_FILENAME = "probs.npy"
+META_FILENAME = "meta.json"
+
+
+def upsample_masks(masks_small: np.ndarray, out_shape: Tuple[int, int]) -> np.ndarray:
+    """
+    Resize a (N,h,w) boolean mask stack to (N,H,W) in one pass.
+    Bilinear interpolation followed by a 0.5 cut, which matches resizing a 0/255 mask
+    with PIL and reading it back with > 127. Returns uint8 {0,255}.
+    """
+    n, h, w = masks_small.shape
+    out_h, out_w = out_shape
+    if (h, w) == (out_h, out_w):
+        return masks_small.astype(np.uint8) * 255
+    zoomed = ndimage.zoom(
+        masks_small.astype(np.float32),
+        (1, out_h / h, out_w / w),
+        order=1,
+        mode="nearest",
+        grid_mode=True,
+    )
+    return (zoomed >= 0.5).astype(np.uint8) * 255
+
+
+def masks_from_probabilities(masks_small: np.ndarray, shapes: Sequence[Tuple[int, int]]) -> List[np.ndarray]:
+    """Upsample each slice to its original shape, batching slices that share a shape."""
+    out: List[Optional[np.ndarray]] = [None] * len(shapes)
+    groups: Dict[Tuple[int, int], List[int]] = {}
+    for i, shape in enumerate(shapes):
+        groups.setdefault(tuple(shape), []).append(i)
+    for shape, idxs in groups.items():
+        full = upsample_masks(masks_small[idxs], shape)
+        for j, i in enumerate(idxs):
+            out[i] = full[j]
+    return out  # type: ignore[return-value]
+
+
+def save_probability_maps(
+    study_id: str,
+    probs: np.ndarray,
+    segmented: Sequence[bool],
+    shapes: Sequence[Tuple[int, int]],
+    threshold: float,
+) -> None:
+    # probs: (N, IMAGE_ROW, IMAGE_COL) at model resolution; zeros where not segmented
+    prob_dir = get_study_subdir(study_id, "probabilities")
+    atomic_save_npy(os.path.join(prob_dir, PROBS_FILENAME), probs.astype(np.float16))
+    meta = {
+        "threshold": float(threshold),
+        "segmented": [bool(s) for s in segmented],
+        "shapes": [[int(shape[0]), int(shape[1])] for shape in shapes],
+    }
+    atomic_write_json(os.path.join(prob_dir, META_FILENAME), meta)
+
+
+def load_probability_maps(study_id: str) -> Optional[Tuple[np.ndarray, Dict[str, Any]]]:
+    prob_dir = get_study_subdir(study_id, "probabilities")
+    probs_path = os.path.join(prob_dir, PROBS_FILENAME)
+    meta_path = os.path.join(prob_dir, META_FILENAME)
+    if not (os.path.exists(probs_path) and os.path.exists(meta_path)):
+        return None
+    with open(meta_path, "r") as f:
+        meta = json.load(f)
+    return np.load(probs_path), meta
+
+
+def get_stored_threshold(study_id: str) -> Optional[float]:
+    meta_path = os.path.join(get_study_subdir(study_id, "probabilities"), META_FILENAME)
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path, "r") as f:
+        return json.load(f).get("threshold")
+
+
+def update_probability_maps(study_id: str, updates: Dict[int, np.ndarray]) -> None:
+    """Replace probability maps for individual slices (0-based), e.g. after resegmentation."""
+    loaded = load_probability_maps(study_id)
+    if loaded is None or not updates:
+        return
+    probs, meta = loaded
+    probs = np.array(probs)  # writable copy
+    for i, prob in updates.items():
+        if 0 <= i < probs.shape[0] and prob.shape == probs.shape[1:]:
+            probs[i] = prob.astype(np.float16)
+            meta["segmented"][i] = True
+    save_probability_maps(study_id, probs, meta["segmented"], meta["shapes"], meta["threshold"])
+
+
+def _render_overlay(study_id: str, slice_index: int, mask: np.ndarray) -> None:
+    base_path = study_store.png_path(study_id, slice_index)
+    if not os.path.exists(base_path):
+        return
+    with stage_timer("overlay_render"):
+        base = np.array(Image.open(base_path).convert('L'))
+        study_store.write_overlay(
+            study_id, slice_index, overlay_mask_on_image(base, mask.astype(np.uint8), color_rgb=(0, 255, 0)),
+            **encoder_params("png"),
+        )
+
+
+def rethreshold_study(study_id: str, threshold: float, render_overlays: bool = False) -> Optional[Dict[str, Any]]:
+    """
+    Regenerate masks, the area index and overlays from stored probability maps.
+    Only slices whose binarized mask actually changes are rewritten. Returns None when
+    the study has no stored probability maps.
+    """
+    # Imported here: postprocess reads this module's metadata constants
+    from app.services.postprocess import SETTINGS_KEY, postprocess_study
+
+    loaded = load_probability_maps(study_id)
+    if loaded is None:
+        return None
+    probs, meta = loaded
+    segmented = np.asarray(meta["segmented"], dtype=bool)
+    shapes = [tuple(s) for s in meta["shapes"]]
+    n = probs.shape[0]
+
+    new_small = (probs >= np.float16(threshold)) & segmented[:, None, None]
+    settings = meta.get(SETTINGS_KEY)
+    if settings:
+        # Post-processing is volume-level, so the whole thresholded volume is cleaned and
+        # compared against the stored masks instead of diffing per slice
+        if len(set(shapes)) != 1:
+            raise VolumeBuildError(f"slices have differing shapes: {sorted(set(shapes))}")
+        full = np.stack(masks_from_probabilities(new_small, shapes)) > 127
+        out = postprocess_study(study_id, settings, masks=full)
+        meta["threshold"] = float(threshold)
+        atomic_write_json(os.path.join(get_study_subdir(study_id, "probabilities"), META_FILENAME), meta)
+        if render_overlays:
+            for idx in out["updated_slices"]:
+                _render_overlay(study_id, idx, out["masks"][idx - 1])
+        return {"raw_areas": out["raw_areas"], "updated_slices": out["updated_slices"]}
+
+    old_threshold = meta.get("threshold")
+    raw_areas = read_area_index(study_id)
+    if old_threshold is None or raw_areas is None or len(raw_areas) != n:
+        changed = np.arange(n)
+        raw_areas = [0] * n
+    else:
+        old_small = (probs >= np.float16(old_threshold)) & segmented[:, None, None]
+        changed = np.nonzero((new_small != old_small).any(axis=(1, 2)))[0]
+
+    full_masks = masks_from_probabilities(new_small[changed], [shapes[i] for i in changed])
+    for i, mask in zip(changed.tolist(), full_masks):
+        with stage_timer("mask_write"):
+            study_store.write_mask(study_id, i + 1, mask)
+        raw_areas[i] = int(np.count_nonzero(mask))
+        # Every encoded variant is stale now; missing ones are regenerated on next request
+        study_store.remove_overlays(study_id, i + 1)
+        if render_overlays:
+            _render_overlay(study_id, i + 1, mask > 127)
+
+    write_area_index(study_id, raw_areas)
+    meta["threshold"] = float(threshold)
+    atomic_write_json(os.path.join(get_study_subdir(study_id, "probabilities"), META_FILENAME), meta)
+    return {
+        "raw_areas": raw_areas,
+        "updated_slices": [i + 1 for i in changed.tolist()],
+    }
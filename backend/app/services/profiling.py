@@ -0,0 +1,114 @@
+import contextvars
+import cProfile
+import io
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+
+PROFILERS = ("cprofile", "pyinstrument")
+
+
+class JobTimeline:
+    """Structured span timeline of one job; times are seconds since the job started."""
+
+    def __init__(self) -> None:
+        self.started_at = time.time()
+        self._t0 = time.perf_counter()
+        self._spans: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def add_span(self, name: str, start: float, end: float, attrs: Dict[str, Any]) -> None:
+        span = {
+            "name": name,
+            "start_s": round(start - self._t0, 6),
+            "duration_s": round(end - start, 6),
+            "thread": threading.current_thread().name,
+        }
+        if attrs:
+            span["attrs"] = attrs
+        with self._lock:
+            self._spans.append(span)
+
+    def event(self, name: str, **attrs: Any) -> None:
+        now = time.perf_counter()
+        self.add_span(name, now, now, attrs)
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            spans = list(self._spans)
+        summary: Dict[str, Dict[str, float]] = {}
+        for span in spans:
+            entry = summary.setdefault(span["name"], {"count": 0, "total_s": 0.0})
+            entry["count"] += 1
+            entry["total_s"] = round(entry["total_s"] + span["duration_s"], 6)
+        return {
+            "started_at": self.started_at,
+            "elapsed_s": round(time.perf_counter() - self._t0, 6),
+            "summary": summary,
+            "spans": spans,
+        }
+
+
+_current: "contextvars.ContextVar[Optional[JobTimeline]]" = contextvars.ContextVar("pdx_job_timeline", default=None)
+
+
+@contextmanager
+def activate_timeline(timeline: JobTimeline) -> Iterator[JobTimeline]:
+    token = _current.set(timeline)
+    try:
+        yield timeline
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def span(name: str, **attrs: Any) -> Iterator[None]:
+    # No-op outside a job (e.g. request handlers), so instrumented code can always call it
+    timeline = _current.get()
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timeline is not None:
+            timeline.add_span(name, t0, time.perf_counter(), attrs)
+
+
+def event(name: str, **attrs: Any) -> None:
+    timeline = _current.get()
+    if timeline is not None:
+        timeline.event(name, **attrs)
+
+
+@contextmanager
+def capture_profile(kind: Optional[str], out: Dict[str, Any]) -> Iterator[None]:
+    """Optionally run the block under cProfile or pyinstrument; writes the report into out."""
+    if kind == "cprofile":
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            buf = io.StringIO()
+            pstats.Stats(profiler, stream=buf).sort_stats("cumulative").print_stats(60)
+            out.update({"profiler": "cprofile", "profiler_output": buf.getvalue()})
+        return
+    if kind == "pyinstrument":
+        try:
+            from pyinstrument import Profiler
+        except Exception:
+            out.update({"profiler": "pyinstrument", "profiler_error": "pyinstrument not installed"})
+            yield
+            return
+        profiler = Profiler()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            out.update({"profiler": "pyinstrument", "profiler_output": profiler.output_text()})
+        return
+    yield
@@ -0,0 +1,116 @@
+import hashlib
+import json
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from app.services.jobs import jobs
+from app.services.metadata import read_spacing_and_thickness_mm, read_study_info
+from app.services.storage import study_store
+from app.services.volume import load_raw_areas, masks_version, scale_all_areas
+
+
+# /results payloads, materialized when a job finishes and kept on the job with their JSON
+# body and ETag. A request only compares the mask version (the area index mtime); after a
+# resegment or re-threshold, just the changed slices are rescaled and the body re-encoded.
+# Everything here comes from the area index and cached headers; morphology, which needs the
+# mask volume, is served separately by /results/{job_id}/morphology.
+
+
+def _encode(entry: Dict[str, Any]) -> Dict[str, Any]:
+    body = json.dumps(entry["payload"], default=str).encode()
+    entry["body"] = body
+    entry["etag"] = '"%s"' % hashlib.sha1(body).hexdigest()[:20]
+    return entry
+
+
+def _classifier_fields(result: Dict[str, Any], payload: Dict[str, Any], scaled_cc: List[float]) -> Dict[str, Any]:
+    classifier_results = result.get("classifier_results", payload.get("classifier_results"))
+    classifier_inferred = result.get("classifier_inferred")
+    # Ensure classifier_results aligns with masks order; if missing or length-mismatched,
+    # derive booleans directly from per-slice areas in mask order
+    if not isinstance(classifier_results, list) or len(classifier_results) != len(scaled_cc):
+        classifier_results = [bool(float(a) > 0) for a in scaled_cc]
+        classifier_inferred = None
+    return {"classifier_results": classifier_results, "classifier_inferred": classifier_inferred}
+
+
+def _build(job: Dict[str, Any], version: Optional[int]) -> Dict[str, Any]:
+    result = job.get("result") or {}
+    study_id = result.get("study_id") or job["payload"].get("study_id")
+    # Per-slice areas from the area index (masks are decoded only if it is missing or stale)
+    raw_areas = load_raw_areas(study_id)
+    if not raw_areas:
+        payload = {
+            "study_id": study_id,
+            "total_volume_cc": 0,
+            "slice_areas_cc": [],
+            "classifier_results": result.get("classifier_results", job["payload"].get("classifier_results")),
+            "classifier_inferred": result.get("classifier_inferred"),
+        }
+        return _encode({"version": version, "raw_areas": [], "payload": payload})
+    spacing_mm, thickness_mm = read_spacing_and_thickness_mm(study_id)
+    meta = read_study_info(study_id)
+    scaled_cc = scale_all_areas(raw_areas, thickness_mm, spacing_mm)
+    payload = {
+        "study_id": study_id,
+        "total_volume_cc": float(np.sum(scaled_cc)),
+        "slice_areas_cc": scaled_cc,
+        "pixel_spacing_mm": spacing_mm,
+        "slice_thickness_mm": thickness_mm,
+        **_classifier_fields(result, job["payload"], scaled_cc),
+        **meta,
+    }
+    return _encode({"version": version, "raw_areas": list(raw_areas), "payload": payload})
+
+
+def _refresh(job: Dict[str, Any], entry: Dict[str, Any], version: Optional[int]) -> Dict[str, Any]:
+    payload = entry["payload"]
+    old = entry["raw_areas"]
+    raw_areas = load_raw_areas(payload["study_id"])
+    if not old or len(raw_areas) != len(old):
+        return _build(job, version)
+    changed = [i for i, (a, b) in enumerate(zip(raw_areas, old)) if a != b]
+    scaled_cc = list(payload["slice_areas_cc"])
+    if changed:
+        # Scaling is per slice, so rescaling only the changed ones gives identical values
+        rescaled = scale_all_areas(
+            [raw_areas[i] for i in changed], payload["slice_thickness_mm"], payload["pixel_spacing_mm"]
+        )
+        for i, area in zip(changed, rescaled):
+            scaled_cc[i] = area
+    payload = {
+        **payload,
+        "total_volume_cc": float(np.sum(scaled_cc)),
+        "slice_areas_cc": scaled_cc,
+        **_classifier_fields(job.get("result") or {}, job["payload"], scaled_cc),
+    }
+    return _encode({"version": version, "raw_areas": list(raw_areas), "payload": payload})
+
+
+def cached_results(job_id: str) -> Optional[Dict[str, Any]]:
+    """The job's entry if it matches the current masks; one stat, no decoding."""
+    job = jobs.get(job_id)
+    entry = job.get("results_cache") if job else None
+    if entry is None or entry["version"] != masks_version(entry["payload"]["study_id"]):
+        return None
+    return entry
+
+
+def materialize_results(job_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Build, or bring up to date, a finished job's /results entry: {"payload", "body", "etag"}.
+    None when the job is unknown or not done.
+    """
+    job = jobs.get(job_id)
+    if not job or job["status"] != "done":
+        return None
+    study_id = (job.get("result") or {}).get("study_id") or job["payload"].get("study_id")
+    with study_store.build_lock(study_id, f"results/{job_id}"):
+        version = masks_version(study_id)
+        entry = job.get("results_cache")
+        if entry is not None and entry["version"] == version:
+            return entry
+        entry = _refresh(job, entry, version) if entry is not None else _build(job, version)
+        jobs.set_results_cache(job_id, entry)
+        return entry
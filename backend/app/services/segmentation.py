@@ -1,113 +1,357 @@
 import os
-from typing import List, Optional, Tuple
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 import numpy as np
 from PIL import Image
 import pydicom
 
 from app.services.images import ensure_png_slices, get_png_path
-from app.services.storage import get_study_subdir, get_study_dicom_source_dir
-from app.models.segmentation_model.architectures.r2udensenet import create_r2udensenet_model, IMAGE_ROW, IMAGE_COL
+from app.services.storage import get_study_dicom_source_dir, study_store
+from app.models.input_shapes import IMAGE_ROW, IMAGE_COL
 from app.utils.image_preprocessing import custom_normalize
-from app.services.dicom import list_dicom_files
+from app.services.dicom import DicomSlice, decode_session, list_dicom_slices, read_slice_pixels
+from app.services.inference_cache import InferenceCache, hash_pixels, make_cache_key, weights_fingerprint
+from app.services.probability_maps import save_probability_maps, upsample_masks
+from app.services.volume import write_area_index
+from app.services.metrics import stage_timer
+from app.services.inference import segmenter_probabilities
+from app.services.profiling import event
+from app.services.pipeline import DECODE_WORKERS, WRITE_WORKERS, Lookahead, Stage, prefetch
+from app.services.memory import plan_slice_storage
+from app.services.postprocess import clean_study_masks
+from app.services.volume_cache import VolumeBuildError
 
 
 def run_segmentation_placeholder(study_id: str, threshold: float = 0.5) -> List[str]:
     # Ensure PNGs exist and create trivial masks by thresholding mid-intensity
     png_files = ensure_png_slices(study_id)
-    masks_dir = get_study_subdir(study_id, "masks")
     saved: List[str] = []
+    raw_areas: List[int] = []
     for idx_name in png_files:
         slice_index = int(os.path.splitext(idx_name)[0])
         img_path = get_png_path(study_id, slice_index)
         img = Image.open(img_path).convert('L')
         arr = np.array(img, dtype=np.float32) / 255.0
         mask = (arr > threshold).astype(np.uint8) * 255
-        out_path = os.path.join(masks_dir, f"{slice_index}.png")
-        Image.fromarray(mask).save(out_path)
+        out_path = study_store.write_mask(study_id, slice_index, mask)
         saved.append(out_path)
+        raw_areas.append(int(np.count_nonzero(mask)))
+    write_area_index(study_id, raw_areas)
     return saved
 
 
 def _load_volume_as_batch(study_id: str) -> np.ndarray:
     # Load DICOM slices directly, preserve as much information as possible, then resize to model input
     dicom_dir = get_study_dicom_source_dir(study_id)
-    dcm_files = list_dicom_files(dicom_dir)
-    batch: List[np.ndarray] = []
-    for name in dcm_files:
-        ds = pydicom.dcmread(os.path.join(dicom_dir, name))
-        arr = ds.pixel_array.astype(np.float32)
-        # Normalize slice to 0..1 per-volume normalization will follow
-        # Resize if needed to model input
-        if arr.shape[::-1] != (IMAGE_COL, IMAGE_ROW):
-            img = Image.fromarray(arr)
-            img = img.resize((IMAGE_COL, IMAGE_ROW))
-            arr = np.array(img, dtype=np.float32)
-        batch.append(arr)
-    vol = np.stack(batch, axis=0)  # N,H,W
-    # Apply custom normalization instead of z-score
-    vol = custom_normalize(vol)
-    vol = np.expand_dims(vol, axis=-1)  # N,H,W,1
-    return vol
-
-
-# Global model cache to avoid retracing
-_segmentation_model_cache = {}
+    slices = list_dicom_slices(dicom_dir)
+    # Filled slice by slice at model size: only one full-resolution slice is alive at a time
+    vol = np.empty((len(slices), IMAGE_ROW, IMAGE_COL), dtype=np.float32)  # N,H,W
+    with decode_session():
+        for i, s in enumerate(slices):
+            vol[i] = _segmenter_input(read_slice_pixels(dicom_dir, s).astype(np.float32))
+    # Per-volume min-max normalization (as custom_normalize on a 3D array), in place
+    lo, hi = vol.min(), vol.max()
+    if hi - lo != 0:
+        vol -= lo
+        vol /= hi - lo
+    return vol[..., None]  # N,H,W,1
+
 
 def run_segmentation_r2u(study_id: str, weights_path: str, threshold: float = 0.5) -> List[str]:
     # Load input volume
     x = _load_volume_as_batch(study_id)
     
-    # Use cached model or create new one
-    cache_key = weights_path
-    if cache_key not in _segmentation_model_cache:
-        model = create_r2udensenet_model()
-        model.load_weights(weights_path)
-        _segmentation_model_cache[cache_key] = model
-    else:
-        model = _segmentation_model_cache[cache_key]
-    
-    # Predict
-    preds = model.predict(x, batch_size=1, verbose=0)  # N,H,W,1
-    preds = np.squeeze(preds, axis=-1)  # N,H,W
+    # Predict (model cached by the registry, or run by the shared inference worker)
+    preds = segmenter_probabilities(x, weights_path)  # N,H,W
     preds = (preds >= threshold).astype(np.uint8) * 255
 
-    masks_dir = get_study_subdir(study_id, "masks")
     saved: List[str] = []
     # Save in original indexing order (1..N)
     for i in range(preds.shape[0]):
-        out_path = os.path.join(masks_dir, f"{i+1}.png")
-        Image.fromarray(preds[i]).save(out_path)
+        out_path = study_store.write_mask(study_id, i + 1, preds[i])
         saved.append(out_path)
+    write_area_index(study_id, [int(np.count_nonzero(m)) for m in preds])
     return saved
 
 
+def _scan_classifier_bidirectional(
+    n: int,
+    classify_indices: Callable[[List[int]], List[bool]],
+    batch_size: int = 8,
+    coarse_stride: int = 0,
+) -> Tuple[List[bool], List[bool]]:
+    """
+    Classify slices from both ends of the series inward and stop once the first positive
+    from each side is found. Slices between the outermost positives are assumed to contain
+    tumor (the segmenter runs on the whole contiguous range anyway); slices outside that
+    range which were never scanned are assumed negative.
+
+    With coarse_stride > 1, every coarse_stride-th slice is classified first, and the fine
+    scan only searches the gaps next to the outermost coarse positives.
+
+    classify_indices: takes a list of 0-based slice indices and returns one bool per index.
+    Returns (flags, inferred) where inferred[i] is True when flags[i] was not produced by
+    the classifier.
+    """
+    scanned: List[Optional[bool]] = [None] * n
+    batch_size = max(1, int(batch_size))
+
+    def _classify(indices: List[int]) -> bool:
+        # Returns True when any slice in indices is positive
+        todo = [i for i in indices if scanned[i] is None]
+        for start in range(0, len(todo), batch_size):
+            chunk = todo[start:start + batch_size]
+            for i, flag in zip(chunk, classify_indices(chunk)):
+                scanned[i] = bool(flag)
+        return any(scanned[i] for i in indices)
+
+    def _scan_inward(lo: int, hi: int, need_left: bool, need_right: bool) -> None:
+        left, right = lo, hi
+        while left <= right and (need_left or need_right):
+            if need_left:
+                stop = min(left + batch_size, right + 1)
+                if _classify(list(range(left, stop))):
+                    need_left = False
+                left = stop
+            if need_right and left <= right:
+                start = max(right - batch_size + 1, left)
+                if _classify(list(range(start, right + 1))):
+                    need_right = False
+                right = start - 1
+
+    samples: List[int] = []
+    if coarse_stride and coarse_stride > 1 and n > coarse_stride:
+        samples = list(range(0, n, coarse_stride))
+        if samples[-1] != n - 1:
+            samples.append(n - 1)
+        _classify(samples)
+
+    coarse_pos = [i for i in samples if scanned[i]]
+    if coarse_pos:
+        first_sample, last_sample = coarse_pos[0], coarse_pos[-1]
+        k_first = samples.index(first_sample)
+        k_last = samples.index(last_sample)
+        # Search the gap before the first coarse positive from the left and the gap after
+        # the last coarse positive from the right
+        if k_first > 0:
+            _scan_inward(samples[k_first - 1] + 1, first_sample, True, False)
+        if k_last < len(samples) - 1:
+            _scan_inward(last_sample, samples[k_last + 1] - 1, False, True)
+    else:
+        # No coarse pass, or it found nothing: fine scan the whole series
+        _scan_inward(0, n - 1, True, True)
+
+    positives = [i for i, f in enumerate(scanned) if f]
+    first_pos = positives[0] if positives else -1
+    last_pos = positives[-1] if positives else -2
+    flags: List[bool] = []
+    inferred: List[bool] = []
+    for i, f in enumerate(scanned):
+        if f is None:
+            flags.append(first_pos <= i <= last_pos)
+            inferred.append(True)
+        else:
+            flags.append(f)
+            inferred.append(False)
+    return flags, inferred
+
+
+def _segmenter_input(arr: np.ndarray) -> np.ndarray:
+    if arr.shape[::-1] != (IMAGE_COL, IMAGE_ROW):
+        img = Image.fromarray(arr)
+        img = img.resize((IMAGE_COL, IMAGE_ROW))
+        arr = np.array(img, dtype=np.float32)
+    return arr
+
+
 def run_classify_then_segment(
     study_id: str,
     classifier_predict_slice: callable,
     segmenter_weights_path: str,
     threshold: float = 0.5,
-) -> Tuple[List[str], List[bool]]:
+    classifier_predict_batch: Optional[Callable[[List[np.ndarray]], List[float]]] = None,
+    scan_mode: str = "full",
+    scan_batch_size: int = 8,
+    coarse_stride: int = 0,
+    classifier_weights_path: Optional[str] = None,
+    classifier_threshold: float = 0.5,
+    cache: Optional[InferenceCache] = None,
+    segment_batch_size: int = 1,
+    memory_budget_mb: Optional[int] = None,
+    slice_storage: Optional[str] = None,
+    memory: Optional[Dict[str, Any]] = None,
+    postprocess: Optional[Dict[str, Any]] = None,
+) -> Tuple[List[str], List[bool], List[bool]]:
     """
     For each slice, run the classifier; if positive, segment; else save an empty mask of same size.
     classifier_predict_slice: function that takes (H,W) np.ndarray and returns bool (tumor present)
+    classifier_predict_batch: optional function that takes a list of (H,W) arrays and returns a
+        list of tumor scores in [0, 1]; when given it is used instead of the per-slice function
+        and scores >= classifier_threshold count as positive
+    scan_mode: "full" classifies every slice; "bidirectional" scans inward from both ends and
+        stops at the first positive from each side (see _scan_classifier_bidirectional)
+    cache: optional InferenceCache; classifier scores (batch scorer + classifier_weights_path
+        required) and segmenter probability maps are looked up by slice content before inference
+    segment_batch_size: slices per segmenter call for cache misses
+    memory_budget_mb / slice_storage: per-job memory budget and how decoded slices are kept
+        (see app.services.memory.plan_slice_storage); the chosen plan is written into memory
+    postprocess: optional clean-up settings (app.services.postprocess); masks are cleaned as a
+        volume before they are written, so each mask is written once
+
+    Returns (saved mask paths, classifier flags, inferred flags).
     """
-    # Load and normalize volume once
     dicom_dir = get_study_dicom_source_dir(study_id)
-    dcm_files = list_dicom_files(dicom_dir)
-    if not dcm_files:
-        return []
-    masks_dir = get_study_subdir(study_id, "masks")
-
-    # Pass 1: run classifier on all slices (original size)
-    classifier_flags: List[bool] = []
-    arrays: List[np.ndarray] = []
-    for name in dcm_files:
-        ds = pydicom.dcmread(os.path.join(dicom_dir, name))
-        arr = ds.pixel_array.astype(np.float32)
-        arrays.append(arr)
-        has_tumor = bool(classifier_predict_slice(arr))
-        classifier_flags.append(has_tumor)
+    slices = list_dicom_slices(dicom_dir)
+    if not slices:
+        return [], [], []
+    if cache is not None and not cache.enabled:
+        cache = None
+
+    header = pydicom.dcmread(os.path.join(dicom_dir, slices[0].name), stop_before_pixels=True)
+    plan = plan_slice_storage(
+        len(slices),
+        int(header.get("Rows", IMAGE_ROW)),
+        int(header.get("Columns", IMAGE_COL)),
+        max(1, int(header.get("BitsAllocated", 16)) // 8),
+        segment_batch_size,
+        budget_mb=memory_budget_mb,
+        mode=slice_storage,
+    )
+    if memory is not None:
+        memory.update(plan)
+
+    # Streaming stages: slices decode in the background while the classifier consumes them,
+    # the next segmenter batch is preprocessed while the current one runs, and masks are
+    # encoded and written while inference continues
+    decoder = Stage("decode", DECODE_WORKERS, max_pending=2 * DECODE_WORKERS)
+    preprocessor = Stage("preprocess", 1)
+    writer = Stage("write", WRITE_WORKERS)
+    with decode_session():
+        try:
+            return _pipeline(
+                study_id=study_id,
+                dicom_dir=dicom_dir,
+                slices=slices,
+                decoder=decoder,
+                preprocessor=preprocessor,
+                writer=writer,
+                classifier_predict_slice=classifier_predict_slice,
+                segmenter_weights_path=segmenter_weights_path,
+                threshold=threshold,
+                classifier_predict_batch=classifier_predict_batch,
+                scan_mode=scan_mode,
+                scan_batch_size=scan_batch_size,
+                coarse_stride=coarse_stride,
+                classifier_weights_path=classifier_weights_path,
+                classifier_threshold=classifier_threshold,
+                cache=cache,
+                segment_batch_size=plan["segment_batch_size"],
+                slice_storage=plan["slice_storage"],
+                postprocess=postprocess,
+            )
+        finally:
+            decoder.close()
+            preprocessor.close()
+            writer.close()
+
+
+def _pipeline(
+    *,
+    study_id: str,
+    dicom_dir: str,
+    slices: List[DicomSlice],
+    decoder: Stage,
+    preprocessor: Stage,
+    writer: Stage,
+    classifier_predict_slice: callable,
+    segmenter_weights_path: str,
+    threshold: float,
+    classifier_predict_batch: Optional[Callable[[List[np.ndarray]], List[float]]],
+    scan_mode: str,
+    scan_batch_size: int,
+    coarse_stride: int,
+    classifier_weights_path: Optional[str],
+    classifier_threshold: float,
+    cache: Optional[InferenceCache],
+    segment_batch_size: int,
+    slice_storage: str,
+    postprocess: Optional[Dict[str, Any]],
+) -> Tuple[List[str], List[bool], List[bool]]:
+    n = len(slices)
+
+    def _decode(idx0: int) -> Tuple[Optional[np.ndarray], str, Tuple[int, ...]]:
+        s = slices[idx0]
+        if slice_storage == "reread" and cache is None:
+            # Nothing to hash; the header is enough until the pixels are needed
+            ds = pydicom.dcmread(os.path.join(dicom_dir, s.name), stop_before_pixels=True)
+            return None, "", (int(ds.Rows), int(ds.Columns))
+        # Only this frame is decoded, so multi-frame files stream like a classic series
+        with stage_timer("dicom_decode", slice=idx0 + 1):
+            pixels = read_slice_pixels(dicom_dir, s)
+        digest = hash_pixels(pixels) if cache is not None else ""
+        if slice_storage == "float32":
+            return pixels.astype(np.float32), digest, pixels.shape
+        if slice_storage == "native":
+            return pixels, digest, pixels.shape
+        return None, digest, pixels.shape
+
+    # Decoded on demand, a few slices ahead of whichever stage asks, through the bounded queue
+    decoded = Lookahead(decoder, _decode, n, ahead=2 * DECODE_WORKERS)
+
+    def pixels(i: int) -> np.ndarray:
+        # float32 per use; native and re-read slices are converted only for the current batch
+        kept = decoded.get(i)[0]
+        if kept is None:
+            with stage_timer("dicom_decode", slice=i + 1, reread=True):
+                kept = read_slice_pixels(dicom_dir, slices[i])
+        return kept.astype(np.float32, copy=False)
+
+    def pixel_hash(i: int) -> str:
+        return decoded.get(i)[1]
+
+    def shape(i: int) -> Tuple[int, ...]:
+        return decoded.get(i)[2]
+
+    clf_cache = cache if (classifier_predict_batch is not None and classifier_weights_path) else None
+    clf_weights_hash = weights_fingerprint(classifier_weights_path) if clf_cache is not None else ""
+
+    def classify_indices(indices: List[int]) -> List[bool]:
+        if classifier_predict_batch is None:
+            return [bool(classifier_predict_slice(pixels(i))) for i in indices]
+        scores = {}
+        misses: List[int] = []
+        for i in indices:
+            score = None
+            if clf_cache is not None:
+                score = clf_cache.get_classifier_score(make_cache_key(pixel_hash(i), clf_weights_hash))
+            if score is None:
+                misses.append(i)
+            else:
+                scores[i] = score
+        if clf_cache is not None:
+            event("cache_lookup", model="classifier", hits=len(indices) - len(misses), misses=len(misses))
+        if misses:
+            for i, score in zip(misses, classifier_predict_batch([pixels(i) for i in misses])):
+                scores[i] = float(score)
+                if clf_cache is not None:
+                    clf_cache.put_classifier_score(make_cache_key(pixel_hash(i), clf_weights_hash), scores[i])
+        return [scores[i] >= classifier_threshold for i in indices]
+
+    # Pass 1: run classifier (original size)
+    if scan_mode == "bidirectional":
+        classifier_flags, inferred_flags = _scan_classifier_bidirectional(
+            n,
+            classify_indices,
+            batch_size=scan_batch_size,
+            coarse_stride=coarse_stride,
+        )
+    else:
+        step = max(1, int(scan_batch_size))
+        classifier_flags = []
+        for start in range(0, n, step):
+            classifier_flags.extend(classify_indices(list(range(start, min(start + step, n)))))
+        inferred_flags = [False] * len(classifier_flags)
 
     # Determine contiguous range from first to last positive
     if any(classifier_flags):
@@ -117,32 +361,76 @@ def run_classify_then_segment(
         first_pos = -1
         last_pos = -2  # ensures no slice is segmented
 
-    # Prepare segmenter model once
-    seg_model = create_r2udensenet_model()
-    seg_model.load_weights(segmenter_weights_path)
+    seg_weights_hash = weights_fingerprint(segmenter_weights_path) if cache is not None else ""
 
-    # Pass 2: segment only within [first_pos, last_pos], zeros elsewhere
-    saved: List[str] = []
-    for idx0, arr in enumerate(arrays):
-        idx = idx0 + 1  # 1-based for filenames
-        if first_pos <= idx0 <= last_pos:
-            arr_resized = arr
-            if arr.shape[::-1] != (IMAGE_COL, IMAGE_ROW):
-                img = Image.fromarray(arr)
-                img = img.resize((IMAGE_COL, IMAGE_ROW))
-                arr_resized = np.array(img, dtype=np.float32)
-            x = custom_normalize(arr_resized)
-            x = np.expand_dims(x, axis=(0, -1))  # 1,H,W,1
-            pred = seg_model.predict(x, batch_size=1, verbose=0)
-            mask_small = (np.squeeze(pred, axis=(0, -1)) >= threshold).astype(np.uint8) * 255
-            mask_img = Image.fromarray(mask_small)
-            mask_img = mask_img.resize((arr.shape[1], arr.shape[0]))
-            out = np.array(mask_img, dtype=np.uint8)
+    # Probability maps at model resolution, kept so the threshold can be changed later
+    probs = np.zeros((n, IMAGE_ROW, IMAGE_COL), dtype=np.float16)
+    segmented = [first_pos <= i <= last_pos for i in range(n)]
+    writes: Dict[int, Future] = {}
+
+    def _save(idx0: int, out: np.ndarray) -> Tuple[str, int]:
+        with stage_timer("mask_write", slice=idx0 + 1):
+            out_path = study_store.write_mask(study_id, idx0 + 1, out)
+        return out_path, int(np.count_nonzero(out))
+
+    def _write(idx0: int) -> Any:
+        # Masks at original size, zeros outside the segmented range
+        if segmented[idx0]:
+            # Threshold the stored float16 map so re-thresholding later reproduces this mask
+            mask_small = probs[idx0:idx0 + 1] >= np.float16(threshold)
+            out = upsample_masks(mask_small, shape(idx0))[0]
         else:
-            out = np.zeros_like(arr, dtype=np.uint8)
-        out_path = os.path.join(masks_dir, f"{idx}.png")
-        Image.fromarray(out).save(out_path)
-        saved.append(out_path)
-    return saved, classifier_flags
+            out = np.zeros(shape(idx0), dtype=np.uint8)
+        if postprocess is not None:
+            return out  # written after the whole volume is cleaned
+        return _save(idx0, out)
+
+    # Pass 2: slices outside [first_pos, last_pos] and cache hits go straight to the writer;
+    # the misses go through the segmenter in batches
+    seg_keys: Dict[int, str] = {}
+    misses: List[int] = []
+    for idx0 in range(n):
+        if segmented[idx0]:
+            prob = None
+            if cache is not None:
+                seg_keys[idx0] = make_cache_key(pixel_hash(idx0), seg_weights_hash)
+                prob = cache.get_probability_map(seg_keys[idx0])
+                event("cache_hit" if prob is not None else "cache_miss", model="segmenter", slice=idx0 + 1)
+            if prob is None:
+                misses.append(idx0)
+                continue
+            probs[idx0] = prob
+        writes[idx0] = writer.put(_write, idx0)
+
+    def _prepare(chunk: List[int]) -> np.ndarray:
+        with stage_timer("preprocess", slice=chunk[0] + 1):
+            x = np.stack([custom_normalize(_segmenter_input(pixels(i))) for i in chunk])
+            return np.expand_dims(x, axis=-1)  # N,H,W,1
 
+    step = max(1, int(segment_batch_size))
+    chunks = [misses[start:start + step] for start in range(0, len(misses), step)]
+    # The segmenter is only loaded when something misses the cache
+    for chunk, x in zip(chunks, prefetch(preprocessor, _prepare, chunks)):
+        with stage_timer("segmenter", slice=chunk[0] + 1, batch_size=len(chunk)):
+            batch_probs = segmenter_probabilities(x, segmenter_weights_path)
+        for idx0, prob in zip(chunk, batch_probs):
+            probs[idx0] = prob
+            if cache is not None:
+                cache.put_probability_map(seg_keys[idx0], prob)
+            writes[idx0] = writer.put(_write, idx0)
 
+    writer.drain()
+    if postprocess is not None:
+        masks = [writes[idx0].result() for idx0 in range(n)]
+        if len({m.shape for m in masks}) != 1:
+            raise VolumeBuildError(f"slices have differing shapes: {sorted({m.shape for m in masks})}")
+        with stage_timer("postprocess"):
+            cleaned = clean_study_masks(study_id, np.stack(masks) > 127, postprocess)["masks"]
+        del masks
+        for idx0 in range(n):
+            writes[idx0] = writer.put(_save, idx0, cleaned[idx0].astype(np.uint8) * 255)
+        writer.drain()
+    results = [writes[idx0].result() for idx0 in range(n)]
+    save_probability_maps(study_id, probs, segmented, [shape(i) for i in range(n)], threshold)
+    write_area_index(study_id, [area for _, area in results])
+    return [path for path, _ in results], classifier_flags, inferred_flags
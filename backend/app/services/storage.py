@@ -1,53 +1,306 @@
+import hashlib
+import json
 import os
 import tempfile
+import threading
+import time
 import uuid
-from typing import List, Tuple
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
 
+import numpy as np
 from fastapi import UploadFile
-from app.services.dicom import list_dicom_files
+from PIL import Image
+
+from app.services.dicom import DicomSlice, directory_signature, list_dicom_files, list_dicom_slices
+from app.services.executors import run_io
 
 
 BASE_STORAGE_DIR = os.environ.get("PDX_STORAGE_DIR") or os.path.join(
     tempfile.gettempdir(), "pdx_segmentation_app"
 )
+SOURCE_PATH_FILENAME = "source_path.txt"
+# Study access times are persisted as the study directory's mtime, at most this often
+ACCESS_TOUCH_INTERVAL_S = 60.0
+OVERLAY_EXTENSIONS = ("png", "webp")
+
+
+def _tmp_path(path: str) -> str:
+    # Same directory so os.replace is a rename; suffix keeps listings of *.png/*.json clean
+    directory, name = os.path.split(path)
+    return os.path.join(directory, f".{name}.{uuid.uuid4().hex[:8]}.tmp")
+
+
+def _atomic(path: str, write: Callable[[str], None]) -> None:
+    tmp = _tmp_path(path)
+    try:
+        try:
+            write(tmp)
+        except FileNotFoundError:
+            # Directory removed since it was cached (e.g. evicted by the storage janitor)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            write(tmp)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def atomic_write_bytes(path: str, content: bytes) -> None:
+    def _write(tmp: str) -> None:
+        with open(tmp, "wb") as out:
+            out.write(content)
+    _atomic(path, _write)
+
+
+def atomic_write_json(path: str, obj: Any, **kwargs: Any) -> None:
+    def _write(tmp: str) -> None:
+        with open(tmp, "w") as f:
+            json.dump(obj, f, **kwargs)
+    _atomic(path, _write)
+
+
+def atomic_save_npy(path: str, arr: np.ndarray) -> None:
+    def _write(tmp: str) -> None:
+        with open(tmp, "wb") as f:
+            np.save(f, arr)
+    _atomic(path, _write)
+
+
+def atomic_save_image(img: Image.Image, path: str, **params: Any) -> None:
+    """Readers never see a partially written image; the format follows the path extension."""
+    fmt = Image.registered_extensions().get(os.path.splitext(path)[1].lower(), "PNG")
+    _atomic(path, lambda tmp: img.save(tmp, format=fmt, **params))
+
+
+class StudyStore:
+    """
+    Study directory layout, resolved once per study and cached:
+
+        <base>/studies/<id>/{png,masks,overlays,probabilities,...}/ plus sidecar files
+
+    Directories are created on first use only, and the DICOM source folder and its file
+    listing are read once, so serving a slice costs a handful of syscalls.
+    """
+
+    def __init__(self, base_dir: str) -> None:
+        self.root = os.path.abspath(os.path.join(base_dir, "studies"))
+        self._dirs: Set[str] = set()
+        self._sources: Dict[str, str] = {}
+        self._dicom_files: Dict[str, List[str]] = {}
+        self._dicom_slices: Dict[str, List[DicomSlice]] = {}
+        self._source_versions: Dict[str, Tuple[Any, str]] = {}  # study -> (folder signature, version)
+        self._png_complete: Set[str] = set()
+        self._touched: Dict[str, float] = {}
+        self._build_locks: Dict[Tuple[str, str], threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def _ensure(self, path: str) -> str:
+        if path not in self._dirs:
+            os.makedirs(path, exist_ok=True)
+            with self._lock:
+                self._dirs.add(path)
+        return path
+
+    def exists(self, study_id: str) -> bool:
+        return os.path.isdir(os.path.join(self.root, study_id))
+
+    def study_dir(self, study_id: str) -> str:
+        path = self._ensure(os.path.join(self.root, study_id))
+        self.touch(study_id)
+        return path
+
+    def touch(self, study_id: str) -> None:
+        """Record an access; the storage janitor evicts least recently used studies first."""
+        now = time.time()
+        if now - self._touched.get(study_id, 0.0) < ACCESS_TOUCH_INTERVAL_S:
+            return
+        self._touched[study_id] = now
+        try:
+            os.utime(os.path.join(self.root, study_id))
+        except OSError:
+            pass
+
+    def last_access(self, study_id: str) -> float:
+        try:
+            mtime = os.stat(os.path.join(self.root, study_id)).st_mtime
+        except OSError:
+            mtime = 0.0
+        return max(mtime, self._touched.get(study_id, 0.0))
+
+    def subdir(self, study_id: str, name: str) -> str:
+        return self._ensure(os.path.join(self.study_dir(study_id), name))
+
+    def sidecar_path(self, study_id: str, filename: str) -> str:
+        return os.path.join(self.study_dir(study_id), filename)
+
+    def png_path(self, study_id: str, slice_index: int) -> str:
+        return os.path.join(self.subdir(study_id, "png"), f"{slice_index}.png")
+
+    def mask_path(self, study_id: str, slice_index: int) -> str:
+        return os.path.join(self.subdir(study_id, "masks"), f"{slice_index}.png")
+
+    def overlay_path(self, study_id: str, slice_index: int, ext: str = "png") -> str:
+        return os.path.join(self.subdir(study_id, "overlays"), f"{slice_index}.{ext}")
+
+    def write_png(self, study_id: str, slice_index: int, img: Image.Image, **params: Any) -> str:
+        path = self.png_path(study_id, slice_index)
+        atomic_save_image(img, path, **params)
+        return path
 
+    def write_mask(self, study_id: str, slice_index: int, mask: np.ndarray) -> str:
+        path = self.mask_path(study_id, slice_index)
+        atomic_save_image(Image.fromarray(mask), path)
+        return path
 
-def _ensure_dir(path: str) -> None:
-    os.makedirs(path, exist_ok=True)
+    def write_overlay(self, study_id: str, slice_index: int, img: Image.Image, ext: str = "png", **params: Any) -> str:
+        path = self.overlay_path(study_id, slice_index, ext)
+        atomic_save_image(img, path, **params)
+        return path
+
+    def remove_overlays(self, study_id: str, slice_index: int) -> None:
+        """Delete every encoded variant of a slice's overlay (they go stale together)."""
+        for ext in OVERLAY_EXTENSIONS:
+            try:
+                os.remove(self.overlay_path(study_id, slice_index, ext))
+            except FileNotFoundError:
+                pass
+
+    def set_source_dir(self, study_id: str, source_dir: str) -> None:
+        source = os.path.abspath(source_dir).strip()
+        atomic_write_bytes(self.sidecar_path(study_id, SOURCE_PATH_FILENAME), source.encode())
+        self.forget(study_id)
+        with self._lock:
+            self._sources[study_id] = source
+
+    def find_by_source(self, source_dir: str) -> Optional[str]:
+        """The study last ingested in place from source_dir in this process, if it still exists."""
+        source = os.path.abspath(source_dir).strip()
+        with self._lock:
+            candidates = [sid for sid, src in self._sources.items() if src == source]
+        for study_id in reversed(candidates):
+            if self.exists(study_id):
+                return study_id
+        return None
+
+    def source_dir(self, study_id: str) -> str:
+        cached = self._sources.get(study_id)
+        if cached is not None:
+            return cached
+        meta_path = self.sidecar_path(study_id, SOURCE_PATH_FILENAME)
+        source = None
+        if os.path.exists(meta_path):
+            try:
+                with open(meta_path, "r") as f:
+                    p = f.read().strip()
+                if os.path.isdir(p):
+                    source = p
+            except Exception:
+                pass
+        if source is not None or not os.path.exists(meta_path):
+            # Fallback to managed dicom folder (for uploaded studies)
+            source = source or self.subdir(study_id, "dicom")
+            with self._lock:
+                self._sources[study_id] = source
+            return source
+        # Recorded source folder is unavailable (e.g. unmounted); re-check next time
+        return self.subdir(study_id, "dicom")
+
+    def dicom_files(self, study_id: str) -> List[str]:
+        cached = self._dicom_files.get(study_id)
+        if cached is not None:
+            return cached
+        files = list_dicom_files(self.source_dir(study_id))
+        if files:
+            # Empty listings are not cached: an upload may still be in progress
+            with self._lock:
+                self._dicom_files[study_id] = files
+        return files
+
+    def source_version(self, study_id: str) -> str:
+        """
+        Changes whenever the study's DICOM files do: folder, names, sizes or mtimes. The files
+        are stat'ed again only when the folder signature changes or after forget().
+        """
+        source = self.source_dir(study_id)
+        signature = directory_signature(source)
+        cached = self._source_versions.get(study_id)
+        if cached is not None and signature is not None and cached[0] == (source, signature):
+            return cached[1]
+        h = hashlib.sha1(source.encode())
+        try:
+            h.update(str(os.stat(source).st_mtime_ns).encode())
+            for name in list_dicom_files(source):
+                st = os.stat(os.path.join(source, name))
+                h.update(f"{name}:{st.st_size}:{st.st_mtime_ns}".encode())
+        except OSError:
+            pass
+        version = h.hexdigest()[:16]
+        if signature is not None:
+            with self._lock:
+                self._source_versions[study_id] = ((source, signature), version)
+        return version
+
+    def dicom_slices(self, study_id: str) -> List[DicomSlice]:
+        """Slices in mask order; differs from dicom_files for multi-frame files."""
+        cached = self._dicom_slices.get(study_id)
+        if cached is not None:
+            return cached
+        slices = list_dicom_slices(self.source_dir(study_id))
+        if slices:
+            with self._lock:
+                self._dicom_slices[study_id] = slices
+        return slices
+
+    def pngs_complete(self, study_id: str) -> bool:
+        return study_id in self._png_complete
+
+    def mark_pngs_complete(self, study_id: str) -> None:
+        with self._lock:
+            self._png_complete.add(study_id)
+
+    def build_lock(self, study_id: str, name: str) -> threading.Lock:
+        """
+        Per-study lock so concurrent requests build a derived artifact only once. Locks are
+        kept for the life of the process (forget() leaves them): callers fetch a lock and
+        acquire it later, and must always get the same object.
+        """
+        with self._lock:
+            return self._build_locks.setdefault((study_id, name), threading.Lock())
+
+    def forget(self, study_id: str) -> None:
+        """Drop cached state for a study, e.g. after its directory was removed."""
+        prefix = os.path.join(self.root, study_id)
+        with self._lock:
+            self._dirs = {d for d in self._dirs if d != prefix and not d.startswith(prefix + os.sep)}
+            self._sources.pop(study_id, None)
+            self._dicom_files.pop(study_id, None)
+            self._dicom_slices.pop(study_id, None)
+            self._source_versions.pop(study_id, None)
+            self._png_complete.discard(study_id)
+
+
+study_store = StudyStore(BASE_STORAGE_DIR)
 
 
 def get_study_dir(study_id: str) -> str:
-    study_dir = os.path.abspath(os.path.join(BASE_STORAGE_DIR, "studies", study_id))
-    _ensure_dir(study_dir)
-    return study_dir
+    return study_store.study_dir(study_id)
+
+
+def study_exists(study_id: str) -> bool:
+    return study_store.exists(study_id)
 
 
 def get_study_subdir(study_id: str, subdir_name: str) -> str:
-    path = os.path.join(get_study_dir(study_id), subdir_name)
-    _ensure_dir(path)
-    return path
+    return study_store.subdir(study_id, subdir_name)
 
 
 def set_study_source_dir(study_id: str, source_dir: str) -> None:
-    study_dir = get_study_dir(study_id)
-    meta_path = os.path.join(study_dir, "source_path.txt")
-    with open(meta_path, "w") as f:
-        f.write(os.path.abspath(source_dir).strip())
+    study_store.set_source_dir(study_id, source_dir)
 
 
 def get_study_dicom_source_dir(study_id: str) -> str:
-    study_dir = get_study_dir(study_id)
-    meta_path = os.path.join(study_dir, "source_path.txt")
-    if os.path.exists(meta_path):
-        try:
-            with open(meta_path, "r") as f:
-                p = f.read().strip()
-            if os.path.isdir(p):
-                return p
-        except Exception:
-            pass
-    # Fallback to managed dicom folder (for uploaded studies)
-    return get_study_subdir(study_id, "dicom")
+    return study_store.source_dir(study_id)
 
 
 async def save_uploads(files: List[UploadFile]) -> Tuple[str, List[str]]:
@@ -60,8 +313,7 @@ async def save_uploads(files: List[UploadFile]) -> Tuple[str, List[str]]:
         filename = os.path.basename(f.filename)
         dest_path = os.path.join(dicom_dir, filename)
         content = await f.read()
-        with open(dest_path, "wb") as out:
-            out.write(content)
+        await run_io(atomic_write_bytes, dest_path, content)
         saved_filenames.append(filename)
 
     return study_id, saved_filenames
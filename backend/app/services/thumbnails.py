@@ -0,0 +1,230 @@
+import json
+import math
+import os
+import shutil
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from app.services.images import ensure_png_slices, get_png_path
+from app.services.metrics import stage_timer
+from app.services.overlay import overlay_mask_on_image
+from app.services.storage import atomic_save_npy, atomic_write_json, study_store
+from app.services.volume import masks_version
+
+
+# Thumbnail pyramid: every slice downscaled so its long side fits each level, stored as one
+# uint8 (N, h, w) stack per level under thumbs/. Stacks are built once per study from the
+# 8-bit previews; mask stacks are rebuilt whenever the area index changes (new masks).
+PYRAMID_LEVELS = tuple(
+    int(v) for v in os.environ.get("PDX_THUMBNAIL_LEVELS", "64,128").split(",") if v.strip()
+)
+FULL_LEVEL = "full"
+THUMBS_SUBDIR = "thumbs"
+# Montages larger than this many pixels are rejected; request a range or a smaller level
+MAX_MONTAGE_PIXELS = int(os.environ.get("PDX_MAX_MONTAGE_PIXELS", str(64 * 1024 * 1024)))
+# Source version the previews and thumbnail stacks were made from
+SOURCE_VERSION_FILENAME = "source_version.json"
+SOURCE_DERIVED_SUBDIRS = ("png", "webp", "png16", "overlays", THUMBS_SUBDIR)
+
+
+def parse_level(level: str) -> Optional[int]:
+    """Pixel size of a pyramid level, None for full resolution. Raises ValueError if unknown."""
+    if level == FULL_LEVEL:
+        return None
+    if not level.isdigit() or int(level) not in PYRAMID_LEVELS:
+        levels = ", ".join([str(v) for v in PYRAMID_LEVELS] + [FULL_LEVEL])
+        raise ValueError(f"unknown level {level!r}; expected one of {levels}")
+    return int(level)
+
+
+def _fit(shape: Tuple[int, int], size: Optional[int]) -> Tuple[int, int]:
+    h, w = shape
+    if size is None or max(h, w) <= size:
+        return h, w
+    scale = size / max(h, w)
+    return max(1, round(h * scale)), max(1, round(w * scale))
+
+
+def _load_gray(path: str) -> np.ndarray:
+    with Image.open(path) as img:
+        return np.array(img.convert('L'))
+
+
+def _stack(slices: List[np.ndarray], size: Optional[int], binary: bool) -> np.ndarray:
+    # Slices of one series normally share a shape; odd ones are resized to the first
+    out_h, out_w = _fit(slices[0].shape, size)
+    stack = np.zeros((len(slices), out_h, out_w), dtype=np.uint8)
+    for i, arr in enumerate(slices):
+        if arr.shape != (out_h, out_w):
+            img = Image.fromarray(arr).resize((out_w, out_h), Image.BILINEAR, reducing_gap=2.0)
+            arr = np.array(img)
+        stack[i] = (arr > 127).astype(np.uint8) * 255 if binary else arr
+    return stack
+
+
+def _stack_path(study_id: str, name: str) -> str:
+    return os.path.join(study_store.subdir(study_id, THUMBS_SUBDIR), f"{name}.npy")
+
+
+def _load_npy(path: str) -> Optional[np.ndarray]:
+    try:
+        return np.load(path)
+    except (OSError, ValueError):
+        return None
+
+
+def refresh_source_derivatives(study_id: str) -> str:
+    """
+    The study's source version. The first call after the source files change deletes the
+    previews, overlays and thumbnail stacks made from the old files and drops the cached
+    slice listing, so every later caller sees the new series.
+    """
+    version = study_store.source_version(study_id)
+    path = study_store.sidecar_path(study_id, SOURCE_VERSION_FILENAME)
+    with study_store.build_lock(study_id, SOURCE_VERSION_FILENAME):
+        try:
+            with open(path, "r") as f:
+                stored = json.load(f).get("version")
+        except (OSError, ValueError):
+            stored = None
+        if stored == version:
+            return version
+        if stored is not None:
+            for name in SOURCE_DERIVED_SUBDIRS:
+                shutil.rmtree(os.path.join(study_store.study_dir(study_id), name), ignore_errors=True)
+            study_store.forget(study_id)
+        atomic_write_json(path, {"version": version})
+    return version
+
+
+def image_stack(study_id: str, size: int) -> Optional[np.ndarray]:
+    """(N, h, w) uint8 previews at a pyramid level, built on first use."""
+    refresh_source_derivatives(study_id)
+    files = ensure_png_slices(study_id)
+    if not files:
+        return None
+    path = _stack_path(study_id, str(size))
+    with study_store.build_lock(study_id, str(size)):
+        stack = _load_npy(path)
+        if stack is not None and stack.shape[0] == len(files):
+            return stack
+        with stage_timer("thumbnail_build", level=size):
+            stack = _stack([_load_gray(get_png_path(study_id, i)) for i in range(1, len(files) + 1)], size, False)
+            atomic_save_npy(path, stack)
+    return stack
+
+
+def _mask_paths(study_id: str, num_slices: int) -> Optional[List[str]]:
+    paths = [study_store.mask_path(study_id, i) for i in range(1, num_slices + 1)]
+    return paths if all(os.path.exists(p) for p in paths) else None
+
+
+def mask_stack(study_id: str, size: int, num_slices: int) -> Optional[np.ndarray]:
+    """(N, h, w) uint8 {0,255} masks at a pyramid level; None when the study has no masks."""
+    version = masks_version(study_id)
+    paths = _mask_paths(study_id, num_slices) if version is not None else None
+    if paths is None:
+        return None
+    name = f"{size}_masks"
+    path = _stack_path(study_id, name)
+    meta_path = os.path.join(os.path.dirname(path), f"{name}.json")
+    with study_store.build_lock(study_id, name):
+        try:
+            with open(meta_path, "r") as f:
+                stored = json.load(f).get("version")
+        except (OSError, ValueError):
+            stored = None
+        stack = _load_npy(path) if stored == version else None
+        if stack is not None and stack.shape[0] == num_slices:
+            return stack
+        with stage_timer("thumbnail_build", level=size, kind="masks"):
+            stack = _stack([_load_gray(p) for p in paths], size, True)
+            atomic_save_npy(path, stack)
+            atomic_write_json(meta_path, {"version": version})
+    return stack
+
+
+def _tiles(study_id: str, size: Optional[int], start: int, end: int, overlay: bool, num_slices: int):
+    # Pyramid levels slice the cached stacks; full resolution decodes only the requested range
+    if size is None:
+        if not ensure_png_slices(study_id):
+            return None, None
+        images = _stack([_load_gray(get_png_path(study_id, i)) for i in range(start, end + 1)], None, False)
+        paths = _mask_paths(study_id, num_slices) if overlay else None
+        masks = _stack([_load_gray(p) for p in paths[start - 1:end]], None, True) if paths else None
+        return images, masks
+    images = image_stack(study_id, size)
+    if images is None:
+        return None, None
+    masks = mask_stack(study_id, size, num_slices) if overlay else None
+    return images[start - 1:end], (masks[start - 1:end] if masks is not None else None)
+
+
+def _grid(tiles: np.ndarray, rows: int, columns: int) -> np.ndarray:
+    count, tile_h, tile_w = tiles.shape
+    flat = np.zeros((rows * columns, tile_h, tile_w), dtype=np.uint8)
+    flat[:count] = tiles
+    return flat.reshape(rows, columns, tile_h, tile_w).transpose(0, 2, 1, 3).reshape(rows * tile_h, columns * tile_w)
+
+
+def render_montage(
+    study_id: str,
+    level: str,
+    start: int = 1,
+    end: Optional[int] = None,
+    columns: Optional[int] = None,
+    overlay: bool = False,
+    alpha: float = 0.4,
+) -> Optional[Tuple[Image.Image, Dict[str, Any]]]:
+    """
+    Sprite sheet of slices start..end (1-based, inclusive) at a pyramid level, laid out row
+    by row in slice order. Returns the image and its layout, or None for an unknown study.
+    Raises ValueError for an invalid level, range or montage size.
+    """
+    size = parse_level(level)
+    num_slices = len(study_store.dicom_slices(study_id))
+    if num_slices == 0:
+        return None
+    end = num_slices if end is None else end
+    if start < 1 or end > num_slices or start > end:
+        raise ValueError(f"slice range must lie within 1..{num_slices}")
+    count = end - start + 1
+    columns = columns or math.ceil(math.sqrt(count))
+    columns = min(columns, count)
+    rows = math.ceil(count / columns)
+
+    if size is None:
+        # Checked before decoding anything; pyramid tiles are at most size x size
+        ensure_png_slices(study_id)
+        tile_h, tile_w = _load_gray(get_png_path(study_id, start)).shape
+    else:
+        tile_h = tile_w = size
+    if rows * tile_h * columns * tile_w > MAX_MONTAGE_PIXELS:
+        raise ValueError("montage too large; request a slice range or a smaller level")
+
+    images, masks = _tiles(study_id, size, start, end, overlay, num_slices)
+    if images is None:
+        return None
+    tile_h, tile_w = images.shape[1:]
+    with stage_timer("montage_render", level=level):
+        sheet = _grid(images, rows, columns)
+        if masks is not None:
+            img = overlay_mask_on_image(
+                sheet, (_grid(masks, rows, columns) > 127).astype(np.uint8), color_rgb=(0, 255, 0), alpha=alpha
+            )
+        else:
+            img = Image.fromarray(sheet, mode='L')
+
+    layout = {
+        "level": level,
+        "start": start,
+        "end": end,
+        "columns": columns,
+        "rows": rows,
+        "tile_width": int(tile_w),
+        "tile_height": int(tile_h),
+        "overlay": masks is not None,
+    }
+    return img, layout
@@ -1,6 +1,14 @@
-from typing import Iterable, List, Sequence
+import json
+import os
+from typing import Dict, Iterable, List, Optional, Sequence
 
 import numpy as np
+from PIL import Image
+
+from app.services.storage import atomic_write_json, get_study_dir, get_study_subdir
+
+
+AREA_INDEX_FILENAME = "areas.json"
 
 
 def compute_raw_areas(mask_volume: np.ndarray) -> List[float]:
@@ -16,6 +24,66 @@ def scale_single_area(raw_area: float, slice_thickness_mm: float, pixel_spacing_
 
 
 def scale_all_areas(raw_areas: Iterable[float], slice_thickness_mm: float, pixel_spacing_mm: Sequence[float]) -> List[float]:
-    return [scale_single_area(area, slice_thickness_mm, pixel_spacing_mm) for area in raw_areas]
+    # Same operation order as scale_single_area, so results are identical, over the whole list at once
+    raw = np.asarray(list(raw_areas), dtype=np.float64)
+    return (raw * slice_thickness_mm * pixel_spacing_mm[0] * pixel_spacing_mm[1] / 1000.0).tolist()
+
+
+def read_area_index(study_id: str) -> Optional[List[int]]:
+    # Per-slice raw mask pixel counts, in slice order; None when not yet written
+    path = os.path.join(get_study_dir(study_id), AREA_INDEX_FILENAME)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r") as f:
+            return [int(a) for a in json.load(f)["raw_areas"]]
+    except Exception:
+        return None
+
+
+def write_area_index(study_id: str, raw_areas: Iterable[float]) -> None:
+    path = os.path.join(get_study_dir(study_id), AREA_INDEX_FILENAME)
+    atomic_write_json(path, {"raw_areas": [int(a) for a in raw_areas]})
+
+
+def masks_version(study_id: str) -> Optional[int]:
+    # Every mask writer (pipeline, rethreshold, resegment) rewrites the area index after it,
+    # so its mtime identifies the current set of masks for derived caches
+    try:
+        return os.stat(os.path.join(get_study_dir(study_id), AREA_INDEX_FILENAME)).st_mtime_ns
+    except OSError:
+        return None
+
+
+def update_area_index(study_id: str, updates: Dict[int, int]) -> None:
+    # updates maps 0-based slice index -> raw area; ignored if no index exists yet
+    raw_areas = read_area_index(study_id)
+    if raw_areas is None:
+        return
+    for i, area in updates.items():
+        if 0 <= i < len(raw_areas):
+            raw_areas[i] = int(area)
+    write_area_index(study_id, raw_areas)
 
 
+def load_raw_areas(study_id: str) -> List[int]:
+    """
+    Per-slice raw areas in mask order. Uses the area index when it matches the masks on disk;
+    otherwise decodes the masks once and writes the index for next time.
+    """
+    masks_dir = get_study_subdir(study_id, "masks")
+    mask_files = sorted(
+        (f for f in os.listdir(masks_dir) if f.lower().endswith('.png')),
+        key=lambda x: int(os.path.splitext(x)[0])
+    )
+    if not mask_files:
+        return []
+    raw_areas = read_area_index(study_id)
+    if raw_areas is not None and len(raw_areas) == len(mask_files):
+        return raw_areas
+    raw_areas = [
+        int(np.count_nonzero(np.array(Image.open(os.path.join(masks_dir, name)).convert('L')) > 127))
+        for name in mask_files
+    ]
+    write_area_index(study_id, raw_areas)
+    return raw_areas
@@ -0,0 +1,154 @@
+import json
+import os
+import struct
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+import pydicom
+
+from app.services.dicom import DicomSlice, decode_session, functional_group, read_slice_pixels
+from app.services.images import ensure_png_slices, get_png_path
+from app.services.metrics import stage_timer
+from app.services.pipeline import DECODE_WORKERS, Stage, prefetch
+from app.services.storage import atomic_save_npy, atomic_write_json, study_store
+from app.services.thumbnails import refresh_source_derivatives
+from app.services.volume import masks_version
+
+
+# Whole-study (N, H, W) arrays under volume/, built once and memory-mapped on read so any
+# slice range is a view. "uint8" images match the 8-bit previews, "native" images keep the
+# stored DICOM values (int16, or uint16 when they do not fit), masks are uint8 {0,1}.
+VOLUME_SUBDIR = "volume"
+KINDS = ("image", "mask")
+DTYPES = ("uint8", "native")
+
+# Payload header, little-endian: magic, version, dtype code, kind code, start (1-based),
+# then shape (slices, rows, cols). Voxel data follows in C order.
+HEADER = struct.Struct("<4sBBHIIII")
+MAGIC = b"PDXV"
+HEADER_VERSION = 1
+DTYPE_CODES = {"uint8": 1, "int16": 2, "uint16": 3}
+KIND_CODES = {"image": 0, "mask": 1}
+
+
+class VolumeBuildError(ValueError):
+    """The study's slices cannot be stacked into one volume (mixed shapes or value range)."""
+
+
+def _stack(slices: List[np.ndarray], dtype: Any) -> np.ndarray:
+    shapes = {a.shape for a in slices}
+    if len(shapes) != 1:
+        raise VolumeBuildError(f"slices have differing shapes: {sorted(shapes)}")
+    return np.stack(slices).astype(dtype, copy=False)
+
+
+def _load_gray(path: str) -> np.ndarray:
+    with Image.open(path) as img:
+        return np.array(img.convert('L'))
+
+
+def _native_volume(study_id: str) -> Tuple[np.ndarray, Dict[str, float]]:
+    source = study_store.source_dir(study_id)
+    refs = study_store.dicom_slices(study_id)
+    ds = pydicom.dcmread(os.path.join(source, refs[0].name), stop_before_pixels=True)
+    # Enhanced multi-frame files keep the rescale in a functional group
+    transform = ds if "RescaleSlope" in ds else functional_group(ds, 0, "PixelValueTransformationSequence")
+    rescale = {
+        "slope": float(getattr(transform, "RescaleSlope", 1.0) or 1.0),
+        "intercept": float(getattr(transform, "RescaleIntercept", 0.0) or 0.0),
+    }
+
+    def _decode(s: DicomSlice) -> np.ndarray:
+        with stage_timer("dicom_decode"):
+            return read_slice_pixels(source, s)
+
+    with Stage("decode", DECODE_WORKERS) as decoder, decode_session():
+        slices = list(prefetch(decoder, _decode, refs, ahead=2 * DECODE_WORKERS))
+    lo = min(int(a.min()) for a in slices)
+    hi = max(int(a.max()) for a in slices)
+    dtype = np.int16 if lo >= -32768 and hi <= 32767 else np.uint16
+    if dtype is np.uint16 and lo < 0:
+        raise VolumeBuildError("pixel values do not fit in 16 bits")
+    return _stack(slices, dtype), rescale
+
+
+def _cache_paths(study_id: str, name: str) -> Tuple[str, str]:
+    directory = study_store.subdir(study_id, VOLUME_SUBDIR)
+    return os.path.join(directory, f"{name}.npy"), os.path.join(directory, f"{name}.json")
+
+
+def load_volume(study_id: str, kind: str, dtype: str) -> Optional[Tuple[np.ndarray, Dict[str, Any]]]:
+    """
+    Memory-mapped volume and its metadata ({"version", and "rescale" for native images}),
+    built on first use. None when the study has no slices, or no masks for kind="mask".
+    Raises VolumeBuildError when the slices cannot be stacked.
+    """
+    # Images follow the source files, so a changed series is rebuilt (and gets a new ETag);
+    # refreshing first also drops the previews and slice listing of the old series
+    version = masks_version(study_id) if kind == "mask" else refresh_source_derivatives(study_id)
+    if version is None:
+        return None
+    num_slices = len(study_store.dicom_slices(study_id))
+    if num_slices == 0:
+        return None
+    name = "masks" if kind == "mask" else f"images_{dtype}"
+    npy_path, meta_path = _cache_paths(study_id, name)
+    with study_store.build_lock(study_id, f"{VOLUME_SUBDIR}/{name}"):
+        try:
+            with open(meta_path, "r") as f:
+                meta = json.load(f)
+            if meta.get("version") == version:
+                vol = np.load(npy_path, mmap_mode="r")
+                if vol.shape[0] == num_slices:
+                    return vol, meta
+        except (OSError, ValueError):
+            pass
+        with stage_timer("volume_build", kind=kind, dtype=dtype):
+            meta = {"version": version}
+            if kind == "mask":
+                paths = [study_store.mask_path(study_id, i) for i in range(1, num_slices + 1)]
+                if not all(os.path.exists(p) for p in paths):
+                    return None
+                vol = _stack([_load_gray(p) > 127 for p in paths], np.uint8)
+            elif dtype == "native":
+                vol, meta["rescale"] = _native_volume(study_id)
+            else:
+                ensure_png_slices(study_id)
+                vol = _stack([_load_gray(get_png_path(study_id, i)) for i in range(1, num_slices + 1)], np.uint8)
+            atomic_save_npy(npy_path, vol)
+            atomic_write_json(meta_path, meta)
+    return np.load(npy_path, mmap_mode="r"), meta
+
+
+def slice_range_payload(
+    study_id: str, kind: str, dtype: str, start: int = 1, end: Optional[int] = None
+) -> Optional[Tuple[bytes, Dict[str, Any]]]:
+    """
+    Header plus raw voxels for slices start..end (1-based, inclusive), and a description of
+    the payload. None when the volume is unavailable; ValueError for an invalid range.
+    """
+    loaded = load_volume(study_id, kind, dtype)
+    if loaded is None:
+        return None
+    vol, meta = loaded
+    n, rows, cols = vol.shape
+    end = n if end is None else end
+    if start < 1 or end > n or start > end:
+        raise ValueError(f"slice range must lie within 1..{n}")
+    data = np.ascontiguousarray(vol[start - 1:end])
+    dtype_name = data.dtype.name
+    header = HEADER.pack(
+        MAGIC, HEADER_VERSION, DTYPE_CODES[dtype_name], KIND_CODES[kind], start, end - start + 1, rows, cols
+    )
+    info = {
+        "kind": kind,
+        "dtype": dtype_name,
+        "shape": [end - start + 1, rows, cols],
+        "start": start,
+        "end": end,
+        "header_bytes": HEADER.size,
+        "version": meta.get("version"),
+        "rescale": meta.get("rescale"),
+    }
+    return header + data.tobytes(), info
@@ -0,0 +1,170 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from app.services.inference_cache import weights_fingerprint
+from app.services.storage import BASE_STORAGE_DIR, _atomic, atomic_write_json
+
+
+# Model weights converted to a flat, memory-mappable form. Loading an HDF5 weights file
+# walks the h5 tree layer by layer; the first load does that once and dumps every variable,
+# in model.weights order, into one raw .bin (64-byte aligned) plus a JSON manifest, keyed by
+# the SHA-256 of the HDF5 file. Later loads map the .bin and hand views to set_weights, so
+# only the pages actually copied into the variables are read. Replacing the HDF5 file
+# changes its checksum, and the next load converts again. Converted copies count towards the
+# storage quota and are evicted by the janitor last, least recently loaded first.
+
+logger = logging.getLogger(__name__)
+
+WEIGHTS_CACHE_DIR = os.environ.get("PDX_WEIGHTS_CACHE_DIR") or os.path.join(BASE_STORAGE_DIR, "cache", "weights")
+WEIGHTS_FORMATS = ("flat", "hdf5")
+# "hdf5" always reads the original file and never writes a converted copy
+WEIGHTS_FORMAT = os.environ.get("PDX_WEIGHTS_FORMAT", "flat")
+
+FORMAT_VERSION = 1
+_ALIGN = 64
+
+_convert_lock = threading.Lock()
+
+
+def _source_checksum(weights_path: str, cache_dir: str) -> str:
+    """
+    weights_fingerprint, remembered on disk per (path, size, mtime) so a fresh process does
+    not re-hash a ~100 MB file before every load.
+    """
+    path = os.path.abspath(weights_path)
+    st = os.stat(path)
+    memo = os.path.join(cache_dir, "src-%s.json" % hashlib.sha1(path.encode()).hexdigest()[:16])
+    stamp = {"path": path, "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+    try:
+        with open(memo, "r") as f:
+            cached = json.load(f)
+        if {k: cached.get(k) for k in stamp} == stamp and cached.get("sha256"):
+            return cached["sha256"]
+    except (OSError, ValueError):
+        pass
+    digest = weights_fingerprint(path)
+    try:
+        atomic_write_json(memo, {**stamp, "sha256": digest})
+    except OSError as exc:
+        logger.warning("Could not record weights checksum in %s: %s", cache_dir, exc)
+    return digest
+
+
+def converted_paths(kind: str, checksum: str, cache_dir: str = WEIGHTS_CACHE_DIR) -> Dict[str, str]:
+    stem = os.path.join(cache_dir, f"{kind}-{checksum[:24]}")
+    return {"data": stem + ".bin", "manifest": stem + ".json"}
+
+
+def write_flat_weights(arrays: List[np.ndarray], paths: Dict[str, str], checksum: str) -> None:
+    """Write arrays into one aligned .bin, then the manifest that marks it complete."""
+    entries: List[Dict[str, Any]] = []
+
+    def _write(tmp: str) -> None:
+        entries.clear()
+        offset = 0
+        with open(tmp, "wb") as f:
+            for arr in arrays:
+                arr = np.ascontiguousarray(arr)
+                pad = -offset % _ALIGN
+                f.write(b"\0" * pad)
+                offset += pad
+                entries.append({"offset": offset, "shape": list(arr.shape), "dtype": arr.dtype.str})
+                f.write(arr.tobytes())
+                offset += arr.nbytes
+
+    _atomic(paths["data"], _write)
+    atomic_write_json(paths["manifest"], {
+        "format_version": FORMAT_VERSION,
+        "source_sha256": checksum,
+        "size": os.path.getsize(paths["data"]),
+        "arrays": entries,
+    })
+
+
+def read_flat_weights(paths: Dict[str, str], checksum: str) -> Optional[List[np.ndarray]]:
+    """Read-only memory-mapped views of converted weights; None when missing or stale."""
+    try:
+        with open(paths["manifest"], "r") as f:
+            manifest = json.load(f)
+        if manifest.get("format_version") != FORMAT_VERSION or manifest.get("source_sha256") != checksum:
+            return None
+        if os.path.getsize(paths["data"]) != manifest["size"]:
+            return None
+    except (OSError, ValueError, KeyError):
+        return None
+    if not manifest["arrays"]:
+        return []
+    data = np.memmap(paths["data"], dtype=np.uint8, mode="r")
+    return [
+        np.ndarray(tuple(e["shape"]), dtype=np.dtype(e["dtype"]), buffer=data, offset=e["offset"])
+        for e in manifest["arrays"]
+    ]
+
+
+def load_weights(
+    model: Any,
+    kind: str,
+    weights_path: str,
+    weights_format: Optional[str] = None,
+    cache_dir: Optional[str] = None,
+) -> str:
+    """
+    Load weights_path into a built model, from its converted copy when there is one.
+    Returns the format actually read: "flat", or "hdf5" (converting it for next time).
+    """
+    weights_format = weights_format or WEIGHTS_FORMAT
+    if weights_format not in WEIGHTS_FORMATS:
+        raise ValueError(f"weights format must be one of {', '.join(WEIGHTS_FORMATS)}")
+    if weights_format == "hdf5":
+        model.load_weights(weights_path)
+        return "hdf5"
+    cache_dir = cache_dir or WEIGHTS_CACHE_DIR
+    checksum = _source_checksum(weights_path, cache_dir)
+    paths = converted_paths(kind, checksum, cache_dir)
+    arrays = read_flat_weights(paths, checksum)
+    if arrays is not None:
+        try:
+            model.set_weights(arrays)
+            try:
+                os.utime(paths["manifest"])  # last use, for eviction order
+            except OSError:
+                pass
+            return "flat"
+        except ValueError as exc:
+            # Architecture changed since the conversion; the HDF5 file is the source of truth
+            logger.warning("Converted %s weights do not fit the model, reconverting: %s", kind, exc)
+    model.load_weights(weights_path)
+    with _convert_lock:
+        try:
+            write_flat_weights(model.get_weights(), paths, checksum)
+        except OSError as exc:
+            logger.warning("Could not write converted %s weights to %s: %s", kind, cache_dir, exc)
+    return "hdf5"
+
+
+def evict_bytes(max_bytes: int, cache_dir: str = WEIGHTS_CACHE_DIR) -> int:
+    """Delete converted copies, least recently loaded first, until max_bytes are freed."""
+    try:
+        manifests = [e for e in os.scandir(cache_dir) if e.name.endswith(".json") and not e.name.startswith("src-")]
+    except OSError:
+        return 0
+    manifests.sort(key=lambda e: e.stat().st_mtime)
+    freed = 0
+    for entry in manifests:
+        if freed >= max_bytes:
+            break
+        # Manifest first: a half-deleted pair then reads as missing, never as complete
+        for path in (entry.path, entry.path[:-len(".json")] + ".bin"):
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+                freed += size
+            except OSError:
+                continue
+    return freed
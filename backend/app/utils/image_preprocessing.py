@@ -2,14 +2,23 @@ import numpy as np
 import os
 
 
+# Bump whenever slice preprocessing (resize, normalization) changes so cached
+# model outputs computed with the old pipeline are no longer reused.
+PREPROCESSING_VERSION = "1"
+
+
 def get_default_segmentation_weights_path():
-    """Get the default path to segmentation model weights"""
-    return os.path.join("app", "models", "segmentation_model", "weights", "model_r2udensenet.hdf5")
+    """Get the default path to segmentation model weights (PDX_SEGMENTATION_WEIGHTS overrides)"""
+    return os.environ.get("PDX_SEGMENTATION_WEIGHTS") or os.path.join(
+        "app", "models", "segmentation_model", "weights", "model_r2udensenet.hdf5"
+    )
 
 
 def get_default_classifier_weights_path():
-    """Get the default path to classifier model weights"""
-    return os.path.join("app", "models", "classifier_model", "weights", "model_resnet50.hdf5")
+    """Get the default path to classifier model weights (PDX_CLASSIFIER_WEIGHTS overrides)"""
+    return os.environ.get("PDX_CLASSIFIER_WEIGHTS") or os.path.join(
+        "app", "models", "classifier_model", "weights", "model_resnet50.hdf5"
+    )
 
 
 def custom_normalize(image):
@@ -0,0 +1,164 @@
+"""
+TensorFlow thread / batch-size autotuner.
+
+Times the R2U-DenseNet segmenter and ResNet50 classifier on synthetic 192x192 input over a
+grid of intra-op threads, inter-op threads and batch sizes, and writes the best settings to
+a JSON file read by the service at startup (PDX_INFERENCE_CONFIG):
+
+    cd backend
+    python -m benchmarks.autotune --out inference_config.json
+    PDX_INFERENCE_CONFIG=inference_config.json uvicorn app.main:app
+
+Thread pools cannot be changed once TensorFlow has started, so each thread setting is
+measured in a fresh subprocess. Models use random weights; timings do not depend on them.
+With --objective throughput (default) the settings maximize slices per second across
+cpu_count // intra_op_threads concurrent jobs; with latency, a single job's speed.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+
+def _int_list(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def _default_threads(cores: int) -> List[int]:
+    return sorted({max(1, cores // d) for d in (8, 4, 2, 1)})
+
+
+def _measure(intra: int, inter: int, batch_sizes: List[int], slices: int, seed: int) -> Dict[str, Any]:
+    # Runs in the child process: threads must be set before TensorFlow executes anything
+    import numpy as np
+    import tensorflow as tf
+
+    tf.config.threading.set_intra_op_parallelism_threads(intra)
+    tf.config.threading.set_inter_op_parallelism_threads(inter)
+    tf.keras.utils.set_random_seed(seed)
+
+    from app.models.input_shapes import CLASSIFIER_IMAGE_COLS, CLASSIFIER_IMAGE_ROWS, IMAGE_COL, IMAGE_ROW
+    from app.models.classifier_model.architectures.resnet50 import create_resnet50_classifier
+    from app.models.segmentation_model.architectures.r2udensenet import create_r2udensenet_model
+
+    rng = np.random.default_rng(seed)
+    models = {
+        "segmenter": (create_r2udensenet_model(), (IMAGE_ROW, IMAGE_COL)),
+        "classifier": (create_resnet50_classifier(), (CLASSIFIER_IMAGE_ROWS, CLASSIFIER_IMAGE_COLS)),
+    }
+    out: Dict[str, Any] = {}
+    for name, (model, (rows, cols)) in models.items():
+        out[name] = {}
+        for batch_size in batch_sizes:
+            x = rng.random((batch_size, rows, cols, 1), dtype=np.float32)
+            model.predict(x, batch_size=batch_size, verbose=0)  # warm-up: graph tracing
+            calls = max(1, slices // batch_size)
+            t0 = time.perf_counter()
+            for _ in range(calls):
+                model.predict(x, batch_size=batch_size, verbose=0)
+            elapsed = time.perf_counter() - t0
+            out[name][str(batch_size)] = calls * batch_size / elapsed
+    return out
+
+
+def _run_child(intra: int, inter: int, args: argparse.Namespace) -> Optional[Dict[str, Any]]:
+    cmd = [
+        sys.executable, "-m", "benchmarks.autotune", "--child",
+        "--intra", str(intra), "--inter", str(inter),
+        "--batch-sizes", ",".join(str(b) for b in args.batch_sizes),
+        "--slices", str(args.slices), "--seed", str(args.seed),
+    ]
+    env = dict(os.environ, TF_CPP_MIN_LOG_LEVEL="2")
+    proc = subprocess.run(cmd, capture_output=True, text=True, env=env)
+    if proc.returncode != 0:
+        print(f"intra={intra} inter={inter} failed:\n{proc.stderr[-2000:]}", file=sys.stderr)
+        return None
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def choose(measurements: List[Dict[str, Any]], cores: int, objective: str) -> Dict[str, Any]:
+    """Best setting: each model at its fastest batch size, scored on the full pipeline."""
+    best: Optional[Dict[str, Any]] = None
+    for m in measurements:
+        seg_batch, seg_rate = max(m["slices_per_s"]["segmenter"].items(), key=lambda kv: kv[1])
+        clf_batch, clf_rate = max(m["slices_per_s"]["classifier"].items(), key=lambda kv: kv[1])
+        # A slice goes through both models; jobs run side by side on disjoint cores
+        per_job = 1.0 / (1.0 / seg_rate + 1.0 / clf_rate)
+        jobs = max(1, cores // m["intra_op_threads"])
+        score = per_job * jobs if objective == "throughput" else per_job
+        if best is None or score > best["score"]:
+            best = {
+                "score": score,
+                "config": {
+                    "intra_op_threads": m["intra_op_threads"],
+                    "inter_op_threads": m["inter_op_threads"],
+                    "segmenter_batch_size": int(seg_batch),
+                    "classifier_batch_size": int(clf_batch),
+                    "max_concurrent_jobs": jobs if objective == "throughput" else 1,
+                },
+            }
+    if best is None:
+        raise RuntimeError("no setting could be measured")
+    return best
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    cores = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description="Autotune TensorFlow threads and batch sizes")
+    parser.add_argument("--threads", type=_int_list, default=_default_threads(cores),
+                        help="Comma-separated intra-op thread counts to try")
+    parser.add_argument("--inter", type=_int_list, default=[1, 2], help="Inter-op thread counts to try")
+    parser.add_argument("--batch-sizes", type=_int_list, default=[1, 4, 8, 16])
+    parser.add_argument("--slices", type=int, default=32, help="Slices timed per measurement")
+    parser.add_argument("--objective", choices=["throughput", "latency"], default="throughput")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="inference_config.json")
+    # Internal: one measurement in a fresh process
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--intra", type=int, default=1, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        rates = _measure(args.intra, args.inter[0], args.batch_sizes, args.slices, args.seed)
+        print(json.dumps(rates))
+        return 0
+
+    measurements: List[Dict[str, Any]] = []
+    for intra in args.threads:
+        for inter in args.inter:
+            rates = _run_child(intra, inter, args)
+            if rates is None:
+                continue
+            measurements.append({"intra_op_threads": intra, "inter_op_threads": inter, "slices_per_s": rates})
+            seg, clf = rates["segmenter"], rates["classifier"]
+            print(
+                f"intra={intra:<3} inter={inter:<2} "
+                f"segmenter {max(seg.values()):7.1f}/s (batch {max(seg, key=seg.get)})  "
+                f"classifier {max(clf.values()):7.1f}/s (batch {max(clf, key=clf.get)})"
+            )
+
+    best = choose(measurements, cores, args.objective)
+    report = {
+        "config": best["config"],
+        "objective": args.objective,
+        "score_slices_per_s": best["score"],
+        "measurements": measurements,
+        "meta": {
+            "cpu_count": cores,
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+    }
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"best: {json.dumps(best['config'])} -> {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
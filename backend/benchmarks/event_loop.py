@@ -0,0 +1,143 @@
+"""
+Event-loop responsiveness under heavy exports.
+
+Runs the ASGI app in-process, fires several concurrent heavy export requests (ZIP, NPZ,
+MAT, XLSX) against a synthetic study, and meanwhile measures how late a short
+asyncio.sleep() ticker and a stream of slice requests are served. Fails (exit 1) when the
+worst ticker lag exceeds --budget seconds, i.e. when a route blocks the event loop:
+
+    cd backend
+    pip install httpx
+    python -m benchmarks.event_loop --budget 0.1
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+
+HEAVY = [
+    "/export/{sid}/images.zip?kind=pngs",
+    "/export/{sid}/images.zip?kind=masks",
+    "/export/{sid}/images.npz",
+    "/export/{sid}/masks?format=npz",
+    "/export/{sid}/masks?format=mat",
+    "/export/{sid}/volumes.xlsx",
+]
+
+
+def _prepare_study(work_dir: str, slices: int, rows: int, cols: int) -> str:
+    import numpy as np
+    from PIL import Image
+
+    from benchmarks.synthetic import generate_series
+    from app.services.storage import get_study_subdir, ingest_local_directory
+
+    series_dir = os.path.join(work_dir, "series")
+    generate_series(series_dir, slices, rows, cols)
+    study_id, _ = ingest_local_directory(series_dir)
+    # Masks without running the models: a disc per slice is enough to exercise the exports
+    masks_dir = get_study_subdir(study_id, "masks")
+    yy, xx = np.mgrid[:rows, :cols]
+    disc = (((yy - rows / 2) ** 2 + (xx - cols / 2) ** 2) < (min(rows, cols) / 4) ** 2).astype(np.uint8) * 255
+    for i in range(1, slices + 1):
+        Image.fromarray(disc).save(os.path.join(masks_dir, f"{i}.png"))
+    return study_id
+
+
+def _summary(values: List[float]) -> Dict[str, float]:
+    ordered = sorted(values)
+    return {
+        "count": len(ordered),
+        "median_s": statistics.median(ordered),
+        "p99_s": ordered[min(len(ordered) - 1, int(0.99 * len(ordered)))],
+        "max_s": ordered[-1],
+    }
+
+
+async def _measure(study_id: str, args: argparse.Namespace) -> Dict[str, Any]:
+    import httpx
+
+    from app.main import app
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        # Warm up: PNG conversion and the export process pool are one-time costs
+        (await client.get(f"/images/{study_id}/1.png")).raise_for_status()
+        (await client.get(f"/export/{study_id}/volumes.xlsx")).raise_for_status()
+
+        done = asyncio.Event()
+        lags: List[float] = []
+        slice_latency: List[float] = []
+
+        async def ticker() -> None:
+            while not done.is_set():
+                t0 = time.perf_counter()
+                await asyncio.sleep(args.interval)
+                lags.append(time.perf_counter() - t0 - args.interval)
+
+        async def slice_reader() -> None:
+            i = 0
+            while not done.is_set():
+                t0 = time.perf_counter()
+                (await client.get(f"/images/{study_id}/{i % args.slices + 1}.png")).raise_for_status()
+                slice_latency.append(time.perf_counter() - t0)
+                i += 1
+                await asyncio.sleep(args.interval)
+
+        async def exports() -> float:
+            t0 = time.perf_counter()
+            urls = [u.format(sid=study_id) for u in HEAVY] * args.rounds
+            for resp in await asyncio.gather(*(client.get(u) for u in urls)):
+                resp.raise_for_status()
+            return time.perf_counter() - t0
+
+        tasks = [asyncio.create_task(ticker()), asyncio.create_task(slice_reader())]
+        export_s = await exports()
+        done.set()
+        await asyncio.gather(*tasks)
+
+    return {
+        "exports": {"requests": len(HEAVY) * args.rounds, "seconds": export_s},
+        "loop_lag": _summary(lags),
+        "slice_latency": _summary(slice_latency),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Event-loop latency while heavy exports run")
+    parser.add_argument("--slices", type=int, default=64)
+    parser.add_argument("--rows", type=int, default=256)
+    parser.add_argument("--cols", type=int, default=256)
+    parser.add_argument("--rounds", type=int, default=2, help="Copies of each heavy export fired at once")
+    parser.add_argument("--interval", type=float, default=0.005, help="Ticker sleep in seconds")
+    parser.add_argument("--budget", type=float, default=0.1, help="Maximum tolerated loop lag in seconds")
+    parser.add_argument("--keep", action="store_true", help="Keep the temporary work directory")
+    args = parser.parse_args(argv)
+
+    work_dir = tempfile.mkdtemp(prefix="pdx_bench_loop_")
+    # Storage location is read at import time, so set it before importing the app
+    os.environ["PDX_STORAGE_DIR"] = os.path.join(work_dir, "storage")
+    try:
+        study_id = _prepare_study(work_dir, args.slices, args.rows, args.cols)
+        results = asyncio.run(_measure(study_id, args))
+    finally:
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    results["budget_s"] = args.budget
+    print(json.dumps(results, indent=2))
+    if results["loop_lag"]["max_s"] > args.budget:
+        print(f"FAIL: event loop blocked for {results['loop_lag']['max_s']:.3f}s (budget {args.budget}s)", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,63 @@
+"""
+Measure cold import time of the API and enforce a budget.
+
+Each run imports app.main in a fresh interpreter, so nothing is cached in-process.
+Fails (exit 1) when the median exceeds --budget seconds or when TensorFlow was imported,
+since inference modules must stay behind the lazy model registry:
+
+    cd backend
+    python -m benchmarks.import_time --budget 3.0
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from typing import List, Optional
+
+
+_PROBE = (
+    "import json, sys, time\n"
+    "t0 = time.perf_counter()\n"
+    "import app.main\n"
+    "print(json.dumps({'seconds': time.perf_counter() - t0, "
+    "'tensorflow_loaded': 'tensorflow' in sys.modules}))\n"
+)
+
+
+def measure(repeat: int) -> List[dict]:
+    runs = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, "-c", _PROBE], capture_output=True, text=True, check=True)
+        runs.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    return runs
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="API import-time budget check")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--budget", type=float, default=3.0, help="Maximum median import time in seconds")
+    args = parser.parse_args(argv)
+
+    runs = measure(args.repeat)
+    median_s = statistics.median(r["seconds"] for r in runs)
+    tf_loaded = any(r["tensorflow_loaded"] for r in runs)
+    print(json.dumps({
+        "import_app_main": {
+            "runs_s": [r["seconds"] for r in runs],
+            "median_s": median_s,
+            "budget_s": args.budget,
+            "tensorflow_loaded": tf_loaded,
+        }
+    }, indent=2))
+    if tf_loaded:
+        print("FAIL: importing app.main pulled in TensorFlow", file=sys.stderr)
+        return 1
+    if median_s > args.budget:
+        print(f"FAIL: median import time {median_s:.2f}s exceeds budget {args.budget:.2f}s", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,119 @@
+"""
+Model load times for each weights format.
+
+For the segmenter and classifier, times building the architecture and reading its weights
+from the original HDF5 file and from the converted flat copy (app.services.weights_cache):
+
+- cold: a fresh interpreter, with TensorFlow imported and the architecture module loaded
+  before the clock starts, so the time is graph construction plus reading the weights
+- warm: further loads in that same process, once functions and the file pages are cached
+
+The first flat load converts the HDF5 file; its time is reported as convert_s. Without
+--segmenter-weights/--classifier-weights, seeded stub weights are written to a temp dir:
+
+    cd backend
+    python -m benchmarks.model_load --repeat 3 --out model_load.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from typing import Any, Dict, List, Optional
+
+from benchmarks.stub_models import write_stub_weights
+
+
+def _probe(kind: str, weights_path: str, weights_format: str, cache_dir: str, warm: int) -> Dict[str, Any]:
+    # Runs in the child process
+    import time
+
+    import tensorflow as tf  # noqa: F401 - imported before timing
+
+    from app.services.weights_cache import load_weights
+
+    if kind == "segmenter":
+        from app.models.segmentation_model.architectures.r2udensenet import create_r2udensenet_model as create
+    else:
+        from app.models.classifier_model.architectures.resnet50 import create_resnet50_classifier as create
+
+    def _load() -> Dict[str, Any]:
+        t0 = time.perf_counter()
+        model = create()
+        t1 = time.perf_counter()
+        read = load_weights(model, kind, weights_path, weights_format=weights_format, cache_dir=cache_dir)
+        t2 = time.perf_counter()
+        return {"build_s": t1 - t0, "weights_s": t2 - t1, "total_s": t2 - t0, "read": read}
+
+    cold = _load()
+    return {"cold": cold, "warm": [_load() for _ in range(warm)]}
+
+
+def _run_child(kind: str, weights_path: str, weights_format: str, cache_dir: str, warm: int) -> Dict[str, Any]:
+    code = (
+        "import json\n"
+        "from benchmarks.model_load import _probe\n"
+        f"print(json.dumps(_probe({kind!r}, {weights_path!r}, {weights_format!r}, {cache_dir!r}, {warm})))\n"
+    )
+    env = {**os.environ, "TF_CPP_MIN_LOG_LEVEL": "3"}
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True, env=env)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def _summary(runs: List[Dict[str, Any]]) -> Dict[str, float]:
+    return {key: statistics.median(r[key] for r in runs) for key in ("build_s", "weights_s", "total_s")}
+
+
+def measure(kind: str, weights_path: str, cache_dir: str, repeat: int, warm: int) -> Dict[str, Any]:
+    out: Dict[str, Any] = {"weights_path": weights_path, "hdf5_mb": round(os.path.getsize(weights_path) / 2**20, 1)}
+    # Prime the conversion so every flat run below reads the converted copy
+    first = _run_child(kind, weights_path, "flat", cache_dir, 0)["cold"]
+    if first["read"] == "hdf5":
+        out["convert_s"] = first["total_s"]
+    for weights_format in ("hdf5", "flat"):
+        runs = [_run_child(kind, weights_path, weights_format, cache_dir, warm) for _ in range(repeat)]
+        read = {r["cold"]["read"] for r in runs}
+        if read != {weights_format}:
+            raise RuntimeError(f"{kind}: expected {weights_format} loads, got {sorted(read)}")
+        warm_runs = [w for r in runs for w in r["warm"]]
+        out[weights_format] = {
+            "cold": _summary([r["cold"] for r in runs]),
+            "warm": _summary(warm_runs) if warm_runs else None,
+        }
+    out["cold_speedup"] = out["hdf5"]["cold"]["weights_s"] / max(out["flat"]["cold"]["weights_s"], 1e-9)
+    return out
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Model load benchmark: HDF5 vs converted weights")
+    parser.add_argument("--segmenter-weights")
+    parser.add_argument("--classifier-weights")
+    parser.add_argument("--cache-dir", help="Converted weights directory (default: a temp dir)")
+    parser.add_argument("--repeat", type=int, default=3, help="Cold processes per format")
+    parser.add_argument("--warm", type=int, default=2, help="Warm loads per process")
+    parser.add_argument("--models", default="segmenter,classifier")
+    parser.add_argument("--out", help="Write results JSON here")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix="pdx-model-load-") as tmp:
+        weights = {"segmenter": args.segmenter_weights, "classifier": args.classifier_weights}
+        if not all(weights.values()):
+            seg, clf = write_stub_weights(os.path.join(tmp, "stub"))
+            weights = {"segmenter": weights["segmenter"] or seg, "classifier": weights["classifier"] or clf}
+        cache_dir = args.cache_dir or os.path.join(tmp, "converted")
+        results = {
+            kind: measure(kind, os.path.abspath(weights[kind]), cache_dir, args.repeat, args.warm)
+            for kind in (m.strip() for m in args.models.split(",") if m.strip())
+        }
+    text = json.dumps(results, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,307 @@
+"""
+Reproducible benchmark suite.
+
+Generates a synthetic DICOM series and random-weight stub models, then times the main
+pipeline stages in-process and through the FastAPI TestClient. Results are written as
+JSON so two runs can be compared:
+
+    cd backend
+    python -m benchmarks.run --slices 64 --rows 256 --cols 256 --out bench.json
+    python -m benchmarks.run --slices 64 --rows 256 --cols 256 --compare bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+
+EXPORTS = [
+    ("export_overlays_zip", "/export/{sid}/images.zip?kind=overlays"),
+    ("export_masks_zip", "/export/{sid}/images.zip?kind=masks"),
+    ("export_pngs_zip", "/export/{sid}/images.zip?kind=pngs"),
+    ("export_images_npz", "/export/{sid}/images.npz"),
+    ("export_masks_npz", "/export/{sid}/masks?format=npz"),
+    ("export_masks_mat", "/export/{sid}/masks?format=mat"),
+    ("export_volumes_xlsx", "/export/{sid}/volumes.xlsx"),
+]
+
+
+def _timed(fn: Callable[[], Any], repeat: int, setup: Optional[Callable[[], None]] = None) -> Dict[str, Any]:
+    runs: List[float] = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        t0 = time.perf_counter()
+        fn()
+        runs.append(time.perf_counter() - t0)
+    return {
+        "runs_s": runs,
+        "min_s": min(runs),
+        "median_s": statistics.median(runs),
+        "mean_s": statistics.fmean(runs),
+    }
+
+
+def _encode_benchmark(images: List[Any], fmt: str, params: Dict[str, Any], repeat: int) -> Dict[str, Any]:
+    import io
+
+    sizes: List[int] = []
+
+    def encode_all() -> None:
+        sizes.clear()
+        for img in images:
+            buf = io.BytesIO()
+            img.save(buf, format=fmt, **params)
+            sizes.append(buf.tell())
+
+    out = _timed(encode_all, repeat)
+    out["ms_per_slice"] = 1000.0 * out["median_s"] / max(1, len(images))
+    out["bytes_per_slice"] = statistics.fmean(sizes) if sizes else 0.0
+    return out
+
+
+def _clear_subdir(study_id: str, name: str) -> None:
+    from app.services.storage import get_study_subdir, study_store
+
+    path = get_study_subdir(study_id, name)
+    for f in os.listdir(path):
+        os.remove(os.path.join(path, f))
+    # Cached "all PNGs converted" state would otherwise skip the cold conversion
+    study_store.forget(study_id)
+
+
+def _git_commit() -> str:
+    try:
+        out = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True)
+        return out.stdout.strip()
+    except Exception:
+        return ""
+
+
+def run_benchmarks(args: argparse.Namespace, work_dir: str) -> Dict[str, Any]:
+    from benchmarks.synthetic import generate_series
+    from benchmarks.stub_models import write_stub_weights
+
+    series_dir = os.path.join(work_dir, "series")
+    generate_series(series_dir, args.slices, args.rows, args.cols, seed=args.seed)
+    seg_weights, clf_weights = write_stub_weights(os.path.join(work_dir, "weights"), seed=args.seed)
+    os.environ["PDX_SEGMENTATION_WEIGHTS"] = seg_weights
+    os.environ["PDX_CLASSIFIER_WEIGHTS"] = clf_weights
+
+    import numpy as np
+    from fastapi.testclient import TestClient
+    from PIL import Image
+
+    from app.main import app
+    from app.models.classifier_model.architectures.resnet50 import (
+        load_classifier_with_weights,
+        predict_tumor_scores,
+    )
+    from app.api.segment import _resize_for_classifier
+    from app.services.dicom import list_dicom_slices, read_slice_pixels
+    from app.services.pipeline import DECODE_WORKERS, Stage, prefetch
+    from app.services.images import ensure_png_slices, get_png_path
+    from app.services.overlay import overlay_mask_on_image
+    from app.services.preview import encoder_params
+    from app.services.segmentation import run_classify_then_segment
+    from app.services.storage import get_study_subdir, ingest_local_directory
+
+    results: Dict[str, Any] = {}
+    repeat = args.repeat
+    client = TestClient(app)
+
+    # Ingest
+    results["ingest"] = _timed(lambda: ingest_local_directory(series_dir), repeat)
+    results["api_ingest"] = _timed(
+        lambda: client.post("/files/ingest_local", json={"path": series_dir}).raise_for_status(), repeat
+    )
+    study_id, _ = ingest_local_directory(series_dir)
+
+    # PNG conversion (cold each run)
+    results["ensure_png_slices"] = _timed(
+        lambda: ensure_png_slices(study_id), repeat, setup=lambda: _clear_subdir(study_id, "png")
+    )
+
+    # Preview encoding per format, over every slice (encode only; decode excluded)
+    previews = [
+        Image.open(get_png_path(study_id, i)).convert('L') for i in range(1, len(ensure_png_slices(study_id)) + 1)
+    ]
+    encodings = [
+        ("encode_png_default", "PNG", {}),  # PIL default, compress_level=6
+        ("encode_png", "PNG", encoder_params("png")),
+        ("encode_webp_lossless", "WEBP", encoder_params("webp")),
+    ]
+    for name, fmt, params in encodings:
+        results[name] = _encode_benchmark(previews, fmt, params, repeat)
+
+    # Slice transfer through the API, negotiated by Accept
+    for name, accept in (("api_slices_png", "image/png"), ("api_slices_webp", "image/webp,image/*")):
+        sizes: List[int] = []
+
+        def fetch_slices(accept: str = accept, sizes: List[int] = sizes) -> None:
+            sizes.clear()
+            for i in range(1, len(previews) + 1):
+                resp = client.get(f"/images/{study_id}/{i}.png", headers={"Accept": accept})
+                resp.raise_for_status()
+                sizes.append(len(resp.content))
+
+        results[name] = _timed(fetch_slices, repeat)
+        results[name]["bytes_per_slice"] = statistics.fmean(sizes)
+
+    # DICOM decode, one frame at a time: serially and spread over the pipeline's decode workers
+    slices = list_dicom_slices(series_dir)
+    results["dicom_decode_serial"] = _timed(lambda: [read_slice_pixels(series_dir, s) for s in slices], repeat)
+
+    def decode_parallel() -> None:
+        with Stage("decode", DECODE_WORKERS) as decoder:
+            list(prefetch(decoder, lambda s: read_slice_pixels(series_dir, s), slices, ahead=2 * DECODE_WORKERS))
+
+    results["dicom_decode_parallel"] = _timed(decode_parallel, repeat)
+
+    # Classification over every slice
+    arrays = [read_slice_pixels(series_dir, s).astype(np.float32) for s in slices]
+    clf_model = load_classifier_with_weights(clf_weights)
+
+    def classify_all() -> None:
+        for start in range(0, len(arrays), args.batch_size):
+            batch = np.stack([_resize_for_classifier(a) for a in arrays[start:start + args.batch_size]])
+            predict_tumor_scores(clf_model, np.expand_dims(batch, axis=-1))
+
+    results["classification"] = _timed(classify_all, repeat)
+
+    # Segmentation of every slice (classifier forced positive so the workload is fixed)
+    results["segmentation"] = _timed(
+        lambda: run_classify_then_segment(
+            study_id=study_id,
+            classifier_predict_slice=lambda arr: True,
+            segmenter_weights_path=seg_weights,
+            cache=None,
+        ),
+        repeat,
+    )
+
+    # Overlay rendering
+    masks_dir = get_study_subdir(study_id, "masks")
+
+    def render_overlays() -> None:
+        for i in range(1, len(arrays) + 1):
+            base = np.array(Image.open(get_png_path(study_id, i)).convert('L'))
+            mask = np.array(Image.open(os.path.join(masks_dir, f"{i}.png")).convert('L')) > 127
+            overlay_mask_on_image(base, mask.astype(np.uint8), color_rgb=(0, 255, 0), alpha=0.4)
+
+    results["overlay_render"] = _timed(render_overlays, repeat)
+
+    # Full job through the API
+    def api_segment() -> None:
+        job_id = client.post(
+            "/segment/start", json={"study_id": study_id, "use_cache": False}
+        ).json()["job_id"]
+        while True:
+            status = client.get(f"/segment/{job_id}/status").json()["status"]
+            if status in ("done", "error"):
+                break
+            time.sleep(0.05)
+        if status != "done":
+            raise RuntimeError(f"segmentation job {job_id} failed")
+        api_segment.job_id = job_id  # type: ignore[attr-defined]
+
+    results["api_segment"] = _timed(api_segment, repeat)
+    job_id = api_segment.job_id  # type: ignore[attr-defined]
+
+    results["api_results"] = _timed(lambda: client.get(f"/results/{job_id}").raise_for_status(), repeat)
+
+    def api_overlays() -> None:
+        for i in range(1, len(arrays) + 1):
+            client.get(f"/images/{study_id}/{i}/overlay.png", params={"v": "bench"}).raise_for_status()
+
+    results["api_overlay_render"] = _timed(api_overlays, repeat)
+
+    for name, route in EXPORTS:
+        url = route.format(sid=study_id)
+        results[name] = _timed(lambda url=url: client.get(url).raise_for_status(), repeat)
+
+    return results
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> int:
+    """Print median ratios against a baseline; returns the number of regressions."""
+    regressions = 0
+    print(f"{'benchmark':<24}{'baseline_s':>12}{'current_s':>12}{'ratio':>8}")
+    for name, cur in current["results"].items():
+        base = baseline.get("results", {}).get(name)
+        if not base:
+            print(f"{name:<24}{'-':>12}{cur['median_s']:>12.4f}{'-':>8}")
+            continue
+        ratio = cur["median_s"] / base["median_s"] if base["median_s"] else float("inf")
+        flag = ""
+        if ratio > 1.0 + tolerance:
+            flag = "  REGRESSION"
+            regressions += 1
+        print(f"{name:<24}{base['median_s']:>12.4f}{cur['median_s']:>12.4f}{ratio:>8.2f}{flag}")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="PDX segmentation benchmark suite")
+    parser.add_argument("--slices", type=int, default=64)
+    parser.add_argument("--rows", type=int, default=256)
+    parser.add_argument("--cols", type=int, default=256)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=None, help="Write JSON results to this path")
+    parser.add_argument("--compare", default=None, help="Baseline JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Allowed slowdown ratio before flagging")
+    parser.add_argument("--keep", action="store_true", help="Keep the temporary work directory")
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)
+
+    work_dir = tempfile.mkdtemp(prefix="pdx_bench_")
+    # Must be set before app modules are imported (storage root is read at import time)
+    os.environ["PDX_STORAGE_DIR"] = os.path.join(work_dir, "storage")
+    try:
+        results = run_benchmarks(args, work_dir)
+    finally:
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "slices": args.slices,
+            "rows": args.rows,
+            "cols": args.cols,
+            "repeat": args.repeat,
+            "batch_size": args.batch_size,
+            "seed": args.seed,
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "git_commit": _git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if baseline is not None:
+        return 1 if compare(report, baseline, args.tolerance) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
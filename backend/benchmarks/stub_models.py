@@ -0,0 +1,24 @@
+import os
+from typing import Tuple
+
+
+def write_stub_weights(out_dir: str, seed: int = 0) -> Tuple[str, str]:
+    """
+    Build the real R2U-DenseNet and ResNet50 architectures with seeded random weights and
+    save them next to each other. Timings match the production models; outputs are noise.
+    Returns (segmenter_weights_path, classifier_weights_path).
+    """
+    import tensorflow as tf
+
+    from app.models.segmentation_model.architectures.r2udensenet import create_r2udensenet_model
+    from app.models.classifier_model.architectures.resnet50 import create_resnet50_classifier
+
+    os.makedirs(out_dir, exist_ok=True)
+    seg_path = os.path.join(out_dir, "model_r2udensenet.weights.h5")
+    clf_path = os.path.join(out_dir, "model_resnet50.weights.h5")
+    tf.keras.utils.set_random_seed(seed)
+    if not os.path.exists(seg_path):
+        create_r2udensenet_model().save_weights(seg_path)
+    if not os.path.exists(clf_path):
+        create_resnet50_classifier().save_weights(clf_path)
+    return seg_path, clf_path
@@ -0,0 +1,100 @@
+import os
+from typing import List
+
+import numpy as np
+import pydicom
+from pydicom.dataset import FileDataset, FileMetaDataset
+from pydicom.uid import ExplicitVRLittleEndian, MRImageStorage, generate_uid
+
+
+PYDICOM_MAJOR = int(pydicom.__version__.split(".")[0])
+
+
+def _synthetic_slice(
+    rng: np.random.Generator,
+    rows: int,
+    cols: int,
+    z: float,
+    tumor_center: tuple,
+    tumor_radius: float,
+) -> np.ndarray:
+    # Noisy background, an elliptical "body" and a spherical bright "tumor"
+    yy, xx = np.mgrid[0:rows, 0:cols].astype(np.float32)
+    img = rng.normal(100.0, 20.0, size=(rows, cols)).astype(np.float32)
+    body = ((yy - rows / 2) / (rows * 0.4)) ** 2 + ((xx - cols / 2) / (cols * 0.3)) ** 2 <= 1.0
+    img[body] += 700.0
+    cz, cy, cx = tumor_center
+    r2 = tumor_radius ** 2 - (z - cz) ** 2
+    if r2 > 0:
+        tumor = (yy - cy) ** 2 + (xx - cx) ** 2 <= r2
+        img[tumor] += 900.0
+    return np.clip(img, 0, 65535).astype(np.uint16)
+
+
+def generate_series(
+    out_dir: str,
+    num_slices: int = 64,
+    rows: int = 256,
+    cols: int = 256,
+    pixel_spacing_mm: float = 0.1,
+    slice_thickness_mm: float = 0.5,
+    tumor_fraction: float = 0.25,
+    seed: int = 0,
+) -> List[str]:
+    """
+    Write a deterministic single-frame MR series of num_slices x rows x cols uint16 slices.
+    The tumor spans roughly tumor_fraction of the slices around the middle of the series.
+    Returns the written file paths in slice order.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    study_uid = generate_uid(entropy_srcs=[f"study-{seed}"])
+    series_uid = generate_uid(entropy_srcs=[f"series-{seed}-{num_slices}-{rows}-{cols}"])
+    tumor_center = (num_slices / 2.0, rows * 0.55, cols * 0.5)
+    tumor_radius = max(1.0, num_slices * tumor_fraction / 2.0)
+
+    paths: List[str] = []
+    for i in range(num_slices):
+        pixels = _synthetic_slice(rng, rows, cols, float(i), tumor_center, tumor_radius)
+        sop_uid = generate_uid(entropy_srcs=[series_uid, str(i)])
+
+        file_meta = FileMetaDataset()
+        file_meta.MediaStorageSOPClassUID = MRImageStorage
+        file_meta.MediaStorageSOPInstanceUID = sop_uid
+        file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+
+        path = os.path.join(out_dir, f"slice_{i+1:04d}.dcm")
+        ds = FileDataset(path, {}, file_meta=file_meta, preamble=b"\0" * 128)
+        if PYDICOM_MAJOR < 3:
+            ds.is_little_endian = True
+            ds.is_implicit_VR = False
+        ds.SOPClassUID = MRImageStorage
+        ds.SOPInstanceUID = sop_uid
+        ds.StudyInstanceUID = study_uid
+        ds.SeriesInstanceUID = series_uid
+        ds.Modality = "MR"
+        ds.PatientID = f"SYNTH-{seed}"
+        ds.StudyDate = "20240101"
+        ds.StudyDescription = "Synthetic benchmark study"
+        ds.SeriesDescription = f"Synthetic {num_slices}x{rows}x{cols}"
+        ds.InstanceNumber = i + 1
+        ds.Rows = rows
+        ds.Columns = cols
+        ds.PixelSpacing = [pixel_spacing_mm, pixel_spacing_mm]
+        ds.SliceThickness = slice_thickness_mm
+        ds.SpacingBetweenSlices = slice_thickness_mm
+        ds.ImageOrientationPatient = [1, 0, 0, 0, 1, 0]
+        ds.ImagePositionPatient = [0.0, 0.0, round(i * slice_thickness_mm, 4)]
+        ds.SamplesPerPixel = 1
+        ds.PhotometricInterpretation = "MONOCHROME2"
+        ds.BitsAllocated = 16
+        ds.BitsStored = 16
+        ds.HighBit = 15
+        ds.PixelRepresentation = 0
+        ds.PixelData = pixels.tobytes()
+        if PYDICOM_MAJOR < 3:
+            ds.save_as(path, write_like_original=False)
+        else:
+            ds.save_as(path, enforce_file_format=True)
+        paths.append(path)
+    return paths